@@ -0,0 +1,196 @@
+"""Priority-aware admission control.
+
+Requests are sorted into route classes (checkout, lookups, heavy reads, ...)
+that share one concurrency budget per process. Each class may hold a number of
+reserved slots nobody else can take, may borrow from the shared remainder up to
+its own limit, and otherwise waits in a bounded FIFO queue. Freed slots go to
+the waiting classes in priority order. A request that finds its queue full, or
+waits longer than its class allows, is shed with 429 and a Retry-After hint.
+"""
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional
+
+from starlette.responses import JSONResponse
+
+import tracing
+
+
+class RouteClass:
+    def __init__(self, name: str, priority: int, limit: int, reserved: int = 0, queue: int = 0,
+                 timeout: float = 0.0):
+        self.name = name
+        # Lower numbers are served first when slots free up
+        self.priority = priority
+        self.limit = limit
+        self.reserved = min(reserved, limit)
+        self.queue = queue
+        self.timeout = timeout
+        self.active = 0
+        self.waiters: Deque[asyncio.Future] = deque()
+        # Moving average of how long an admitted request holds its slot
+        self.service_seconds = 0.1
+        self.admitted = 0
+        self.queued = 0
+        self.peak_queued = 0
+        self.wait_seconds = 0.0
+        self.shed = {"queue_full": 0, "timeout": 0}
+
+    @property
+    def borrowed(self) -> int:
+        return max(0, self.active - self.reserved)
+
+    def metrics(self) -> dict:
+        return {
+            "priority": self.priority,
+            "limit": self.limit,
+            "reserved": self.reserved,
+            "queue_limit": self.queue,
+            "active": self.active,
+            "queue_depth": len(self.waiters),
+            "peak_queue_depth": self.peak_queued,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "avg_wait_ms": round(self.wait_seconds / self.queued * 1000, 2) if self.queued else None,
+            "avg_service_ms": round(self.service_seconds * 1000, 2),
+            "shed": dict(self.shed)
+        }
+
+
+class AdmissionController:
+    """Hands out concurrency slots to route classes.
+
+    `capacity` is the total number of requests in flight at once; the part not
+    reserved by any class is shared. Everything runs on the event loop, so the
+    bookkeeping needs no locks.
+    """
+
+    SERVICE_SMOOTHING = 0.2
+
+    def __init__(self, capacity: int, classes: List[RouteClass]):
+        self.capacity = capacity
+        self.classes: Dict[str, RouteClass] = {route_class.name: route_class for route_class in classes}
+        self._by_priority = sorted(classes, key=lambda route_class: route_class.priority)
+        self.shared = max(0, capacity - sum(route_class.reserved for route_class in classes))
+
+    def _shared_in_use(self) -> int:
+        return sum(route_class.borrowed for route_class in self._by_priority)
+
+    def _can_admit(self, route_class: RouteClass) -> bool:
+        if route_class.active >= route_class.limit:
+            return False
+        return route_class.active < route_class.reserved or self._shared_in_use() < self.shared
+
+    def _retry_after(self, route_class: RouteClass) -> int:
+        # Roughly how long until the queue ahead of a new request drains
+        backlog = len(route_class.waiters) + route_class.active + 1
+        return max(1, math.ceil(route_class.service_seconds * backlog / max(route_class.limit, 1)))
+
+    async def acquire(self, route_class: RouteClass) -> Optional[int]:
+        """Wait for a slot. Returns None once admitted, or a Retry-After in seconds when shed."""
+        if route_class.active >= route_class.reserved:
+            # A free shared slot goes to higher priority classes' queues before a new arrival
+            self._dispatch(above=route_class.priority)
+        # Queued requests keep their turn, so only an empty queue lets one straight in
+        if not route_class.waiters and self._can_admit(route_class):
+            route_class.active += 1
+            route_class.admitted += 1
+            return None
+        if len(route_class.waiters) >= route_class.queue:
+            route_class.shed["queue_full"] += 1
+            return self._retry_after(route_class)
+
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        route_class.waiters.append(waiter)
+        route_class.queued += 1
+        route_class.peak_queued = max(route_class.peak_queued, len(route_class.waiters))
+        started = loop.time()
+        try:
+            # Shielded so a timeout leaves the future for the check below
+            await asyncio.wait_for(asyncio.shield(waiter), route_class.timeout)
+        except asyncio.TimeoutError:
+            if not waiter.done():
+                waiter.cancel()
+                route_class.waiters.remove(waiter)
+                route_class.wait_seconds += loop.time() - started
+                route_class.shed["timeout"] += 1
+                return self._retry_after(route_class)
+        except asyncio.CancelledError:
+            # The client went away; give back a slot granted in the meantime
+            if waiter.done() and not waiter.cancelled():
+                self.release(route_class)
+            else:
+                waiter.cancel()
+                route_class.waiters.remove(waiter)
+            raise
+        route_class.wait_seconds += loop.time() - started
+        route_class.admitted += 1
+        return None
+
+    def release(self, route_class: RouteClass, held_seconds: Optional[float] = None):
+        route_class.active -= 1
+        if held_seconds is not None:
+            route_class.service_seconds += self.SERVICE_SMOOTHING * (held_seconds - route_class.service_seconds)
+        self._dispatch()
+
+    def _dispatch(self, above: Optional[int] = None):
+        """Admit waiters in priority order; with `above`, only classes ranked ahead of that priority."""
+        for route_class in self._by_priority:
+            if above is not None and route_class.priority >= above:
+                break
+            while route_class.waiters and self._can_admit(route_class):
+                waiter = route_class.waiters.popleft()
+                route_class.active += 1
+                waiter.set_result(True)
+
+    def metrics(self) -> dict:
+        return {
+            "capacity": self.capacity,
+            "shared": self.shared,
+            "shared_in_use": self._shared_in_use(),
+            "classes": {route_class.name: route_class.metrics() for route_class in self._by_priority}
+        }
+
+
+class AdmissionMiddleware:
+    """Admits each request through the controller, or answers 429 when shed.
+
+    `classify(method, path, query_string)` names the request's route class;
+    None lets the request through unmetered (health checks, admin endpoints).
+    """
+
+    def __init__(self, app, controller: AdmissionController,
+                 classify: Callable[[str, str, bytes], Optional[str]]):
+        self.app = app
+        self.controller = controller
+        self.classify = classify
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        name = self.classify(scope["method"], scope["path"], scope["query_string"])
+        if name is None:
+            await self.app(scope, receive, send)
+            return
+
+        route_class = self.controller.classes[name]
+        with tracing.span("admission", "queue", route_class=name):
+            retry_after = await self.controller.acquire(route_class)
+        if retry_after is not None:
+            response = JSONResponse(
+                {"detail": f"Too many {name} requests in progress; retry shortly"},
+                status_code=429,
+                headers={"Retry-After": str(retry_after)}
+            )
+            await response(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(route_class, time.perf_counter() - started)
@@ -0,0 +1,300 @@
+"""Streaming backup and restore of the POS database.
+
+Each collection is written to a gzip-compressed NDJSON file (MongoDB extended
+JSON, so dates and ObjectIds survive the round trip) in fixed-size chunks, so
+memory stays bounded however large `sales` grows. Incremental backups only
+contain documents whose watermark field moved past the previous backup's;
+deletions are not captured and need the next full backup. The one deletion
+restore does make up for is the archive job's: a sale moved into a
+`sales_archive_YYYY_MM` collection after the base was taken is dropped from
+`sales` again, so it is not counted in both tiers.
+
+Usage (from the backend directory):
+
+    python backup.py backup [--incremental]
+    python backup.py list
+    python backup.py restore <backup-id> [--drop] [--workers 4]
+"""
+import asyncio
+import gzip
+import json
+import os
+import re
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import typer
+from bson import json_util
+from dotenv import load_dotenv
+from pymongo import ReplaceOne
+from pymongo.errors import BulkWriteError
+
+import storage
+
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+BACKUP_DIR = Path(os.environ.get('BACKUP_DIR', ROOT_DIR / 'backups'))
+BACKUP_CHUNK_SIZE = int(os.environ.get('BACKUP_CHUNK_SIZE', '1000'))
+
+# Collection -> field used as the incremental watermark
+BACKUP_COLLECTIONS = {
+    "medicines": "updated_at",
+    "sales": "sale_date",
+    "users": "created_at",
+    "shop_details": "updated_at",
+    "customers": "updated_at",
+    "sales_archive_months": "updated_at",
+    "purchases": "updated_at",
+    "supplier_totals": "last_received_at",
+}
+ARCHIVE_COLLECTION_PATTERN = re.compile(r'^sales_archive_\d{4}_\d{2}$')
+MANIFEST_NAME = "manifest.json"
+
+
+async def backup_collections(db) -> Dict[str, str]:
+    collections = dict(BACKUP_COLLECTIONS)
+    for name in await db.list_collection_names():
+        if ARCHIVE_COLLECTION_PATTERN.match(name):
+            collections[name] = "sale_date"
+    return collections
+
+
+def read_manifest(backup_path: Path) -> dict:
+    return json_util.loads((backup_path / MANIFEST_NAME).read_text())
+
+
+def list_backups(backup_dir: Path = BACKUP_DIR) -> List[dict]:
+    """Completed backups, oldest first."""
+    if not backup_dir.exists():
+        return []
+    manifests = [read_manifest(path) for path in backup_dir.iterdir() if (path / MANIFEST_NAME).exists()]
+    return sorted(manifests, key=lambda manifest: manifest["created_at"])
+
+
+async def _dump_collection(collection, path: Path, query: dict, watermark_field: str) -> dict:
+    documents = 0
+    watermark = None
+    lines: List[str] = []
+    with gzip.open(path, "wt", encoding="utf-8", compresslevel=6) as output:
+        async for document in collection.find(query).batch_size(BACKUP_CHUNK_SIZE):
+            value = document.get(watermark_field)
+            if value is not None and (watermark is None or value > watermark):
+                watermark = value
+            lines.append(json_util.dumps(document, json_options=json_util.RELAXED_JSON_OPTIONS))
+            documents += 1
+            if len(lines) >= BACKUP_CHUNK_SIZE:
+                chunk = "\n".join(lines) + "\n"
+                lines = []
+                # Compression and disk writes happen off the event loop
+                await asyncio.to_thread(output.write, chunk)
+        if lines:
+            await asyncio.to_thread(output.write, "\n".join(lines) + "\n")
+    return {"documents": documents, "watermark_field": watermark_field, "watermark": watermark}
+
+
+async def run_backup(db, incremental: bool = False, backup_dir: Path = BACKUP_DIR) -> dict:
+    previous = list_backups(backup_dir)
+    base = previous[-1] if incremental and previous else None
+    created_at = datetime.utcnow()
+    mode = "incremental" if base else "full"
+    backup_id = f"{created_at.strftime('%Y%m%dT%H%M%S')}-{mode}"
+    # Written under a temporary name so a crashed backup is never picked up as a base
+    work_path = backup_dir / f".{backup_id}"
+    work_path.mkdir(parents=True, exist_ok=True)
+
+    manifest = {
+        "id": backup_id,
+        "mode": mode,
+        "base": base["id"] if base else None,
+        "created_at": created_at,
+        "collections": {},
+    }
+    for name, watermark_field in (await backup_collections(db)).items():
+        query = {}
+        since = base["collections"].get(name, {}).get("watermark") if base else None
+        if since is not None:
+            query = {watermark_field: {"$gt": since}}
+        result = await _dump_collection(db[name], work_path / f"{name}.ndjson.gz", query, watermark_field)
+        # Keep the previous watermark when nothing new arrived
+        if result["watermark"] is None:
+            result["watermark"] = since
+        manifest["collections"][name] = result
+
+    manifest["finished_at"] = datetime.utcnow()
+    (work_path / MANIFEST_NAME).write_text(json_util.dumps(manifest, indent=2))
+    work_path.rename(backup_dir / backup_id)
+    return manifest
+
+
+def _restore_chain(backup_id: str, backup_dir: Path) -> List[dict]:
+    """The full backup and every incremental needed to reach `backup_id`, oldest first."""
+    chain = []
+    current: Optional[str] = backup_id
+    while current:
+        path = backup_dir / current
+        if not (path / MANIFEST_NAME).exists():
+            raise FileNotFoundError(f"Backup {current} not found in {backup_dir}")
+        manifest = read_manifest(path)
+        chain.append(manifest)
+        current = manifest["base"]
+    return list(reversed(chain))
+
+
+def _read_chunks(path: Path):
+    with gzip.open(path, "rt", encoding="utf-8") as source:
+        chunk = []
+        for line in source:
+            if line.strip():
+                chunk.append(line)
+            if len(chunk) >= BACKUP_CHUNK_SIZE:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+async def _write_batch(collection, lines: List[str], upsert: bool):
+    documents = await asyncio.to_thread(lambda: [json_util.loads(line) for line in lines])
+    if upsert:
+        await collection.bulk_write(
+            [ReplaceOne({"_id": document["_id"]}, document, upsert=True) for document in documents],
+            ordered=False
+        )
+        return
+    try:
+        await collection.insert_many(documents, ordered=False)
+    except BulkWriteError as e:
+        # Documents already present (e.g. a resumed restore) are fine
+        if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+            raise
+
+
+async def _restore_collection(collection, path: Path, upsert: bool, workers: int) -> int:
+    chunks = _read_chunks(path)
+    pending = set()
+    restored = 0
+    while True:
+        # Only read the next chunk once a writer is free, which bounds memory
+        if len(pending) >= workers:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()
+        lines = await asyncio.to_thread(next, chunks, None)
+        if lines is None:
+            break
+        pending.add(asyncio.create_task(_write_batch(collection, lines, upsert)))
+        restored += len(lines)
+    if pending:
+        await asyncio.gather(*pending)
+    return restored
+
+
+async def _drop_archived_sales(db, archive_names: List[str]) -> int:
+    """Remove `sales` documents that also exist in an archive collection.
+
+    The archive job keeps the original _id, so these are sales the base still
+    had in the hot tier and a later incremental picked up in their archive month.
+    """
+    removed = 0
+    for name in sorted(archive_names):
+        ids = []
+        async for document in db[name].find({}, {"_id": 1}).batch_size(BACKUP_CHUNK_SIZE):
+            ids.append(document["_id"])
+            if len(ids) >= BACKUP_CHUNK_SIZE:
+                removed += (await db.sales.delete_many({"_id": {"$in": ids}})).deleted_count
+                ids = []
+        if ids:
+            removed += (await db.sales.delete_many({"_id": {"$in": ids}})).deleted_count
+    return removed
+
+
+async def _rebuild_inventory_counters(db) -> int:
+    inventory = storage.MongoInventoryRepository(db)
+    store_ids = await db.medicines.distinct("store_id")
+    for store_id in store_ids:
+        await inventory.replace(store_id, await inventory.recompute(store_id))
+    return len(store_ids)
+
+
+async def run_restore(db, backup_id: str, drop: bool = False, workers: int = 4,
+                      backup_dir: Path = BACKUP_DIR) -> dict:
+    chain = _restore_chain(backup_id, backup_dir)
+    restored: Dict[str, int] = {}
+    if drop:
+        for name in set().union(*(manifest["collections"] for manifest in chain)):
+            await db.drop_collection(name)
+    for manifest in chain:
+        # The base is bulk inserted; incrementals replace updated documents by _id
+        upsert = manifest["mode"] == "incremental"
+        for name in manifest["collections"]:
+            path = backup_dir / manifest["id"] / f"{name}.ndjson.gz"
+            count = await _restore_collection(db[name], path, upsert, workers)
+            restored[name] = restored.get(name, 0) + count
+    archived = await _drop_archived_sales(db, [name for name in restored if ARCHIVE_COLLECTION_PATTERN.match(name)])
+    # Last, so the counters match the medicines exactly as restored
+    stores = await _rebuild_inventory_counters(db)
+    return {
+        "backup_id": backup_id,
+        "applied": [manifest["id"] for manifest in chain],
+        "documents": restored,
+        "archived_duplicates": archived,
+        "inventory_counters_rebuilt": stores,
+    }
+
+
+cli = typer.Typer(help="Backup and restore the Medicine POS database.")
+
+
+def _connect():
+    from motor.motor_asyncio import AsyncIOMotorClient
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    return client, client[os.environ['DB_NAME']]
+
+
+def _run(coroutine_factory):
+    async def runner():
+        client, db = _connect()
+        try:
+            return await coroutine_factory(db)
+        finally:
+            client.close()
+    return asyncio.run(runner())
+
+
+@cli.command()
+def backup(
+    incremental: bool = typer.Option(False, help="Only documents changed since the latest backup"),
+    backup_dir: Path = typer.Option(BACKUP_DIR, help="Directory holding backups"),
+):
+    """Write a compressed snapshot of every collection."""
+    manifest = _run(lambda db: run_backup(db, incremental=incremental, backup_dir=backup_dir))
+    typer.echo(f"Backup {manifest['id']} written")
+    for name, info in manifest["collections"].items():
+        typer.echo(f"  {name}: {info['documents']} documents")
+
+
+@cli.command("list")
+def list_command(backup_dir: Path = typer.Option(BACKUP_DIR, help="Directory holding backups")):
+    """List completed backups."""
+    for manifest in list_backups(backup_dir):
+        documents = sum(info["documents"] for info in manifest["collections"].values())
+        typer.echo(f"{manifest['id']}\t{manifest['mode']}\tbase={manifest['base'] or '-'}\t{documents} documents")
+
+
+@cli.command()
+def restore(
+    backup_id: str = typer.Argument(..., help="Backup to restore; its base chain is applied first"),
+    drop: bool = typer.Option(False, help="Drop the backed up collections before restoring"),
+    workers: int = typer.Option(4, help="Concurrent insert batches"),
+    backup_dir: Path = typer.Option(BACKUP_DIR, help="Directory holding backups"),
+):
+    """Restore a backup, applying its full base and incrementals in order."""
+    result = _run(lambda db: run_restore(db, backup_id, drop=drop, workers=workers, backup_dir=backup_dir))
+    typer.echo(json.dumps(result["documents"], indent=2))
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,211 @@
+"""Receipt and Z-report rendering.
+
+These functions run in a worker process pool, so they only take and return
+plain, picklable data and never touch the database.
+"""
+import csv
+import io
+from datetime import datetime, timezone, tzinfo
+from html import escape
+from typing import List, Optional
+
+
+def gst_breakup(amount: float, gst_rate: float) -> dict:
+    """Split a GST-inclusive amount into taxable value and CGST/SGST halves."""
+    taxable = amount / (1 + gst_rate) if gst_rate else amount
+    tax = amount - taxable
+    return {
+        "taxable_value": round(taxable, 2),
+        "cgst": round(tax / 2, 2),
+        "sgst": round(tax / 2, 2),
+        "total_tax": round(tax, 2),
+        "gross": round(amount, 2),
+    }
+
+
+def _format_datetime(value, zone: Optional[tzinfo] = None) -> str:
+    """A naive UTC timestamp as wall-clock time in `zone` (None is the host's local time)."""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return value
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(zone).strftime("%d-%m-%Y %H:%M")
+
+
+def _shop_lines(shop: Optional[dict]) -> List[str]:
+    if not shop:
+        return []
+    lines = [shop["name"], shop["address"], f"Phone: {shop['phone']}"]
+    if shop.get("gst_number"):
+        lines.append(f"GSTIN: {shop['gst_number']}")
+    lines.append(f"DL No: {shop['license_number']}")
+    return lines
+
+
+def render_receipt(sale: dict, shop: Optional[dict], fmt: str, gst_rate: float,
+                   zone: Optional[tzinfo] = None) -> str:
+    gst = gst_breakup(sale["total_amount"], gst_rate)
+    # sale_date is stored in UTC; the invoice shows the shop's wall-clock time
+    if fmt == "text":
+        return _render_receipt_text(sale, shop, gst, gst_rate, zone)
+    return _render_receipt_html(sale, shop, gst, gst_rate, zone)
+
+
+def _render_receipt_text(sale: dict, shop: Optional[dict], gst: dict, gst_rate: float,
+                         zone: Optional[tzinfo] = None, width: int = 40) -> str:
+    rule = "-" * width
+    lines = [line.center(width) for line in _shop_lines(shop)]
+    lines += [
+        "TAX INVOICE".center(width),
+        rule,
+        f"Receipt: {sale['receipt_number']}",
+        f"Date: {_format_datetime(sale['sale_date'], zone)}",
+    ]
+    if sale.get("customer_name"):
+        lines.append(f"Customer: {sale['customer_name']}")
+    if sale.get("customer_phone"):
+        lines.append(f"Phone: {sale['customer_phone']}")
+    lines += [rule, f"{'Item':<20}{'Qty':>5}{'Rate':>7}{'Amount':>8}", rule]
+    for item in sale["items"]:
+        lines.append(
+            f"{item['medicine_name'][:20]:<20}{item['quantity']:>5}{item['price']:>7.2f}{item['total']:>8.2f}"
+        )
+    lines += [
+        rule,
+        f"{'Taxable value':<30}{gst['taxable_value']:>10.2f}",
+        f"{f'CGST @ {gst_rate * 50:g}%':<30}{gst['cgst']:>10.2f}",
+        f"{f'SGST @ {gst_rate * 50:g}%':<30}{gst['sgst']:>10.2f}",
+        f"{'TOTAL':<30}{sale['total_amount']:>10.2f}",
+        f"Paid by {sale['payment_method'].upper()}",
+        rule,
+        "Thank you! Get well soon.".center(width),
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def _render_receipt_html(sale: dict, shop: Optional[dict], gst: dict, gst_rate: float,
+                         zone: Optional[tzinfo] = None) -> str:
+    header = "".join(f"<div>{escape(line)}</div>" for line in _shop_lines(shop))
+    customer = ""
+    if sale.get("customer_name") or sale.get("customer_phone"):
+        customer = (
+            f"<div>Customer: {escape(sale.get('customer_name') or '')} "
+            f"{escape(sale.get('customer_phone') or '')}</div>"
+        )
+    rows = "".join(
+        f"<tr><td>{escape(item['medicine_name'])}</td><td class='num'>{item['quantity']}</td>"
+        f"<td class='num'>{item['price']:.2f}</td><td class='num'>{item['total']:.2f}</td></tr>"
+        for item in sale["items"]
+    )
+    half_rate = f"{gst_rate * 50:g}%"
+    return f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Receipt {escape(sale['receipt_number'])}</title>
+<style>
+body {{ font-family: monospace; width: 80mm; margin: 0 auto; }}
+.center {{ text-align: center; }} table {{ width: 100%; border-collapse: collapse; }}
+th, td {{ padding: 2px 0; }} .num {{ text-align: right; }} tfoot td {{ border-top: 1px dashed #000; }}
+@media print {{ @page {{ margin: 0; }} }}
+</style></head>
+<body>
+<div class="center"><strong>{header}</strong><div>TAX INVOICE</div></div>
+<hr>
+<div>Receipt: {escape(sale['receipt_number'])}</div>
+<div>Date: {escape(_format_datetime(sale['sale_date'], zone))}</div>
+{customer}
+<table>
+<thead><tr><th align="left">Item</th><th class="num">Qty</th><th class="num">Rate</th><th class="num">Amount</th></tr></thead>
+<tbody>{rows}</tbody>
+<tfoot>
+<tr><td colspan="3">Taxable value</td><td class="num">{gst['taxable_value']:.2f}</td></tr>
+<tr><td colspan="3">CGST @ {half_rate}</td><td class="num">{gst['cgst']:.2f}</td></tr>
+<tr><td colspan="3">SGST @ {half_rate}</td><td class="num">{gst['sgst']:.2f}</td></tr>
+<tr><td colspan="3"><strong>TOTAL</strong></td><td class="num"><strong>{sale['total_amount']:.2f}</strong></td></tr>
+</tfoot>
+</table>
+<div>Paid by {escape(sale['payment_method'].upper())}</div>
+<hr><div class="center">Thank you! Get well soon.</div>
+</body></html>
+"""
+
+
+def render_z_report(report: dict, shop: Optional[dict], fmt: str, gst_rate: float) -> str:
+    gst = gst_breakup(report["total_sales"], gst_rate)
+    if fmt == "csv":
+        return _render_z_report_csv(report, shop, gst)
+    return _render_z_report_html(report, shop, gst, gst_rate)
+
+
+def _render_z_report_csv(report: dict, shop: Optional[dict], gst: dict) -> str:
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(["Z-Report", report["report_date"]])
+    if shop:
+        writer.writerow(["Shop", shop["name"]])
+        writer.writerow(["GSTIN", shop.get("gst_number") or ""])
+    writer.writerow(["Store", report["store_id"]])
+    writer.writerow(["Generated at", report["generated_at"]])
+    writer.writerow([])
+    writer.writerow(["Transactions", report["total_transactions"]])
+    writer.writerow(["First receipt", report["first_receipt"] or ""])
+    writer.writerow(["Last receipt", report["last_receipt"] or ""])
+    writer.writerow([])
+    writer.writerow(["Payment method", "Transactions", "Amount"])
+    for payment in report["payments"]:
+        writer.writerow([payment["payment_method"], payment["transactions"], f"{payment['total']:.2f}"])
+    writer.writerow([])
+    writer.writerow(["GST summary", "Amount"])
+    for label, key in [("Taxable value", "taxable_value"), ("CGST", "cgst"), ("SGST", "sgst"),
+                       ("Total tax", "total_tax"), ("Gross sales", "gross")]:
+        writer.writerow([label, f"{gst[key]:.2f}"])
+    writer.writerow([])
+    writer.writerow(["Medicine ID", "Medicine", "Quantity", "Amount"])
+    for item in report["items"]:
+        writer.writerow([item["medicine_id"], item["medicine_name"], item["quantity"], f"{item['total']:.2f}"])
+    return output.getvalue()
+
+
+def _render_z_report_html(report: dict, shop: Optional[dict], gst: dict, gst_rate: float) -> str:
+    header = "".join(f"<div>{escape(line)}</div>" for line in _shop_lines(shop))
+    payments = "".join(
+        f"<tr><td>{escape(payment['payment_method'].upper())}</td><td class='num'>{payment['transactions']}</td>"
+        f"<td class='num'>{payment['total']:.2f}</td></tr>"
+        for payment in report["payments"]
+    )
+    items = "".join(
+        f"<tr><td>{escape(item['medicine_name'])}</td><td class='num'>{item['quantity']}</td>"
+        f"<td class='num'>{item['total']:.2f}</td></tr>"
+        for item in report["items"]
+    )
+    half_rate = f"{gst_rate * 50:g}%"
+    return f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Z-Report {escape(report['report_date'])}</title>
+<style>
+body {{ font-family: sans-serif; max-width: 720px; margin: 0 auto; }}
+table {{ width: 100%; border-collapse: collapse; margin-bottom: 16px; }}
+th, td {{ border-bottom: 1px solid #ccc; padding: 4px; text-align: left; }} .num {{ text-align: right; }}
+</style></head>
+<body>
+<header>{header}</header>
+<h1>Z-Report &mdash; {escape(report['report_date'])}</h1>
+<p>Store {escape(report['store_id'])} &middot; {report['total_transactions']} transactions
+&middot; receipts {escape(report['first_receipt'] or '-')} to {escape(report['last_receipt'] or '-')}</p>
+<h2>Payments</h2>
+<table><thead><tr><th>Method</th><th class="num">Transactions</th><th class="num">Amount</th></tr></thead>
+<tbody>{payments}</tbody></table>
+<h2>GST summary</h2>
+<table>
+<tr><td>Taxable value</td><td class="num">{gst['taxable_value']:.2f}</td></tr>
+<tr><td>CGST @ {half_rate}</td><td class="num">{gst['cgst']:.2f}</td></tr>
+<tr><td>SGST @ {half_rate}</td><td class="num">{gst['sgst']:.2f}</td></tr>
+<tr><td>Total tax</td><td class="num">{gst['total_tax']:.2f}</td></tr>
+<tr><td><strong>Gross sales</strong></td><td class="num"><strong>{gst['gross']:.2f}</strong></td></tr>
+</table>
+<h2>Items sold</h2>
+<table><thead><tr><th>Medicine</th><th class="num">Quantity</th><th class="num">Amount</th></tr></thead>
+<tbody>{items}</tbody></table>
+<footer>Generated {escape(str(report['generated_at']))}</footer>
+</body></html>
+"""
@@ -0,0 +1,315 @@
+import asyncio
+import logging
+import os
+import random
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta, timezone, tzinfo
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+from pymongo.errors import DuplicateKeyError
+
+
+logger = logging.getLogger(__name__)
+
+JobFunc = Callable[[], Awaitable[object]]
+
+
+class CronSchedule:
+    """Five-field cron expression (minute hour day-of-month month day-of-week).
+
+    Supports `*`, `*/n`, `a-b`, `a-b/n` and comma separated lists. Day-of-week
+    uses 0 (or 7) for Sunday.
+    """
+
+    _RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+
+    def __init__(self, expression: str):
+        parts = expression.split()
+        if len(parts) != 5:
+            raise ValueError(f"Invalid cron expression: {expression!r}")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, self.weekdays = [
+            self._parse_field(part, low, high) for part, (low, high) in zip(parts, self._RANGES)
+        ]
+        self._any_day = parts[2] == "*"
+        self._any_weekday = parts[4] == "*"
+
+    @staticmethod
+    def _parse_field(field: str, low: int, high: int) -> Set[int]:
+        values: Set[int] = set()
+        for chunk in field.split(","):
+            step = 1
+            if "/" in chunk:
+                chunk, step_text = chunk.split("/", 1)
+                step = int(step_text)
+            if chunk == "*":
+                start, end = low, high
+            elif "-" in chunk:
+                start_text, end_text = chunk.split("-", 1)
+                start, end = int(start_text), int(end_text)
+            else:
+                start = end = int(chunk)
+            if start < low or end > high or start > end:
+                raise ValueError(f"Invalid cron field: {field!r}")
+            values.update(range(start, end + 1, step))
+        if high == 7 and 7 in values:
+            # 7 is an alias for Sunday
+            values.discard(7)
+            values.add(0)
+        return values
+
+    def _day_matches(self, moment: datetime) -> bool:
+        day_ok = moment.day in self.days
+        # Python: Monday=0, cron: Sunday=0
+        weekday_ok = (moment.weekday() + 1) % 7 in self.weekdays
+        if self._any_day:
+            return weekday_ok
+        if self._any_weekday:
+            return day_ok
+        return day_ok or weekday_ok
+
+    def next_after(self, moment: datetime) -> datetime:
+        candidate = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        # Four years covers every valid day/month combination (e.g. Feb 29)
+        limit = candidate + timedelta(days=366 * 4)
+        while candidate < limit:
+            if candidate.month not in self.months or not self._day_matches(candidate):
+                candidate = (candidate + timedelta(days=1)).replace(hour=0, minute=0)
+                continue
+            if candidate.hour not in self.hours:
+                candidate = (candidate + timedelta(hours=1)).replace(minute=0)
+                continue
+            if candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+                continue
+            return candidate
+        raise ValueError(f"Cron expression never fires: {self.expression!r}")
+
+
+class Job:
+    def __init__(
+        self,
+        name: str,
+        func: JobFunc,
+        interval: Optional[float] = None,
+        cron: Optional[str] = None,
+        jitter: float = 0.0,
+        exclusive: bool = True,
+        lease_seconds: Optional[float] = None,
+        run_on_start: bool = False,
+        enabled: bool = True,
+        timezone: Optional[tzinfo] = None,
+    ):
+        if (interval is None) == (cron is None):
+            raise ValueError("Job needs exactly one of interval or cron")
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.cron = CronSchedule(cron) if cron else None
+        self.jitter = jitter
+        # Exclusive jobs run on a single worker at a time, guarded by a Mongo lease
+        self.exclusive = exclusive
+        self.lease_seconds = lease_seconds or max(interval or 0, 300)
+        self.run_on_start = run_on_start
+        # Disabled jobs stay registered (and visible in metrics) but never run
+        self.enabled = enabled
+        # Cron fields are wall-clock times in this zone; None is the host's local time
+        self.timezone = timezone
+
+        self.next_run: Optional[datetime] = None
+        # The un-jittered cron fire time behind next_run; workers agree on it, so
+        # it identifies the slot in the lease and each slot runs once
+        self.next_slot: Optional[datetime] = None
+        self.running = False
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+        self.last_started: Optional[datetime] = None
+        self.last_duration: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.last_result: object = None
+        self.total_duration = 0.0
+
+    def compute_next_run(self, now: datetime) -> Optional[datetime]:
+        if not self.enabled:
+            return None
+        if self.cron:
+            next_run = self.next_slot = self._to_utc(self.cron.next_after(self._to_local(now)))
+        else:
+            next_run = now + timedelta(seconds=self.interval)
+        if self.jitter:
+            next_run += timedelta(seconds=random.uniform(0, self.jitter))
+        return next_run
+
+    def _to_local(self, moment: datetime) -> datetime:
+        """Naive UTC -> naive wall-clock time in the job's timezone."""
+        aware = moment.replace(tzinfo=timezone.utc)
+        return (aware.astimezone(self.timezone) if self.timezone else aware.astimezone()).replace(tzinfo=None)
+
+    def _to_utc(self, moment: datetime) -> datetime:
+        # astimezone() reads a naive datetime as host local time
+        local = moment.replace(tzinfo=self.timezone) if self.timezone else moment
+        return local.astimezone(timezone.utc).replace(tzinfo=None)
+
+    def metrics(self) -> dict:
+        return {
+            "name": self.name,
+            "schedule": self.cron.expression if self.cron else f"every {self.interval:g}s",
+            "timezone": str(self.timezone or "local") if self.cron else None,
+            "jitter": self.jitter,
+            "exclusive": self.exclusive,
+            "enabled": self.enabled,
+            "running": self.running,
+            "runs": self.runs,
+            "failures": self.failures,
+            "skipped": self.skipped,
+            "last_started": self.last_started,
+            "last_duration": round(self.last_duration, 4) if self.last_duration is not None else None,
+            "avg_duration": round(self.total_duration / self.runs, 4) if self.runs else None,
+            "last_error": self.last_error,
+            "last_result": self.last_result,
+            "next_run": self.next_run,
+        }
+
+
+class Scheduler:
+    """Runs periodic maintenance jobs inside the app process.
+
+    Exclusive jobs take a lease document in `lease_collection` before running so
+    that only one worker across all processes executes a given job at a time.
+    For cron jobs the lease also records the slot (scheduled fire time) it ran,
+    so a worker whose jittered start comes after another worker finished that
+    slot skips it instead of running it again.
+    """
+
+    def __init__(self, lease_collection=None, tick_seconds: float = 1.0, timezone: Optional[tzinfo] = None):
+        self.lease_collection = lease_collection
+        self.tick_seconds = tick_seconds
+        # Default zone for cron jobs; next_run and every other timestamp stay in UTC
+        self.timezone = timezone
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.jobs: Dict[str, Job] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._running_tasks: Set[asyncio.Task] = set()
+
+    def add_job(self, name: str, func: JobFunc, **options) -> Job:
+        if name in self.jobs:
+            raise ValueError(f"Job {name!r} is already registered")
+        options.setdefault("timezone", self.timezone)
+        job = Job(name, func, **options)
+        self.jobs[name] = job
+        if self._task:
+            now = datetime.utcnow()
+            job.next_run = now if job.run_on_start and job.enabled else job.compute_next_run(now)
+        return job
+
+    def job(self, name: str, **options):
+        """Decorator form of `add_job`."""
+        def decorator(func: JobFunc) -> JobFunc:
+            self.add_job(name, func, **options)
+            return func
+        return decorator
+
+    async def start(self):
+        if self._task:
+            return
+        now = datetime.utcnow()
+        for job in self.jobs.values():
+            job.next_run = now if job.run_on_start and job.enabled else job.compute_next_run(now)
+        self._task = asyncio.create_task(self._loop())
+        logger.info("Scheduler started with %d job(s) as %s", len(self.jobs), self.owner)
+
+    async def stop(self):
+        if not self._task:
+            return
+        self._task.cancel()
+        for task in list(self._running_tasks):
+            task.cancel()
+        await asyncio.gather(self._task, *self._running_tasks, return_exceptions=True)
+        self._task = None
+
+    async def _loop(self):
+        while True:
+            now = datetime.utcnow()
+            for job in self.jobs.values():
+                if job.next_run and job.next_run <= now and not job.running:
+                    slot = job.next_slot
+                    job.next_run = job.compute_next_run(now)
+                    self._spawn(job, slot)
+            await asyncio.sleep(self.tick_seconds)
+
+    def _spawn(self, job: Job, slot: Optional[datetime] = None) -> asyncio.Task:
+        task = asyncio.create_task(self._run(job, slot))
+        self._running_tasks.add(task)
+        task.add_done_callback(self._running_tasks.discard)
+        return task
+
+    async def trigger(self, name: str) -> dict:
+        """Run a job immediately and wait for it to finish."""
+        job = self.jobs.get(name)
+        if job is None:
+            raise KeyError(name)
+        if not job.enabled:
+            return {"name": name, "status": "disabled"}
+        if job.running:
+            return {"name": name, "status": "already_running"}
+        status = await self._spawn(job)
+        return {**job.metrics(), "status": status}
+
+    async def _acquire_lease(self, job: Job, slot: Optional[datetime] = None) -> bool:
+        if not job.exclusive or self.lease_collection is None:
+            return True
+        now = datetime.utcnow()
+        conditions = [{"$or": [{"lease_until": {"$lte": now}}, {"owner": self.owner}]}]
+        lease = {"owner": self.owner, "lease_until": now + timedelta(seconds=job.lease_seconds), "acquired_at": now}
+        if slot is not None:
+            conditions.append({"$or": [{"slot": {"$exists": False}}, {"slot": {"$lt": slot}}]})
+            lease["slot"] = slot
+        try:
+            await self.lease_collection.find_one_and_update(
+                {"_id": job.name, "$and": conditions}, {"$set": lease}, upsert=True
+            )
+        except DuplicateKeyError:
+            # Another worker holds an unexpired lease, or already ran this slot
+            return False
+        return True
+
+    async def _release_lease(self, job: Job):
+        if not job.exclusive or self.lease_collection is None:
+            return
+        await self.lease_collection.update_one(
+            {"_id": job.name, "owner": self.owner},
+            {"$set": {"lease_until": datetime.utcnow(), "last_finished": datetime.utcnow()}},
+        )
+
+    async def _run(self, job: Job, slot: Optional[datetime] = None) -> str:
+        job.running = True
+        try:
+            if not await self._acquire_lease(job, slot):
+                job.skipped += 1
+                return "skipped"
+            job.last_started = datetime.utcnow()
+            started = time.perf_counter()
+            try:
+                job.last_result = await job.func()
+                job.last_error = None
+                return "completed"
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                job.failures += 1
+                job.last_error = f"{type(e).__name__}: {e}"
+                logger.exception("Scheduled job %s failed", job.name)
+                return "failed"
+            finally:
+                job.last_duration = time.perf_counter() - started
+                job.total_duration += job.last_duration
+                job.runs += 1
+                await self._release_lease(job)
+        finally:
+            job.running = False
+
+    def metrics(self) -> List[dict]:
+        return [job.metrics() for job in self.jobs.values()]
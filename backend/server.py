@@ -1,30 +1,213 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Query
+from fastapi import FastAPI, APIRouter, Depends, Header, HTTPException, Query, Response
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.datastructures import Headers, MutableHeaders
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import BulkWriteError
+import asyncio
+import gzip
+import multiprocessing
 import os
+import re
 import logging
+import time
+from collections import OrderedDict
+from functools import wraps
+from urllib.parse import parse_qsl
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Optional
+from pydantic import BaseModel, Field, create_model
+from typing import Dict, List, Optional, Set, Tuple
 import uuid
-from datetime import datetime, date
+from datetime import datetime, date, timedelta, timezone
 from enum import Enum
+from zoneinfo import ZoneInfo
+
+import admission
+import backup
+import reports
+import snapshot
+import storage
+import tracing
+from scheduler import Scheduler
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
 
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# Storage backend: MongoDB for multi-store deployments, or an embedded SQLite
+# file for single-shop edge installs
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'mongo').lower()
+USE_MONGO = STORAGE_BACKEND == 'mongo'
+if USE_MONGO:
+    mongo_url = os.environ['MONGO_URL']
+    client = AsyncIOMotorClient(mongo_url)
+    db = client[os.environ['DB_NAME']]
+    repo: storage.Repository = storage.MongoRepository(db)
+elif STORAGE_BACKEND == 'sqlite':
+    client = db = None
+    repo = storage.SQLiteRepository(os.environ.get('SQLITE_PATH', str(ROOT_DIR / 'pos.sqlite3')))
+else:
+    raise RuntimeError(f"Unknown STORAGE_BACKEND {STORAGE_BACKEND!r}; expected 'mongo' or 'sqlite'")
+
+# Stores (branches) share one deployment; every document carries a store_id
+DEFAULT_STORE_ID = os.environ.get('DEFAULT_STORE_ID', 'main')
+STORE_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+SHARD_SALES_BY_STORE = os.environ.get('SHARD_SALES_BY_STORE', 'false').lower() == 'true'
+SHOP_CACHE_TTL = float(os.environ.get('SHOP_CACHE_TTL', '60'))
+# Receipts and reports are rendered in a process pool, off the event loop
+REPORT_WORKERS = int(os.environ.get('REPORT_WORKERS', '2'))
+REPORT_CACHE_SIZE = int(os.environ.get('REPORT_CACHE_SIZE', '512'))
+# Today's Z-report keeps changing, so it is only cached briefly
+OPEN_DAY_REPORT_TTL = float(os.environ.get('OPEN_DAY_REPORT_TTL', '60'))
+# The shop's business day (Z-reports) follows SHOP_TZ, an IANA name such as
+# Asia/Kolkata, or the host's local time; sale_date itself is always UTC
+SHOP_TZ = os.environ.get('SHOP_TZ')
+SHOP_ZONE = ZoneInfo(SHOP_TZ) if SHOP_TZ else None
+# Shelf prices are GST inclusive; medicines are mostly in the 12% slab
+GST_RATE = float(os.environ.get('GST_RATE', '0.12'))
+# How often each worker polls for catalog changes made by other workers
+CATALOG_SYNC_SECONDS = float(os.environ.get('CATALOG_SYNC_SECONDS', '2'))
+# Identical concurrent GETs on these routes share one execution and response
+COALESCE_READS = os.environ.get('COALESCE_READS', 'true').lower() == 'true'
+COALESCED_PATHS = {"/api/medicines", "/api/sales", "/api/sales/analytics", "/api/shop", "/api/bootstrap"}
+# Opt-in request tracing; X-Trace: 1 forces a trace for a single request
+TRACING_ENABLED = os.environ.get('TRACING_ENABLED', 'false').lower() == 'true'
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '0.01'))
+TRACE_FILE = Path(os.environ.get('TRACE_FILE', ROOT_DIR / 'traces' / 'trace.json'))
+TRACE_FILE_MAX_BYTES = int(os.environ.get('TRACE_FILE_MAX_BYTES', str(20 * 1024 * 1024)))
+TRACE_FILE_BACKUPS = int(os.environ.get('TRACE_FILE_BACKUPS', '5'))
+tracer = tracing.Tracer(
+    TRACE_SAMPLE_RATE,
+    tracing.TraceFile(TRACE_FILE, TRACE_FILE_MAX_BYTES, TRACE_FILE_BACKUPS),
+    buffer_size=int(os.environ.get('TRACE_BUFFER_SIZE', '200'))
+)
+if TRACING_ENABLED:
+    tracing.instrument_repository(repo)
+# Admission control: requests in flight per worker, split into route classes so
+# reports and full catalog reads cannot crowd out checkout
+ADMISSION_CONTROL = os.environ.get('ADMISSION_CONTROL', 'true').lower() == 'true'
+ADMISSION_CAPACITY = int(os.environ.get('ADMISSION_CAPACITY', '64'))
+
+def _route_class(name: str, priority: int, limit: int, reserved: int, queue: int, timeout: float):
+    """A route class whose numbers can be tuned per class, e.g. ADMISSION_HEAVY_LIMIT=8."""
+    def setting(knob: str, default):
+        return type(default)(os.environ.get(f'ADMISSION_{name.upper()}_{knob}', default))
+    return admission.RouteClass(
+        name, priority, limit=setting('LIMIT', limit), reserved=setting('RESERVED', reserved),
+        queue=setting('QUEUE', queue), timeout=setting('TIMEOUT', timeout)
+    )
+
+admission_controller = admission.AdmissionController(ADMISSION_CAPACITY, [
+    # Customers waiting at the till: own slots, and a long queue that should never shed
+    _route_class('checkout', 0, limit=ADMISSION_CAPACITY, reserved=16, queue=1000, timeout=30.0),
+    # Barcode scans and single-medicine lookups at the counter
+    _route_class('lookup', 1, limit=ADMISSION_CAPACITY, reserved=8, queue=500, timeout=10.0),
+    _route_class('default', 2, limit=32, reserved=0, queue=200, timeout=10.0),
+    # Analytics, reports, sales history and full catalog lists
+    _route_class('heavy', 3, limit=4, reserved=0, queue=16, timeout=5.0),
+])
+
+# (method, path pattern, route class), first match wins; GET /api/medicines is
+# classified by whether it searches (see _admission_class)
+ADMISSION_ROUTES = [
+    ("POST", re.compile(r"^/api/sales$"), "checkout"),
+    ("GET", re.compile(r"^/api/sales/[^/]+/receipt$"), "lookup"),
+    ("GET", re.compile(r"^/api/medicines/[^/]+$"), "lookup"),
+    # The till refreshes with this right after every sale
+    ("GET", re.compile(r"^/api/bootstrap/delta$"), "lookup"),
+    ("GET", re.compile(r"^/api/sales(/analytics)?$"), "heavy"),
+    ("GET", re.compile(r"^/api/medicines/[^/]+/sales$"), "heavy"),
+    ("GET", re.compile(r"^/api/(reports|inventory|suppliers|analytics)/"), "heavy"),
+]
+
+def _admission_class(method: str, path: str, query_string: bytes) -> Optional[str]:
+    # Health checks and admin endpoints stay reachable while the worker is saturated
+    if not path.startswith("/api/") or path == "/api/" or path.startswith("/api/admin/"):
+        return None
+    if method == "GET" and path == "/api/medicines":
+        # A search is a barcode or name lookup at the counter; no search is the whole catalog
+        searching = any(key == "search" and value for key, value in parse_qsl(query_string.decode("latin-1")))
+        return "lookup" if searching else "heavy"
+    for route_method, pattern, route_class in ADMISSION_ROUTES:
+        if method == route_method and pattern.match(path):
+            return route_class
+    return "default"
+
+# Largest PATCH /medicines/bulk request accepted
+MAX_BULK_UPDATES = int(os.environ.get('MAX_BULK_UPDATES', '10000'))
+# Most lines on one purchase order or goods receipt
+MAX_PURCHASE_LINES = int(os.environ.get('MAX_PURCHASE_LINES', '1000'))
+# Latest sales on the dashboard, as returned by /bootstrap
+BOOTSTRAP_RECENT_SALES = int(os.environ.get('BOOTSTRAP_RECENT_SALES', '10'))
+# Sales embedded in each customer profile, enough for repeat-prescription lookups
+CUSTOMER_RECENT_SALES = int(os.environ.get('CUSTOMER_RECENT_SALES', '10'))
+
+# Background maintenance jobs; exclusive jobs are leased through Mongo. A SQLite
+# install is a single process, so it needs no leases. Cron schedules are read in
+# SCHEDULER_TZ (an IANA name such as Asia/Kolkata), or the host's local time.
+SCHEDULER_TZ = os.environ.get('SCHEDULER_TZ')
+scheduler = Scheduler(
+    lease_collection=db.job_leases if USE_MONGO else None,
+    timezone=ZoneInfo(SCHEDULER_TZ) if SCHEDULER_TZ else None
+)
+SCHEDULER_ENABLED = os.environ.get('SCHEDULER_ENABLED', 'true').lower() == 'true'
+EXPIRY_WARNING_DAYS = int(os.environ.get('EXPIRY_WARNING_DAYS', '30'))
+
+# The event loop only keeps weak references to tasks, so fire-and-forget work is held here
+background_tasks: Set[asyncio.Task] = set()
+
+def _in_background(coroutine) -> asyncio.Task:
+    task = asyncio.create_task(coroutine)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+# Sales older than the horizon are moved into monthly archive collections
+SALES_ARCHIVE_DAYS = int(os.environ.get('SALES_ARCHIVE_DAYS', '365'))
+SALES_ARCHIVE_PREFIX = "sales_archive_"
+SALES_ARCHIVE_BATCH_SIZE = int(os.environ.get('SALES_ARCHIVE_BATCH_SIZE', '1000'))
+
+# Columnar sales snapshot behind /api/analytics/sales, one directory per store
+SNAPSHOT_DIR = Path(os.environ.get('SNAPSHOT_DIR', ROOT_DIR / 'snapshots'))
+SNAPSHOT_INTERVAL = float(os.environ.get('SNAPSHOT_INTERVAL', '60'))
+# Sales younger than this may still be committing, so they wait for the next refresh
+SNAPSHOT_SETTLE_SECONDS = float(os.environ.get('SNAPSHOT_SETTLE_SECONDS', '30'))
+SNAPSHOT_BATCH_SIZE = int(os.environ.get('SNAPSHOT_BATCH_SIZE', '5000'))
+
+class TracedJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        with tracing.span("encode json", "encode"):
+            return super().render(content)
+
+class TracedRoute(APIRoute):
+    """Times the endpoint function itself, separating it from request parsing
+    and response validation in traces."""
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        # include_router rebuilds routes from already wrapped endpoints
+        if not getattr(endpoint, "traced", False):
+            original = endpoint
+
+            @wraps(original)
+            async def endpoint(*args, **inner_kwargs):
+                with tracing.span(original.__name__, "handler"):
+                    return await original(*args, **inner_kwargs)
+            endpoint.traced = True
+        super().__init__(path, endpoint, **kwargs)
 
 # Create the main app without a prefix
-app = FastAPI(title="Medicine Sales & Stock Management API")
+app = FastAPI(title="Medicine Sales & Stock Management API", default_response_class=TracedJSONResponse)
 
 # Create a router with the /api prefix
-api_router = APIRouter(prefix="/api")
+api_router = APIRouter(prefix="/api", route_class=TracedRoute)
 
 # Enums
 class PaymentMethod(str, Enum):
@@ -37,9 +220,25 @@ class UserRole(str, Enum):
     MANAGER = "manager" 
     CASHIER = "cashier"
 
+class PurchaseOrderStatus(str, Enum):
+    OPEN = "open"
+    RECEIVED = "received"
+
+class GoodsReceiptStatus(str, Enum):
+    DRAFT = "draft"
+    # Stock is being added; posting again resumes without adding anything twice
+    POSTING = "posting"
+    POSTED = "posted"
+
 # Models
+class Batch(BaseModel):
+    batch_number: str
+    expiry_date: date
+    quantity: int
+
 class Medicine(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    store_id: str = DEFAULT_STORE_ID
     name: str
     price: float
     stock_quantity: int
@@ -47,6 +246,9 @@ class Medicine(BaseModel):
     batch_number: str
     supplier: str
     barcode: Optional[str] = None
+    # Stock by lot, earliest expiry first; stock_quantity is their total and
+    # expiry_date/batch_number describe the lot that sells next
+    batches: List[Batch] = Field(default_factory=list)
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
@@ -58,6 +260,22 @@ class MedicineCreate(BaseModel):
     batch_number: str
     supplier: str
     barcode: Optional[str] = None
+    # Without batches the whole stock is one batch made of the fields above
+    batches: Optional[List[Batch]] = None
+
+class MedicinePatch(BaseModel):
+    id: str
+    price: Optional[float] = None
+    # Either an absolute count (stock-take) or a relative adjustment
+    stock_quantity: Optional[int] = None
+    stock_delta: Optional[int] = None
+    # Corrects the expiry of the batch on sale
+    expiry_date: Optional[date] = None
+    # Optimistic concurrency: only apply if the medicine is unchanged since this
+    expected_updated_at: Optional[datetime] = None
+
+class MedicineBulkUpdate(BaseModel):
+    updates: List[MedicinePatch]
 
 class SaleItem(BaseModel):
     medicine_id: str
@@ -65,9 +283,12 @@ class SaleItem(BaseModel):
     quantity: int
     price: float
     total: float
+    # Filled in by the server: the batches the quantity was taken from
+    batches: List[Batch] = Field(default_factory=list)
 
 class Sale(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    store_id: str = DEFAULT_STORE_ID
     items: List[SaleItem]
     total_amount: float
     payment_method: PaymentMethod
@@ -85,8 +306,71 @@ class SaleCreate(BaseModel):
     customer_phone: Optional[str] = None
     cashier_id: str
 
+class PurchaseOrderLine(BaseModel):
+    medicine_id: Optional[str] = None
+    medicine_name: str
+    quantity: int
+    unit_cost: float
+
+class PurchaseOrder(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    store_id: str = DEFAULT_STORE_ID
+    kind: str = "order"
+    number: str
+    supplier: str
+    lines: List[PurchaseOrderLine]
+    total_cost: float
+    status: PurchaseOrderStatus = PurchaseOrderStatus.OPEN
+    goods_receipt_id: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    received_at: Optional[datetime] = None
+
+class PurchaseOrderCreate(BaseModel):
+    supplier: str
+    lines: List[PurchaseOrderLine]
+
+class GoodsReceiptLine(BaseModel):
+    # An existing medicine, or a new one described by name, price and barcode
+    # that is created when the receipt is posted
+    medicine_id: Optional[str] = None
+    medicine_name: Optional[str] = None
+    price: Optional[float] = None
+    barcode: Optional[str] = None
+    batch_number: str
+    expiry_date: date
+    quantity: int
+    unit_cost: float = 0
+    # Filled in by the server for lines that create their medicine
+    new_medicine: bool = False
+
+class GoodsReceipt(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    store_id: str = DEFAULT_STORE_ID
+    kind: str = "receipt"
+    number: str
+    supplier: str
+    invoice_number: Optional[str] = None
+    purchase_order_id: Optional[str] = None
+    lines: List[GoodsReceiptLine]
+    total_units: int
+    total_cost: float
+    status: GoodsReceiptStatus = GoodsReceiptStatus.DRAFT
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    posted_at: Optional[datetime] = None
+
+class GoodsReceiptCreate(BaseModel):
+    supplier: str
+    invoice_number: Optional[str] = None
+    purchase_order_id: Optional[str] = None
+    lines: List[GoodsReceiptLine]
+    # Post straight away, or keep a draft to check against the delivery first
+    post: bool = True
+
 class User(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    store_id: str = DEFAULT_STORE_ID
     username: str
     password_hash: str
     role: UserRole
@@ -102,6 +386,7 @@ class UserCreate(BaseModel):
 
 class ShopDetails(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    store_id: str = DEFAULT_STORE_ID
     name: str
     address: str
     phone: str
@@ -110,37 +395,202 @@ class ShopDetails(BaseModel):
     gst_number: Optional[str] = None
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
+def _partial_model(model):
+    """Same fields as `model`, all optional, for responses trimmed with `fields=`."""
+    return create_model(
+        f"{model.__name__}Fields",
+        **{name: (Optional[field.annotation], None) for name, field in model.model_fields.items()}
+    )
+
+MedicineFields = _partial_model(Medicine)
+SaleFields = _partial_model(Sale)
+
+def _projection(fields: Optional[str], model) -> Optional[List[str]]:
+    """Turn a comma separated `fields=` parameter into the list of fields to return."""
+    if not fields:
+        return None
+    requested = {field.strip() for field in fields.split(",") if field.strip()}
+    unknown = requested - set(model.model_fields)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    # id is always returned so clients can key rows
+    requested.add("id")
+    return sorted(requested)
+
+def _normalize_phone(phone: Optional[str]) -> Optional[str]:
+    """Digits only, without the country code, so one customer has one key."""
+    digits = re.sub(r"\D", "", phone or "")
+    # Indian mobile numbers: drop a leading 91 / 0 prefix
+    return digits[-10:] if len(digits) > 10 else digits or None
+
+async def get_store_id(x_store_id: Optional[str] = Header(None)) -> str:
+    """Store scope for the request, taken from the X-Store-ID header."""
+    store_id = x_store_id or DEFAULT_STORE_ID
+    if not STORE_ID_PATTERN.match(store_id):
+        raise HTTPException(status_code=400, detail="Invalid store ID")
+    return store_id
+
+# Catalog cache
+class CatalogCache:
+    """Process-local copy of every store's medicines.
+
+    Medicine endpoints write through to it. Other workers catch up on every
+    sync with a delta read of recently updated medicines, which also brings in
+    the stock that checkouts take without announcing it. A per-store catalog
+    version kept by the repository counts deletes, which a delta read cannot
+    see, and a changed count means a full reload of the store.
+    """
+
+    # Allowance for clock skew between workers when reading deltas by updated_at
+    SYNC_OVERLAP = timedelta(seconds=5)
+
+    def __init__(self):
+        self.stores: Dict[str, Dict[str, dict]] = {}
+        self.versions: Dict[str, Tuple[int, int]] = {}
+        self.synced_at: Dict[str, datetime] = {}
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.delta_syncs = 0
+
+    def get(self, store_id: str, medicine_id: str) -> Optional[dict]:
+        medicine = self.stores.get(store_id, {}).get(medicine_id)
+        if medicine is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return dict(medicine)
+
+    def put(self, medicine: dict):
+        medicine = {key: value for key, value in medicine.items() if key != "_id"}
+        self.stores.setdefault(medicine["store_id"], {})[medicine["id"]] = medicine
+
+    def remove(self, store_id: str, medicine_id: str):
+        self.stores.get(store_id, {}).pop(medicine_id, None)
+
+    async def load(self, store_id: Optional[str] = None):
+        started = datetime.utcnow()
+        versions = await repo.medicines.versions(store_id)
+        stores: Dict[str, Dict[str, dict]] = {store_id: {}} if store_id else {}
+        for medicine in await repo.medicines.all(store_id):
+            stores.setdefault(medicine["store_id"], {})[medicine["id"]] = medicine
+        if store_id is None:
+            self.stores = stores
+        else:
+            self.stores[store_id] = stores[store_id]
+        for version in versions:
+            self.versions[version["store_id"]] = (version["version"], version["deletes"])
+        for loaded_store in stores:
+            self.synced_at[loaded_store] = started
+        self.reloads += 1
+
+    async def publish(self, store_id: str, deleted: bool = False):
+        """Tell other workers that this store's catalog changed."""
+        version = await repo.medicines.bump_version(store_id, deleted=deleted)
+        known_version, known_deletes = self.versions.get(store_id, (0, 0))
+        # Only fast-forward when no other worker changed the store in between
+        if version["version"] == known_version + 1 and version["deletes"] == known_deletes + int(deleted):
+            self.versions[store_id] = (version["version"], version["deletes"])
+
+    async def sync(self) -> dict:
+        changed = []
+        versions = {version["store_id"]: version for version in await repo.medicines.versions()}
+        for store_id in sorted(set(versions) | set(self.synced_at)):
+            version = versions.get(store_id, {"version": 0, "deletes": 0})
+            current = (version["version"], version["deletes"])
+            known = self.versions.get(store_id, (0, 0))
+            if current[1] != known[1] or store_id not in self.synced_at:
+                await self.load(store_id)
+                changed.append(store_id)
+            else:
+                started = datetime.utcnow()
+                since = self.synced_at[store_id] - self.SYNC_OVERLAP
+                updated = await repo.medicines.updated_since(store_id, since)
+                for medicine in updated:
+                    self.put(medicine)
+                self.synced_at[store_id] = started
+                self.delta_syncs += 1
+                if updated or current != known:
+                    changed.append(store_id)
+            self.versions[store_id] = current
+        return {"changed_stores": changed}
+
+    def metrics(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "stores": len(self.stores),
+            "medicines": sum(len(medicines) for medicines in self.stores.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "reloads": self.reloads,
+            "delta_syncs": self.delta_syncs
+        }
+
+catalog = CatalogCache()
+
+def _to_medicine(medicine: dict) -> Medicine:
+    medicine = dict(medicine)
+    # Convert expiry_date string back to date object for response
+    if isinstance(medicine.get('expiry_date'), str):
+        try:
+            medicine['expiry_date'] = datetime.fromisoformat(medicine['expiry_date']).date()
+        except (ValueError, AttributeError):
+            pass
+    return Medicine(**medicine)
+
+async def _cached_medicine(store_id: str, medicine_id: str) -> Optional[dict]:
+    """Medicine from the catalog cache, falling back to storage for entries not synced yet."""
+    medicine = catalog.get(store_id, medicine_id)
+    if medicine is None:
+        medicine = await repo.medicines.get(store_id, medicine_id)
+        if medicine:
+            catalog.put(medicine)
+    return medicine
+
 # Basic API endpoints
 @api_router.get("/")
 async def root():
     return {"message": "Medicine Sales & Stock Management API"}
 
+def _with_batches(medicine_data: dict) -> dict:
+    if not medicine_data.get("batches"):
+        medicine_data["batches"] = [{
+            "batch_number": medicine_data["batch_number"],
+            "expiry_date": medicine_data["expiry_date"],
+            "quantity": medicine_data["stock_quantity"]
+        }]
+    numbers = [batch["batch_number"] for batch in medicine_data["batches"]]
+    if len(set(numbers)) != len(numbers):
+        raise HTTPException(status_code=400, detail="Batch numbers must be unique per medicine")
+    if any(batch["quantity"] < 0 for batch in medicine_data["batches"]):
+        raise HTTPException(status_code=400, detail="Batch quantities cannot be negative")
+    # Convert date objects to strings for storage
+    for batch in [medicine_data, *medicine_data["batches"]]:
+        if isinstance(batch.get('expiry_date'), date):
+            batch['expiry_date'] = batch['expiry_date'].isoformat()
+    return storage.with_batches(medicine_data)
+
 # Medicine endpoints
 @api_router.post("/medicines", response_model=Medicine)
-async def create_medicine(medicine: MedicineCreate):
-    medicine_dict = medicine.dict()
-    medicine_obj = Medicine(**medicine_dict)
-    
-    # Convert date objects to strings for MongoDB
-    medicine_data = medicine_obj.dict()
-    if isinstance(medicine_data.get('expiry_date'), date):
-        medicine_data['expiry_date'] = medicine_data['expiry_date'].isoformat()
-    
-    await db.medicines.insert_one(medicine_data)
-    return medicine_obj
-
-@api_router.get("/medicines", response_model=List[Medicine])
-async def get_medicines(search: Optional[str] = Query(None)):
-    query = {}
-    if search:
-        query = {
-            "$or": [
-                {"name": {"$regex": search, "$options": "i"}},
-                {"barcode": {"$regex": search, "$options": "i"}}
-            ]
-        }
+async def create_medicine(medicine: MedicineCreate, store_id: str = Depends(get_store_id)):
+    medicine_dict = medicine.dict(exclude_none=True)
+    medicine_obj = Medicine(**medicine_dict, store_id=store_id)
+    medicine_data = _with_batches(medicine_obj.dict())
     
-    medicines = await db.medicines.find(query).to_list(1000)
+    await repo.medicines.insert(medicine_data)
+    catalog.put(medicine_data)
+    await catalog.publish(store_id)
+    return _to_medicine(medicine_data)
+
+@api_router.get("/medicines", response_model=List[MedicineFields], response_model_exclude_unset=True)
+async def get_medicines(
+    search: Optional[str] = Query(None),
+    fields: Optional[str] = Query(None),
+    store_id: str = Depends(get_store_id)
+):
+    projection = _projection(fields, Medicine)
+    medicines = await repo.medicines.search(store_id, search, projection)
     # Convert expiry_date string back to date object for response
     for medicine in medicines:
         if isinstance(medicine.get('expiry_date'), str):
@@ -148,112 +598,181 @@ async def get_medicines(search: Optional[str] = Query(None)):
                 medicine['expiry_date'] = datetime.fromisoformat(medicine['expiry_date']).date()
             except (ValueError, AttributeError):
                 pass
-    return [Medicine(**medicine) for medicine in medicines]
+    with tracing.span("build medicines", "model", count=len(medicines)):
+        if projection:
+            return [MedicineFields(**medicine) for medicine in medicines]
+        return [Medicine(**medicine) for medicine in medicines]
 
 @api_router.get("/medicines/{medicine_id}", response_model=Medicine)
-async def get_medicine(medicine_id: str):
-    medicine = await db.medicines.find_one({"id": medicine_id})
+async def get_medicine(medicine_id: str, store_id: str = Depends(get_store_id)):
+    medicine = await _cached_medicine(store_id, medicine_id)
     if not medicine:
         raise HTTPException(status_code=404, detail="Medicine not found")
-    
-    # Convert expiry_date string back to date object for response
-    if isinstance(medicine.get('expiry_date'), str):
-        try:
-            medicine['expiry_date'] = datetime.fromisoformat(medicine['expiry_date']).date()
-        except (ValueError, AttributeError):
-            pass
-    return Medicine(**medicine)
+    return _to_medicine(medicine)
 
 @api_router.put("/medicines/{medicine_id}", response_model=Medicine)
-async def update_medicine(medicine_id: str, medicine_update: MedicineCreate):
-    medicine = await db.medicines.find_one({"id": medicine_id})
-    if not medicine:
-        raise HTTPException(status_code=404, detail="Medicine not found")
-    
-    update_dict = medicine_update.dict()
+async def update_medicine(
+    medicine_id: str,
+    medicine_update: MedicineCreate,
+    store_id: str = Depends(get_store_id)
+):
+    update_dict = _with_batches(medicine_update.dict())
     update_dict["updated_at"] = datetime.utcnow()
     
-    # Convert date objects to strings for MongoDB
-    if isinstance(update_dict.get('expiry_date'), date):
-        update_dict['expiry_date'] = update_dict['expiry_date'].isoformat()
+    updated_medicine = await repo.medicines.update(store_id, medicine_id, update_dict)
+    if not updated_medicine:
+        raise HTTPException(status_code=404, detail="Medicine not found")
     
-    await db.medicines.update_one(
-        {"id": medicine_id},
-        {"$set": update_dict}
-    )
+    catalog.put(updated_medicine)
+    await catalog.publish(store_id)
+    return _to_medicine(updated_medicine)
+
+@api_router.post("/medicines/{medicine_id}/batches", response_model=Medicine)
+async def receive_medicine_batch(medicine_id: str, batch: Batch, store_id: str = Depends(get_store_id)):
+    if batch.quantity <= 0:
+        raise HTTPException(status_code=400, detail="Received quantity must be positive")
+    received = {
+        "batch_number": batch.batch_number, "expiry_date": batch.expiry_date.isoformat(), "quantity": batch.quantity
+    }
+    try:
+        medicine = await repo.medicines.receive(store_id, medicine_id, received)
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+    if not medicine:
+        raise HTTPException(status_code=404, detail="Medicine not found")
     
-    updated_medicine = await db.medicines.find_one({"id": medicine_id})
-    # Convert expiry_date string back to date object for response
-    if isinstance(updated_medicine.get('expiry_date'), str):
-        try:
-            updated_medicine['expiry_date'] = datetime.fromisoformat(updated_medicine['expiry_date']).date()
-        except (ValueError, AttributeError):
-            pass
-    return Medicine(**updated_medicine)
+    catalog.put(medicine)
+    await catalog.publish(store_id)
+    return _to_medicine(medicine)
 
 @api_router.delete("/medicines/{medicine_id}")
-async def delete_medicine(medicine_id: str):
-    result = await db.medicines.delete_one({"id": medicine_id})
-    if result.deleted_count == 0:
+async def delete_medicine(medicine_id: str, store_id: str = Depends(get_store_id)):
+    if not await repo.medicines.delete(store_id, medicine_id):
         raise HTTPException(status_code=404, detail="Medicine not found")
+    catalog.remove(store_id, medicine_id)
+    await catalog.publish(store_id, deleted=True)
     return {"message": "Medicine deleted successfully"}
 
+@api_router.patch("/medicines/bulk")
+async def bulk_update_medicines(bulk: MedicineBulkUpdate, store_id: str = Depends(get_store_id)):
+    if len(bulk.updates) > MAX_BULK_UPDATES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BULK_UPDATES} updates per request")
+    ids = [update.id for update in bulk.updates]
+    if len(set(ids)) != len(ids):
+        raise HTTPException(status_code=400, detail="Each medicine may only appear once per request")
+    
+    patches = []
+    for update in bulk.updates:
+        if update.stock_quantity is not None and update.stock_delta is not None:
+            raise HTTPException(
+                status_code=400, detail=f"Medicine {update.id}: set stock_quantity or stock_delta, not both"
+            )
+        if update.stock_quantity is not None and update.stock_quantity < 0:
+            raise HTTPException(status_code=400, detail=f"Medicine {update.id}: stock_quantity cannot be negative")
+        changes = update.dict(include={"price", "stock_quantity", "expiry_date"}, exclude_none=True)
+        # Convert date objects to strings for storage
+        if "expiry_date" in changes:
+            changes["expiry_date"] = changes["expiry_date"].isoformat()
+        patches.append({
+            "id": update.id,
+            "set": changes,
+            "stock_delta": update.stock_delta,
+            "expected_updated_at": update.expected_updated_at
+        })
+    
+    result = await repo.medicines.bulk_update(store_id, patches)
+    for medicine in result["updated"]:
+        catalog.put(medicine)
+    if result["updated"]:
+        await catalog.publish(store_id)
+    return {
+        "updated": len(result["updated"]),
+        "updated_ids": [medicine["id"] for medicine in result["updated"]],
+        "rejected": result["rejected"]
+    }
+
 # Sales endpoints
 @api_router.post("/sales", response_model=Sale)
-async def create_sale(sale: SaleCreate):
+async def create_sale(sale: SaleCreate, store_id: str = Depends(get_store_id)):
     # Generate receipt number
     receipt_number = f"RCP{int(datetime.utcnow().timestamp())}"
+    today = date.today().isoformat()
     
-    # Check stock availability and update inventory
+    # Validate the cart against the catalog cache; no reads on the happy path
+    with tracing.span("validate cart", items=len(sale.items)):
+        for item in sale.items:
+            medicine = await _cached_medicine(store_id, item.medicine_id)
+            if not medicine:
+                raise HTTPException(status_code=404, detail=f"Medicine {item.medicine_name} not found")
+            
+            # Expired lots are never sold, so only unexpired units count
+            if storage.sellable_stock(medicine, today) < item.quantity:
+                # The cache may lag a restock on another worker; confirm before rejecting
+                medicine = await repo.medicines.get(store_id, item.medicine_id)
+                if medicine:
+                    catalog.put(medicine)
+                if not medicine or storage.sellable_stock(medicine, today) < item.quantity:
+                    raise HTTPException(status_code=400, detail=f"Insufficient stock for {item.medicine_name}")
+    
+    # One atomic earliest-expiry-first allocation per line, which only applies
+    # while enough unexpired stock remains
+    allocations = []
     for item in sale.items:
-        medicine = await db.medicines.find_one({"id": item.medicine_id})
-        if not medicine:
-            raise HTTPException(status_code=404, detail=f"Medicine {item.medicine_name} not found")
-        
-        if medicine["stock_quantity"] < item.quantity:
+        allocation = await repo.medicines.allocate(store_id, item.medicine_id, item.quantity)
+        if not allocation:
+            # Lost a race with another till; give back what this sale already took
+            for done, taken in zip(sale.items, allocations):
+                restored = await repo.medicines.release(store_id, done.medicine_id, taken)
+                if restored:
+                    catalog.put(restored)
             raise HTTPException(status_code=400, detail=f"Insufficient stock for {item.medicine_name}")
-        
-        # Update stock
-        new_stock = medicine["stock_quantity"] - item.quantity
-        await db.medicines.update_one(
-            {"id": item.medicine_id},
-            {"$set": {"stock_quantity": new_stock, "updated_at": datetime.utcnow()}}
-        )
+        medicine, taken = allocation
+        catalog.put(medicine)
+        item.batches = [Batch(**part) for part in taken]
+        allocations.append(taken)
+    # Stock changes reach other workers through the periodic catalog sync
     
     # Create sale record
-    sale_dict = sale.dict()
-    sale_obj = Sale(**sale_dict, receipt_number=receipt_number)
-    
-    # Convert datetime objects to serializable format for MongoDB
-    sale_data = sale_obj.dict()
-    if isinstance(sale_data.get('sale_date'), datetime):
-        sale_data['sale_date'] = sale_data['sale_date'].isoformat()
+    sale.customer_phone = _normalize_phone(sale.customer_phone)
+    with tracing.span("build sale", "model", items=len(sale.items)):
+        sale_dict = sale.dict()
+        sale_obj = Sale(**sale_dict, store_id=store_id, receipt_number=receipt_number)
+        
+        # Convert datetime objects to serializable format for storage
+        sale_data = sale_obj.dict()
+        if isinstance(sale_data.get('sale_date'), datetime):
+            sale_data['sale_date'] = sale_data['sale_date'].isoformat()
+        # Allocations already carry ISO expiry dates
+        for item, taken in zip(sale_data["items"], allocations):
+            item["batches"] = taken
     
-    await db.sales.insert_one(sale_data)
+    await repo.sales.insert(sale_data)
+    if sale_data["customer_phone"]:
+        await repo.customers.record_sale(sale_data, CUSTOMER_RECENT_SALES)
     
     return sale_obj
 
-@api_router.get("/sales", response_model=List[Sale])
+def _month_key(value) -> str:
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m")
+    return str(value)[:7]
+
+def _archive_collection_name(month: str) -> str:
+    return SALES_ARCHIVE_PREFIX + month.replace("-", "_")
+
+@api_router.get("/sales", response_model=List[SaleFields], response_model_exclude_unset=True)
 async def get_sales(
     start_date: Optional[date] = Query(None),
     end_date: Optional[date] = Query(None),
+    medicine_id: Optional[str] = Query(None),
     medicine_name: Optional[str] = Query(None),
-    limit: int = Query(100)
+    limit: int = Query(100),
+    fields: Optional[str] = Query(None),
+    store_id: str = Depends(get_store_id)
 ):
-    query = {}
-    
-    if start_date or end_date:
-        date_query = {}
-        if start_date:
-            date_query["$gte"] = datetime.combine(start_date, datetime.min.time())
-        if end_date:
-            date_query["$lte"] = datetime.combine(end_date, datetime.max.time())
-        query["sale_date"] = date_query
-    
-    if medicine_name:
-        query["items.medicine_name"] = {"$regex": medicine_name, "$options": "i"}
-    
-    sales = await db.sales.find(query).sort("sale_date", -1).limit(limit).to_list(limit)
+    projection = _projection(fields, Sale)
+    # medicine_id is preferred over medicine_name: it is an exact, indexed match
+    sales = await repo.sales.find(store_id, start_date, end_date, medicine_id, medicine_name, limit, projection)
     
     # Convert datetime strings back to datetime objects for response
     for sale in sales:
@@ -263,40 +782,55 @@ async def get_sales(
             except (ValueError, AttributeError):
                 pass
     
-    return [Sale(**sale) for sale in sales]
+    with tracing.span("build sales", "model", count=len(sales)):
+        if projection:
+            return [SaleFields(**sale) for sale in sales]
+        return [Sale(**sale) for sale in sales]
 
-@api_router.get("/sales/analytics")
-async def get_sales_analytics(
+@api_router.get("/medicines/{medicine_id}/sales")
+async def get_medicine_sales(
+    medicine_id: str,
     start_date: Optional[date] = Query(None),
-    end_date: Optional[date] = Query(None)
+    end_date: Optional[date] = Query(None),
+    limit: int = Query(50),
+    store_id: str = Depends(get_store_id)
 ):
-    match_stage = {}
-    
-    if start_date or end_date:
-        date_query = {}
-        if start_date:
-            date_query["$gte"] = datetime.combine(start_date, datetime.min.time())
-        if end_date:
-            date_query["$lte"] = datetime.combine(end_date, datetime.max.time())
-        match_stage["sale_date"] = date_query
-    
-    pipeline = [
-        {"$match": match_stage} if match_stage else {"$match": {}},
-        {"$group": {
-            "_id": None,
-            "total_sales": {"$sum": "$total_amount"},
-            "total_transactions": {"$sum": 1},
-            "avg_transaction": {"$avg": "$total_amount"}
-        }}
-    ]
+    totals, sales = await asyncio.gather(
+        repo.sales.medicine_totals(store_id, medicine_id, start_date, end_date),
+        repo.sales.find(store_id, start_date, end_date, medicine_id=medicine_id, limit=limit)
+    )
+    totals["revenue"] = round(totals["revenue"], 2)
     
-    result = await db.sales.aggregate(pipeline).to_list(1)
+    history = []
+    for sale in sales:
+        for item in sale["items"]:
+            if item["medicine_id"] == medicine_id:
+                history.append({
+                    "sale_id": sale["id"],
+                    "receipt_number": sale["receipt_number"],
+                    "sale_date": sale["sale_date"],
+                    "quantity": item["quantity"],
+                    "price": item["price"],
+                    "total": item["total"],
+                    "payment_method": sale["payment_method"]
+                })
     
-    if result:
+    return {"medicine_id": medicine_id, "totals": totals, "history": history}
+
+@api_router.get("/sales/analytics")
+async def get_sales_analytics(
+    start_date: Optional[date] = Query(None),
+    end_date: Optional[date] = Query(None),
+    store_id: str = Depends(get_store_id)
+):
+    return _analytics(await repo.sales.totals(store_id, start_date, end_date))
+
+def _analytics(totals: dict) -> dict:
+    if totals["total_transactions"]:
         return {
-            "total_sales": round(result[0]["total_sales"], 2),
-            "total_transactions": result[0]["total_transactions"],
-            "avg_transaction": round(result[0]["avg_transaction"], 2)
+            "total_sales": round(totals["total_sales"], 2),
+            "total_transactions": totals["total_transactions"],
+            "avg_transaction": round(totals["total_sales"] / totals["total_transactions"], 2)
         }
     else:
         return {
@@ -305,9 +839,381 @@ async def get_sales_analytics(
             "avg_transaction": 0
         }
 
+def sales_snapshot(store_id: str) -> snapshot.SalesSnapshot:
+    return snapshot.SalesSnapshot(SNAPSHOT_DIR / store_id)
+
+async def refresh_sales_snapshot(store_id: str, max_batches: Optional[int] = None) -> dict:
+    until = datetime.utcnow() - timedelta(seconds=SNAPSHOT_SETTLE_SECONDS)
+    return await snapshot.refresh(
+        sales_snapshot(store_id), repo.sales, store_id, until, SNAPSHOT_BATCH_SIZE, max_batches
+    )
+
+def _refresh_snapshots_in_background() -> bool:
+    if scheduler.jobs["sales_snapshot"].running:
+        return False
+    _in_background(scheduler.trigger("sales_snapshot"))
+    return True
+
+@api_router.get("/analytics/sales")
+async def query_sales_snapshot(
+    start_date: Optional[date] = Query(None),
+    end_date: Optional[date] = Query(None),
+    group_by: Optional[str] = Query(None, description="Comma separated: medicine, payment_method, cashier"),
+    bucket: Optional[str] = Query(None, pattern="^(hour|day|week|month)$"),
+    medicine_id: Optional[str] = Query(None, description="Comma separated medicine ids"),
+    payment_method: Optional[str] = Query(None, description="Comma separated payment methods"),
+    cashier_id: Optional[str] = Query(None, description="Comma separated cashier ids"),
+    limit: int = Query(1000, ge=1, le=100000),
+    store_id: str = Depends(get_store_id)
+):
+    """Quantity, revenue, line and transaction counts per group over the columnar
+    snapshot, as of its `refreshed_at`. Sales from the last SNAPSHOT_SETTLE_SECONDS
+    are not in it yet, and a stale snapshot is answered as is while it catches up."""
+    dimensions = [dimension for dimension in (group_by or "").split(",") if dimension]
+    unknown = sorted(set(dimensions) - set(snapshot.DIMENSIONS))
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Cannot group by {', '.join(unknown)}")
+    filters = {
+        dimension: values.split(",")
+        for dimension, values in (("medicine", medicine_id), ("payment_method", payment_method),
+                                  ("cashier", cashier_id))
+        if values
+    }
+
+    current = sales_snapshot(store_id)
+    meta = await asyncio.to_thread(current.meta)
+    refreshed_at = meta["refreshed_at"]
+    refreshing = False
+    if refreshed_at is None:
+        # A new store waits for one batch only; the snapshot job exports the rest
+        await refresh_sales_snapshot(store_id, max_batches=1)
+        refreshing = _refresh_snapshots_in_background()
+    elif datetime.utcnow() - datetime.fromisoformat(refreshed_at) > timedelta(seconds=SNAPSHOT_INTERVAL):
+        refreshing = _refresh_snapshots_in_background()
+    started = time.perf_counter()
+    result = await asyncio.to_thread(current.query, start_date, end_date, dimensions, bucket, filters, limit)
+    result["query_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    result["refreshing"] = refreshing
+    return result
+
+# Customer endpoints
+@api_router.get("/customers/{phone}/history")
+async def get_customer_history(
+    phone: str,
+    limit: int = Query(CUSTOMER_RECENT_SALES),
+    store_id: str = Depends(get_store_id)
+):
+    customer_phone = _normalize_phone(phone)
+    if not customer_phone:
+        raise HTTPException(status_code=400, detail="Invalid phone number")
+    profile = await repo.customers.get(store_id, customer_phone)
+    if not profile:
+        raise HTTPException(status_code=404, detail="Customer not found")
+    
+    recent_sales = profile.pop("recent_sales")
+    # The profile already holds the newest sales; older history needs the sales index
+    if limit <= len(recent_sales) or len(recent_sales) >= profile["visits"]:
+        sales = recent_sales[:limit]
+    else:
+        sales = [
+            storage.sale_summary(sale)
+            for sale in await repo.sales.find(store_id, limit=limit, customer_phone=customer_phone)
+        ]
+    
+    last_medicines = {}
+    for sale in recent_sales:
+        for item in sale["items"]:
+            last_medicines.setdefault(item["medicine_id"], {
+                "medicine_id": item["medicine_id"],
+                "medicine_name": item["medicine_name"],
+                "quantity": item["quantity"],
+                "last_bought": sale["sale_date"]
+            })
+    
+    profile["lifetime_spend"] = round(profile["lifetime_spend"], 2)
+    return {"profile": profile, "last_medicines": list(last_medicines.values()), "sales": sales}
+
+# Inventory endpoints; answered from the counters kept by the medicine repository
+def _counter_totals(rows: List[dict]) -> dict:
+    skus = sum(row["skus"] for row in rows)
+    in_stock = sum(row["in_stock"] for row in rows)
+    return {
+        "skus": skus,
+        "in_stock_skus": in_stock,
+        "out_of_stock_skus": skus - in_stock,
+        "units": sum(row["units"] for row in rows),
+        "value": round(sum(row["value"] for row in rows), 2)
+    }
+
+def _rows_by_supplier(rows: List[dict]) -> Dict[str, List[dict]]:
+    suppliers = {}
+    for row in rows:
+        suppliers.setdefault(row["supplier"], []).append(row)
+    return suppliers
+
+@api_router.get("/inventory/valuation")
+async def get_inventory_valuation(store_id: str = Depends(get_store_id)):
+    rows = await repo.inventory.counters(store_id)
+    suppliers = [
+        {"supplier": supplier, **_counter_totals(supplier_rows)}
+        for supplier, supplier_rows in _rows_by_supplier(rows).items()
+    ]
+    suppliers.sort(key=lambda supplier: supplier["value"], reverse=True)
+    return {"totals": _counter_totals(rows), "suppliers": suppliers}
+
+@api_router.get("/inventory/expiry-risk")
+async def get_expiry_risk(
+    days: int = Query(EXPIRY_WARNING_DAYS, ge=0),
+    store_id: str = Depends(get_store_id)
+):
+    today = date.today().isoformat()
+    warning_date = (date.today() + timedelta(days=days)).isoformat()
+    rows = await repo.inventory.counters(store_id)
+    # expiry_date is stored as an ISO string, so string comparison keeps date order
+    expired = [row for row in rows if row["expiry_date"] < today]
+    expiring = [row for row in rows if today <= row["expiry_date"] <= warning_date]
+    
+    suppliers = []
+    for supplier, supplier_rows in _rows_by_supplier(expired + expiring).items():
+        expired_value = sum(row["value"] for row in supplier_rows if row["expiry_date"] < today)
+        expiring_value = sum(row["value"] for row in supplier_rows if row["expiry_date"] >= today)
+        suppliers.append({
+            "supplier": supplier,
+            "expired_value": round(expired_value, 2),
+            "expiring_value": round(expiring_value, 2),
+            "value_at_risk": round(expired_value + expiring_value, 2)
+        })
+    suppliers.sort(key=lambda supplier: supplier["value_at_risk"], reverse=True)
+    
+    expired_totals, expiring_totals = _counter_totals(expired), _counter_totals(expiring)
+    return {
+        "as_of": today,
+        "warning_days": days,
+        "expired": expired_totals,
+        "expiring": expiring_totals,
+        "value_at_risk": round(expired_totals["value"] + expiring_totals["value"], 2),
+        "suppliers": suppliers
+    }
+
+async def _valuation_drift(store_id: str) -> Tuple[List[dict], List[dict]]:
+    # Full recompute from the catalog, compared bucket by bucket with the counters
+    counters, actual = await asyncio.gather(repo.inventory.counters(store_id), repo.inventory.recompute(store_id))
+    counted = {(row["supplier"], row["expiry_date"]): row for row in counters}
+    computed = {(row["supplier"], row["expiry_date"]): row for row in actual}
+    empty = dict.fromkeys(storage.COUNTER_FIELDS, 0)
+    
+    mismatches = []
+    for key in sorted(set(counted) | set(computed)):
+        expected, found = computed.get(key, empty), counted.get(key, empty)
+        # Values are float sums, so they only need to agree to the paisa
+        if any(expected[field] != found[field] for field in ("skus", "in_stock", "units")) or \
+                abs(expected["value"] - found["value"]) >= 0.005:
+            mismatches.append({
+                "supplier": key[0],
+                "expiry_date": key[1],
+                "counters": {field: found[field] for field in storage.COUNTER_FIELDS},
+                "actual": {field: expected[field] for field in storage.COUNTER_FIELDS}
+            })
+    return actual, mismatches
+
+@api_router.get("/inventory/valuation/verify")
+async def verify_inventory_valuation(store_id: str = Depends(get_store_id)):
+    actual, mismatches = await _valuation_drift(store_id)
+    return {
+        "consistent": not mismatches,
+        "buckets": len(actual),
+        "mismatches": mismatches,
+        "totals": _counter_totals(actual)
+    }
+
+@api_router.post("/inventory/valuation/rebuild")
+async def rebuild_inventory_valuation(store_id: str = Depends(get_store_id)):
+    actual, mismatches = await _valuation_drift(store_id)
+    if mismatches:
+        await repo.inventory.replace(store_id, actual)
+    return {"repaired": len(mismatches), "buckets": len(actual), "totals": _counter_totals(actual)}
+
+# Purchasing endpoints: purchase orders, goods receipts and supplier totals
+def _check_purchase_lines(lines: list):
+    if not lines:
+        raise HTTPException(status_code=400, detail="At least one line is required")
+    if len(lines) > MAX_PURCHASE_LINES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_PURCHASE_LINES} lines per document")
+    for line in lines:
+        if line.quantity <= 0:
+            raise HTTPException(status_code=400, detail="Quantities must be positive")
+        if line.unit_cost < 0:
+            raise HTTPException(status_code=400, detail="Unit costs cannot be negative")
+
+@api_router.post("/purchase-orders", response_model=PurchaseOrder)
+async def create_purchase_order(order: PurchaseOrderCreate, store_id: str = Depends(get_store_id)):
+    _check_purchase_lines(order.lines)
+    for line in order.lines:
+        if line.medicine_id and not await _cached_medicine(store_id, line.medicine_id):
+            raise HTTPException(status_code=404, detail=f"Medicine {line.medicine_name} not found")
+    
+    order_obj = PurchaseOrder(
+        **order.dict(),
+        store_id=store_id,
+        number=f"PO{int(datetime.utcnow().timestamp())}",
+        total_cost=sum(line.quantity * line.unit_cost for line in order.lines)
+    )
+    await repo.purchases.insert(order_obj.dict())
+    return order_obj
+
+@api_router.get("/purchase-orders", response_model=List[PurchaseOrder])
+async def get_purchase_orders(
+    supplier: Optional[str] = Query(None),
+    status: Optional[PurchaseOrderStatus] = Query(None),
+    limit: int = Query(100, ge=1, le=1000),
+    store_id: str = Depends(get_store_id)
+):
+    orders = await repo.purchases.find(store_id, "order", supplier, status.value if status else None, limit)
+    return [PurchaseOrder(**order) for order in orders]
+
+@api_router.get("/purchase-orders/{order_id}", response_model=PurchaseOrder)
+async def get_purchase_order(order_id: str, store_id: str = Depends(get_store_id)):
+    order = await repo.purchases.get(store_id, "order", order_id)
+    if not order:
+        raise HTTPException(status_code=404, detail="Purchase order not found")
+    return PurchaseOrder(**order)
+
+async def _post_goods_receipt(store_id: str, receipt_id: str) -> dict:
+    """Add a receipt's stock in one bulk write and mark it posted.
+
+    A receipt left in "posting" (a crash, or a conflict reported below) can be
+    posted again: every line carries a marker, so nothing is added twice.
+    """
+    receipt = await repo.purchases.transition(
+        store_id, "receipt", receipt_id, ("draft", "posting"), {"status": "posting"}
+    )
+    if receipt is None:
+        if await repo.purchases.get(store_id, "receipt", receipt_id) is None:
+            raise HTTPException(status_code=404, detail="Goods receipt not found")
+        raise HTTPException(status_code=409, detail="Goods receipt already posted")
+    
+    created: Dict[str, dict] = {}
+    lines = []
+    for index, line in enumerate(receipt["lines"]):
+        batch = {"batch_number": line["batch_number"], "expiry_date": line["expiry_date"], "quantity": line["quantity"]}
+        posting = f"{receipt_id}/{index}"
+        if line["new_medicine"]:
+            medicine = created.get(line["medicine_id"])
+            if medicine is None:
+                medicine = created[line["medicine_id"]] = {**Medicine(
+                    id=line["medicine_id"], store_id=store_id, name=line["medicine_name"], price=line["price"],
+                    stock_quantity=0, expiry_date=line["expiry_date"], batch_number=line["batch_number"],
+                    supplier=receipt["supplier"], barcode=line["barcode"]
+                ).dict(), "postings": []}
+            medicine["batches"].append(batch)
+            medicine["postings"].append(posting)
+        else:
+            lines.append({**batch, "medicine_id": line["medicine_id"], "posting": posting})
+    
+    try:
+        medicines = await repo.medicines.stock_in(
+            store_id, [_with_batches(medicine) for medicine in created.values()], lines
+        )
+    except ValueError as error:
+        # Back to draft; lines added before the conflict are skipped next time
+        await repo.purchases.transition(store_id, "receipt", receipt_id, ("posting",), {"status": "draft"})
+        raise HTTPException(status_code=400, detail=str(error))
+    for medicine in medicines:
+        catalog.put(medicine)
+    await catalog.publish(store_id)
+    
+    posted = await repo.purchases.complete_receipt(store_id, receipt_id, datetime.utcnow())
+    if posted is None:
+        # A concurrent posting of the same receipt finished first
+        return await repo.purchases.get(store_id, "receipt", receipt_id)
+    if posted.get("purchase_order_id"):
+        await repo.purchases.transition(store_id, "order", posted["purchase_order_id"], ("open",), {
+            "status": "received", "received_at": posted["posted_at"], "goods_receipt_id": receipt_id
+        })
+    return posted
+
+@api_router.post("/goods-receipts", response_model=GoodsReceipt)
+async def create_goods_receipt(receipt: GoodsReceiptCreate, store_id: str = Depends(get_store_id)):
+    _check_purchase_lines(receipt.lines)
+    if receipt.purchase_order_id:
+        order = await repo.purchases.get(store_id, "order", receipt.purchase_order_id)
+        if not order:
+            raise HTTPException(status_code=404, detail="Purchase order not found")
+        if order["status"] != PurchaseOrderStatus.OPEN:
+            raise HTTPException(status_code=409, detail="Purchase order already received")
+    
+    # Lines naming the same new medicine become batches of one new medicine
+    new_ids: Dict[str, str] = {}
+    seen = set()
+    for line in receipt.lines:
+        if line.medicine_id:
+            medicine = await _cached_medicine(store_id, line.medicine_id)
+            if not medicine:
+                raise HTTPException(status_code=404, detail=f"Medicine {line.medicine_id} not found")
+            line.medicine_name = medicine["name"]
+            try:
+                storage.receive_batch(medicine, {
+                    "batch_number": line.batch_number, "expiry_date": line.expiry_date.isoformat(), "quantity": 0
+                })
+            except ValueError as error:
+                raise HTTPException(status_code=400, detail=str(error))
+        else:
+            if not line.medicine_name or line.price is None:
+                raise HTTPException(status_code=400, detail="A new medicine needs a medicine_name and price")
+            line.medicine_id = new_ids.setdefault(line.medicine_name.strip().lower(), str(uuid.uuid4()))
+            line.new_medicine = True
+        if (line.medicine_id, line.batch_number) in seen:
+            raise HTTPException(
+                status_code=400, detail=f"Batch {line.batch_number} of {line.medicine_name} appears more than once"
+            )
+        seen.add((line.medicine_id, line.batch_number))
+    
+    receipt_obj = GoodsReceipt(
+        **receipt.dict(exclude={"post"}),
+        store_id=store_id,
+        number=f"GRN{int(datetime.utcnow().timestamp())}",
+        total_units=sum(line.quantity for line in receipt.lines),
+        total_cost=sum(line.quantity * line.unit_cost for line in receipt.lines)
+    )
+    receipt_data = receipt_obj.dict()
+    # Convert date objects to strings for storage
+    for line in receipt_data["lines"]:
+        line["expiry_date"] = line["expiry_date"].isoformat()
+    await repo.purchases.insert(receipt_data)
+    
+    if receipt.post:
+        receipt_data = await _post_goods_receipt(store_id, receipt_obj.id)
+    return GoodsReceipt(**receipt_data)
+
+@api_router.post("/goods-receipts/{receipt_id}/post", response_model=GoodsReceipt)
+async def post_goods_receipt(receipt_id: str, store_id: str = Depends(get_store_id)):
+    return GoodsReceipt(**await _post_goods_receipt(store_id, receipt_id))
+
+@api_router.get("/goods-receipts", response_model=List[GoodsReceipt])
+async def get_goods_receipts(
+    supplier: Optional[str] = Query(None),
+    status: Optional[GoodsReceiptStatus] = Query(None),
+    limit: int = Query(100, ge=1, le=1000),
+    store_id: str = Depends(get_store_id)
+):
+    receipts = await repo.purchases.find(store_id, "receipt", supplier, status.value if status else None, limit)
+    return [GoodsReceipt(**receipt) for receipt in receipts]
+
+@api_router.get("/goods-receipts/{receipt_id}", response_model=GoodsReceipt)
+async def get_goods_receipt(receipt_id: str, store_id: str = Depends(get_store_id)):
+    receipt = await repo.purchases.get(store_id, "receipt", receipt_id)
+    if not receipt:
+        raise HTTPException(status_code=404, detail="Goods receipt not found")
+    return GoodsReceipt(**receipt)
+
+@api_router.get("/suppliers/totals")
+async def get_supplier_totals(store_id: str = Depends(get_store_id)):
+    """Units and cost received per supplier, kept up to date as receipts are posted."""
+    return {"suppliers": await repo.purchases.supplier_totals(store_id)}
+
 # User endpoints
 @api_router.post("/users", response_model=User)
-async def create_user(user: UserCreate):
+async def create_user(user: UserCreate, store_id: str = Depends(get_store_id)):
     # Simple password hashing (in production, use proper hashing)
     import hashlib
     password_hash = hashlib.sha256(user.password.encode()).hexdigest()
@@ -316,19 +1222,20 @@ async def create_user(user: UserCreate):
     user_dict.pop("password")
     user_dict["password_hash"] = password_hash
     
-    user_obj = User(**user_dict)
+    user_obj = User(**user_dict, store_id=store_id)
     
-    # Convert datetime objects to serializable format for MongoDB
+    # Convert datetime objects to serializable format for storage
     user_data = user_obj.dict()
     if isinstance(user_data.get('created_at'), datetime):
         user_data['created_at'] = user_data['created_at'].isoformat()
     
-    await db.users.insert_one(user_data)
+    await repo.users.insert(user_data)
+    _users_cache.pop(store_id, None)
     return user_obj
 
 @api_router.get("/users", response_model=List[User])
-async def get_users():
-    users = await db.users.find().to_list(1000)
+async def get_users(store_id: str = Depends(get_store_id)):
+    users = await repo.users.list(store_id)
     
     # Convert datetime strings back to datetime objects for response
     for user in users:
@@ -338,49 +1245,641 @@ async def get_users():
             except (ValueError, AttributeError):
                 pass
     
-    return [User(**user) for user in users]
+    with tracing.span("build users", "model", count=len(users)):
+        return [User(**user) for user in users]
 
 # Shop details endpoints
+# Per-store cache of shop documents: store_id -> (loaded_at, document or None)
+_shop_cache: Dict[str, Tuple[float, Optional[dict]]] = {}
+
+async def _load_shop(store_id: str) -> Optional[dict]:
+    cached = _shop_cache.get(store_id)
+    if cached and time.monotonic() - cached[0] < SHOP_CACHE_TTL:
+        return cached[1]
+    shop = await repo.shops.get(store_id)
+    if shop:
+        # Convert datetime strings back to datetime objects for response
+        if isinstance(shop.get('updated_at'), str):
+            try:
+                shop['updated_at'] = datetime.fromisoformat(shop['updated_at'])
+            except (ValueError, AttributeError):
+                pass
+    _shop_cache[store_id] = (time.monotonic(), shop)
+    return shop
+
 @api_router.post("/shop", response_model=ShopDetails)
-async def create_or_update_shop(shop: ShopDetails):
-    # Check if shop details already exist
-    existing_shop = await db.shop_details.find_one({})
+async def create_or_update_shop(shop: ShopDetails, store_id: str = Depends(get_store_id)):
+    shop.store_id = store_id
+    # A new version, so receipts and reports cached with the old header are not reused
+    shop.updated_at = datetime.utcnow()
     
-    # Convert datetime objects to serializable format for MongoDB
+    # Convert datetime objects to serializable format for storage
     shop_data = shop.dict()
     if isinstance(shop_data.get('updated_at'), datetime):
         shop_data['updated_at'] = shop_data['updated_at'].isoformat()
     
-    if existing_shop:
-        # Update existing shop details
-        shop.id = existing_shop["id"]
-        shop_data["id"] = existing_shop["id"]
-        await db.shop_details.update_one(
-            {"id": existing_shop["id"]},
-            {"$set": shop_data}
-        )
-    else:
-        # Create new shop details
-        await db.shop_details.insert_one(shop_data)
+    # Existing shop details keep their id
+    saved = await repo.shops.save(shop_data)
+    shop.id = saved["id"]
     
+    _shop_cache.pop(store_id, None)
     return shop
 
 @api_router.get("/shop", response_model=Optional[ShopDetails])
-async def get_shop():
-    shop = await db.shop_details.find_one({})
+async def get_shop(store_id: str = Depends(get_store_id)):
+    shop = await _load_shop(store_id)
     if shop:
-        # Convert datetime strings back to datetime objects for response
-        if isinstance(shop.get('updated_at'), str):
-            try:
-                shop['updated_at'] = datetime.fromisoformat(shop['updated_at'])
-            except (ValueError, AttributeError):
-                pass
         return ShopDetails(**shop)
     return None
 
+# Bootstrap endpoints: everything a till shows on start, in one round trip,
+# trimmed to the fields the frontend renders
+BOOTSTRAP_MEDICINE_FIELDS = ["id", "name", "price", "stock_quantity", "expiry_date", "batch_number", "supplier"]
+BOOTSTRAP_SALE_FIELDS = ["receipt_number", "sale_date", "customer_name", "total_amount", "payment_method", "items"]
+BOOTSTRAP_USER_FIELDS = ["id", "username", "role", "permissions", "is_active", "created_at"]
+BOOTSTRAP_SHOP_FIELDS = ["id", "name", "address", "phone", "email", "license_number", "gst_number"]
+
+# Per-store cache of user lists, like the shop cache: store_id -> (loaded_at, users)
+_users_cache: Dict[str, Tuple[float, List[dict]]] = {}
+
+async def _load_users(store_id: str) -> List[dict]:
+    cached = _users_cache.get(store_id)
+    if cached and time.monotonic() - cached[0] < SHOP_CACHE_TTL:
+        return cached[1]
+    users = [storage.project(user, BOOTSTRAP_USER_FIELDS) for user in await repo.users.list(store_id)]
+    _users_cache[store_id] = (time.monotonic(), users)
+    return users
+
+async def _catalog_medicines(store_id: str) -> List[dict]:
+    """The store's medicines from the catalog cache, by name."""
+    if store_id not in catalog.stores:
+        await catalog.load(store_id)
+    medicines = catalog.stores.get(store_id, {}).values()
+    return sorted(medicines, key=lambda medicine: medicine["name"].lower())
+
+async def _recent_sales(store_id: str) -> List[dict]:
+    sales = await repo.sales.find(store_id, limit=BOOTSTRAP_RECENT_SALES, fields=BOOTSTRAP_SALE_FIELDS)
+    for sale in sales:
+        # The dashboard only shows how many items a sale had
+        sale["item_count"] = len(sale.pop("items"))
+    return sales
+
+def _bootstrap_cursor(store_id: str, as_of: datetime) -> str:
+    """Opaque delta cursor: the catalog delete count and when the response was built."""
+    _, deletes = catalog.versions.get(store_id, (0, 0))
+    return f"{deletes}:{as_of.isoformat()}"
+
+def _updated_after(medicine: dict, since: datetime) -> bool:
+    updated_at = medicine.get("updated_at")
+    if isinstance(updated_at, str):
+        try:
+            updated_at = datetime.fromisoformat(updated_at)
+        except ValueError:
+            return True
+    return not isinstance(updated_at, datetime) or updated_at >= since
+
+@api_router.get("/bootstrap")
+async def get_bootstrap(store_id: str = Depends(get_store_id)):
+    """Medicines, recent sales, analytics, users and shop details in one response."""
+    as_of = datetime.utcnow()
+    medicines, sales, totals, users, shop = await asyncio.gather(
+        _catalog_medicines(store_id), _recent_sales(store_id), repo.sales.totals(store_id),
+        _load_users(store_id), _load_shop(store_id)
+    )
+    return {
+        "cursor": _bootstrap_cursor(store_id, as_of),
+        "medicines": [storage.project(medicine, BOOTSTRAP_MEDICINE_FIELDS) for medicine in medicines],
+        "recent_sales": sales,
+        "analytics": _analytics(totals),
+        "users": users,
+        "shop": storage.project(shop, BOOTSTRAP_SHOP_FIELDS) if shop else None
+    }
+
+@api_router.get("/bootstrap/delta")
+async def get_bootstrap_delta(cursor: str = Query(...), store_id: str = Depends(get_store_id)):
+    """What changed on the dashboard since `cursor`: medicines updated since then,
+    plus fresh recent sales and analytics. Users and shop details are left out.
+
+    When medicines were deleted in the meantime the whole catalog comes back,
+    with `full_catalog` set.
+    """
+    try:
+        deletes_text, since_text = cursor.split(":", 1)
+        deletes, since = int(deletes_text), datetime.fromisoformat(since_text)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid bootstrap cursor")
+    as_of = datetime.utcnow()
+    medicines, sales, totals = await asyncio.gather(
+        _catalog_medicines(store_id), _recent_sales(store_id), repo.sales.totals(store_id)
+    )
+    full_catalog = catalog.versions.get(store_id, (0, 0))[1] != deletes
+    if not full_catalog:
+        # Other workers' writes reach this cache up to a sync interval late, with updated_at from their clock
+        since -= catalog.SYNC_OVERLAP
+        medicines = [medicine for medicine in medicines if _updated_after(medicine, since)]
+    return {
+        "cursor": _bootstrap_cursor(store_id, as_of),
+        "full_catalog": full_catalog,
+        "medicines": [storage.project(medicine, BOOTSTRAP_MEDICINE_FIELDS) for medicine in medicines],
+        "recent_sales": sales,
+        "analytics": _analytics(totals)
+    }
+
+# Receipt and report endpoints
+report_pool: Optional[ProcessPoolExecutor] = None
+# (store_id, kind, key, format, shop version) -> (expires_at or None, rendered artifact)
+_artifact_cache: "OrderedDict[tuple, Tuple[Optional[float], str]]" = OrderedDict()
+
+REPORT_MEDIA_TYPES = {
+    "html": "text/html; charset=utf-8",
+    "text": "text/plain; charset=utf-8",
+    "csv": "text/csv; charset=utf-8"
+}
+
+def _cached_artifact(cache_key: tuple) -> Optional[str]:
+    cached = _artifact_cache.get(cache_key)
+    if cached and (cached[0] is None or cached[0] > time.monotonic()):
+        _artifact_cache.move_to_end(cache_key)
+        return cached[1]
+    return None
+
+async def _render_artifact(cache_key: tuple, ttl: Optional[float], func, *args) -> str:
+    loop = asyncio.get_running_loop()
+    with tracing.span(func.__name__, "render"):
+        rendered = await loop.run_in_executor(report_pool, func, *args)
+    _artifact_cache[cache_key] = (time.monotonic() + ttl if ttl else None, rendered)
+    while len(_artifact_cache) > REPORT_CACHE_SIZE:
+        _artifact_cache.popitem(last=False)
+    return rendered
+
+@api_router.get("/sales/{sale_id}/receipt")
+async def get_sale_receipt(
+    sale_id: str,
+    format: str = Query("html", pattern="^(html|text)$"),
+    store_id: str = Depends(get_store_id)
+):
+    shop = await _load_shop(store_id)
+    cache_key = (store_id, "receipt", sale_id, format, _shop_version(shop))
+    receipt = _cached_artifact(cache_key)
+    if receipt is None:
+        sale = await repo.sales.get(store_id, sale_id)
+        if not sale:
+            raise HTTPException(status_code=404, detail="Sale not found")
+        receipt = await _render_artifact(cache_key, None, reports.render_receipt, sale, shop, format, GST_RATE, SHOP_ZONE)
+    return Response(content=receipt, media_type=REPORT_MEDIA_TYPES[format])
+
+def _shop_today() -> date:
+    return datetime.now(SHOP_ZONE).date() if SHOP_ZONE else date.today()
+
+def _business_day_bounds(day: date) -> Tuple[datetime, datetime]:
+    """First and last instant of a local business day, as naive UTC datetimes."""
+    def to_utc(moment: datetime) -> datetime:
+        # astimezone() reads a naive datetime as host local time
+        local = moment.replace(tzinfo=SHOP_ZONE) if SHOP_ZONE else moment
+        return local.astimezone(timezone.utc).replace(tzinfo=None)
+    start = to_utc(datetime.combine(day, datetime.min.time()))
+    end = to_utc(datetime.combine(day + timedelta(days=1), datetime.min.time()))
+    return start, end - timedelta(microseconds=1)
+
+def _shop_version(shop: Optional[dict]) -> Optional[str]:
+    # Part of artifact cache keys, so an edited shop header reaches cached receipts and reports
+    if not shop:
+        return None
+    updated_at = shop.get("updated_at")
+    return updated_at.isoformat() if isinstance(updated_at, datetime) else updated_at
+
+async def _z_report_data(store_id: str, report_date: date) -> dict:
+    summary = await repo.sales.summary(store_id, *_business_day_bounds(report_date))
+    payments = summary["payments"]
+    receipts = [payment[key] for payment in payments for key in ("first_receipt", "last_receipt")]
+    return {
+        "store_id": store_id,
+        "report_date": report_date.isoformat(),
+        "generated_at": datetime.utcnow().isoformat(),
+        "total_transactions": sum(payment["transactions"] for payment in payments),
+        "total_sales": round(sum(payment["total"] for payment in payments), 2),
+        "first_receipt": min(receipts, default=None),
+        "last_receipt": max(receipts, default=None),
+        "payments": sorted(
+            ({key: payment[key] for key in ("payment_method", "transactions", "total")} for payment in payments),
+            key=lambda payment: payment["payment_method"]
+        ),
+        "items": sorted(summary["items"], key=lambda item: -item["total"])
+    }
+
+@api_router.get("/reports/z-report")
+async def get_z_report(
+    report_date: Optional[date] = Query(None),
+    format: str = Query("html", pattern="^(html|csv)$"),
+    store_id: str = Depends(get_store_id)
+):
+    today = _shop_today()
+    report_date = report_date or today
+    # Closed days never change; the open day is re-rendered after a short TTL
+    ttl = OPEN_DAY_REPORT_TTL if report_date >= today else None
+    shop = await _load_shop(store_id)
+    cache_key = (store_id, "z-report", report_date.isoformat(), format, _shop_version(shop))
+    rendered = _cached_artifact(cache_key)
+    if rendered is None:
+        report = await _z_report_data(store_id, report_date)
+        rendered = await _render_artifact(cache_key, ttl, reports.render_z_report, report, shop, format, GST_RATE)
+    headers = {}
+    if format == "csv":
+        headers["Content-Disposition"] = f'attachment; filename="z-report-{store_id}-{report_date.isoformat()}.csv"'
+    return Response(content=rendered, media_type=REPORT_MEDIA_TYPES[format], headers=headers)
+
+# Maintenance jobs; the sales archive, backups and expiry scan are Mongo specific.
+# The nightly ones run after closing in the scheduler's timezone (see SCHEDULER_TZ).
+@scheduler.job("expiry_scan", cron="15 * * * *", jitter=120, enabled=USE_MONGO)
+async def expiry_scan():
+    today = date.today().isoformat()
+    warning_date = (date.today() + timedelta(days=EXPIRY_WARNING_DAYS)).isoformat()
+    stores = []
+    # expiry_date is stored as an ISO string, so string comparison keeps date order.
+    # One store at a time, so the batch condition goes through (store_id, batches.expiry_date)
+    for store_id in await db.medicines.distinct("store_id"):
+        pipeline = [
+            {"$match": {
+                "store_id": store_id,
+                "batches.expiry_date": {"$lte": warning_date},
+                "expiry_date": {"$lte": warning_date}
+            }},
+            {"$group": {
+                "_id": "$store_id",
+                "expired": {"$sum": {"$cond": [{"$lt": ["$expiry_date", today]}, 1, 0]}},
+                "expiring_soon": {"$sum": {"$cond": [{"$gte": ["$expiry_date", today]}, 1, 0]}}
+            }}
+        ]
+        stores += await db.medicines.aggregate(pipeline).to_list(None)
+    for store in stores:
+        report = {
+            "store_id": store["_id"],
+            "expired": store["expired"],
+            "expiring_soon": store["expiring_soon"],
+            "warning_days": EXPIRY_WARNING_DAYS,
+            "scanned_at": datetime.utcnow()
+        }
+        await db.maintenance_reports.update_one(
+            {"_id": f"expiry_scan:{store['_id']}"}, {"$set": report}, upsert=True
+        )
+    return {
+        "stores": len(stores),
+        "expired": sum(store["expired"] for store in stores),
+        "expiring_soon": sum(store["expiring_soon"] for store in stores)
+    }
+
+async def _refresh_archive_summary(month: str):
+    collection_name = _archive_collection_name(month)
+    pipeline = [{"$group": {
+        "_id": "$store_id",
+        "total_sales": {"$sum": "$total_amount"},
+        "total_transactions": {"$sum": 1},
+        "first_sale": {"$min": "$sale_date"},
+        "last_sale": {"$max": "$sale_date"}
+    }}]
+    for summary in await db[collection_name].aggregate(pipeline).to_list(None):
+        store_id = summary.pop("_id")
+        summary.update({
+            "store_id": store_id,
+            "month": month,
+            "collection": collection_name,
+            "updated_at": datetime.utcnow()
+        })
+        await db.sales_archive_months.update_one(
+            {"_id": f"{store_id}:{month}"}, {"$set": summary}, upsert=True
+        )
+
+async def _archive_store_sales(store_id: str, boundary: str, months: Set[str]) -> int:
+    moved = 0
+    while True:
+        batch = await db.sales.find({"store_id": store_id, "sale_date": {"$lt": boundary}}) \
+            .sort("sale_date", 1).limit(SALES_ARCHIVE_BATCH_SIZE).to_list(SALES_ARCHIVE_BATCH_SIZE)
+        if not batch:
+            break
+        by_month = {}
+        for sale in batch:
+            by_month.setdefault(_month_key(sale["sale_date"]), []).append(sale)
+        for month, sales in by_month.items():
+            archive = db[_archive_collection_name(month)]
+            if month not in months:
+                await storage.ensure_sales_indexes(archive)
+            try:
+                # Original _ids are kept so re-running after a crash is idempotent
+                await archive.insert_many(sales, ordered=False)
+            except BulkWriteError as e:
+                if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                    raise
+            months.add(month)
+        await db.sales.delete_many({"_id": {"$in": [sale["_id"] for sale in batch]}})
+        moved += len(batch)
+    return moved
+
+@scheduler.job("archive_sales", cron="30 2 * * *", jitter=600, lease_seconds=3600, enabled=USE_MONGO)
+async def archive_sales():
+    # Archive whole calendar months so a month never straddles both tiers
+    horizon = date.today() - timedelta(days=SALES_ARCHIVE_DAYS)
+    boundary = horizon.replace(day=1).isoformat()
+    moved = 0
+    months = set()
+    # One store at a time, so every batch is read through the (store_id, sale_date) index
+    for store_id in sorted(await db.sales.distinct("store_id")):
+        moved += await _archive_store_sales(store_id, boundary, months)
+    for month in months:
+        await _refresh_archive_summary(month)
+    return {"moved": moved, "months": sorted(months), "boundary": boundary}
+
+@scheduler.job("catalog_sync", interval=CATALOG_SYNC_SECONDS, exclusive=False)
+async def catalog_sync():
+    return await catalog.sync()
+
+@scheduler.job("sales_snapshot", interval=SNAPSHOT_INTERVAL, jitter=5, exclusive=False)
+async def sales_snapshot_refresh():
+    # Every worker may run this; the snapshot's file lock keeps appends apart
+    store_ids = {DEFAULT_STORE_ID}
+    if SNAPSHOT_DIR.exists():
+        store_ids.update(path.name for path in SNAPSHOT_DIR.iterdir() if path.is_dir())
+    rows = {}
+    for store_id in sorted(store_ids):
+        rows[store_id] = (await refresh_sales_snapshot(store_id))["rows"]
+    return {"rows": rows}
+
+# Weekly full backup with nightly incrementals on top
+@scheduler.job("full_backup", cron="0 3 * * 0", jitter=300, lease_seconds=4 * 3600, enabled=USE_MONGO)
+async def full_backup():
+    manifest = await backup.run_backup(db, incremental=False)
+    return {"id": manifest["id"], "documents": sum(info["documents"] for info in manifest["collections"].values())}
+
+@scheduler.job("incremental_backup", cron="0 3 * * 1-6", jitter=300, lease_seconds=4 * 3600,
+               enabled=USE_MONGO)
+async def incremental_backup():
+    manifest = await backup.run_backup(db, incremental=True)
+    return {"id": manifest["id"], "documents": sum(info["documents"] for info in manifest["collections"].values())}
+
+# Admin endpoints
+@api_router.get("/admin/jobs")
+async def get_jobs():
+    return {"owner": scheduler.owner, "enabled": SCHEDULER_ENABLED, "jobs": scheduler.metrics()}
+
+@api_router.get("/admin/backups")
+async def get_backups():
+    manifests = await asyncio.to_thread(backup.list_backups)
+    return {
+        "running": [name for name in ("full_backup", "incremental_backup") if scheduler.jobs[name].running],
+        "backups": [
+            {
+                "id": manifest["id"],
+                "mode": manifest["mode"],
+                "base": manifest["base"],
+                "created_at": manifest["created_at"],
+                "finished_at": manifest.get("finished_at"),
+                "documents": {name: info["documents"] for name, info in manifest["collections"].items()}
+            }
+            for manifest in manifests
+        ]
+    }
+
+@api_router.post("/admin/backups", status_code=202)
+async def start_backup(mode: str = Query("incremental", pattern="^(full|incremental)$")):
+    job_name = f"{mode}_backup"
+    if not scheduler.jobs[job_name].enabled:
+        raise HTTPException(status_code=409, detail="Backups are only available with the MongoDB storage backend")
+    if scheduler.jobs[job_name].running:
+        raise HTTPException(status_code=409, detail="Backup already running")
+    # Backups outlive the request; progress shows up in /admin/jobs and /admin/backups
+    _in_background(scheduler.trigger(job_name))
+    return {"status": "started", "job": job_name}
+
+@api_router.get("/admin/coalescing")
+async def get_coalescing_metrics():
+    return {"enabled": COALESCE_READS, **read_flights.metrics()}
+
+@api_router.get("/admin/admission")
+async def get_admission_metrics():
+    return {"enabled": ADMISSION_CONTROL, **admission_controller.metrics()}
+
+@api_router.get("/admin/traces")
+async def get_traces():
+    return {"enabled": TRACING_ENABLED, **tracer.metrics()}
+
+@api_router.get("/admin/traces/{request_id}")
+async def get_trace(request_id: str):
+    events = await tracer.events(request_id)
+    if events is None:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    # Loads as-is in chrome://tracing or ui.perfetto.dev
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+@api_router.get("/admin/catalog-cache")
+async def get_catalog_cache_metrics():
+    return catalog.metrics()
+
+@api_router.post("/admin/catalog-cache/reload")
+async def reload_catalog_cache():
+    await catalog.load()
+    return catalog.metrics()
+
+@api_router.post("/admin/jobs/{job_name}/run")
+async def run_job(job_name: str):
+    try:
+        return await scheduler.trigger(job_name)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+# Response compression
+class CompressionMiddleware:
+    """Compresses complete response bodies above `minimum_size`.
+
+    Prefers brotli when installed and accepted by the client, otherwise gzip.
+    Streaming responses are passed through untouched.
+    """
+
+    def __init__(self, app, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    def _encoding(self, scope) -> Optional[str]:
+        accepted = {
+            part.split(";")[0].strip().lower()
+            for part in Headers(scope=scope).get("accept-encoding", "").split(",")
+        }
+        if brotli is not None and "br" in accepted:
+            return "br"
+        if "gzip" in accepted:
+            return "gzip"
+        return None
+
+    def _compress(self, body: bytes, encoding: str) -> bytes:
+        if encoding == "br":
+            return brotli.compress(body, quality=self.brotli_quality)
+        return gzip.compress(body, compresslevel=self.gzip_level)
+
+    async def __call__(self, scope, receive, send):
+        encoding = self._encoding(scope) if scope["type"] == "http" else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start_message, passthrough
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if passthrough or message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            headers = MutableHeaders(raw=start_message["headers"])
+            body = message.get("body", b"")
+            if message.get("more_body") or "content-encoding" in headers or len(body) < self.minimum_size:
+                passthrough = True
+                await send(start_message)
+                await send(message)
+                return
+
+            with tracing.span("compress", "encode", encoding=encoding, size=len(body)):
+                if len(body) > 256 * 1024:
+                    # Keep large payloads from stalling the event loop
+                    compressed = await asyncio.to_thread(self._compress, body, encoding)
+                else:
+                    compressed = self._compress(body, encoding)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(compressed))
+            headers.add_vary_header("Accept-Encoding")
+            await send(start_message)
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_compressed)
+
+# Request coalescing
+class SingleFlight:
+    """Tracks in-flight reads so identical concurrent calls can share one result.
+
+    The first caller for a key leads and publishes its response with
+    `finish`; callers arriving meanwhile `join` and get that response, or
+    None when it could not be shared.
+    """
+
+    def __init__(self):
+        self.in_flight: Dict[tuple, asyncio.Future] = {}
+        self.routes: Dict[str, Dict[str, int]] = {}
+
+    def _count(self, route: str, counter: str):
+        counts = self.routes.setdefault(route, {"leaders": 0, "coalesced": 0, "unshared": 0})
+        counts[counter] += 1
+
+    def leader(self, key: tuple) -> bool:
+        """Register as leader for `key` unless a call is already in flight."""
+        if key in self.in_flight:
+            return False
+        self.in_flight[key] = asyncio.get_running_loop().create_future()
+        self._count(key[0], "leaders")
+        return True
+
+    async def join(self, key: tuple):
+        self._count(key[0], "coalesced")
+        # Shielded so a follower disconnecting does not cancel the shared result
+        return await asyncio.shield(self.in_flight[key])
+
+    def finish(self, key: tuple, result):
+        if result is None:
+            self._count(key[0], "unshared")
+        self.in_flight.pop(key).set_result(result)
+
+    def metrics(self) -> dict:
+        leaders = sum(counts["leaders"] for counts in self.routes.values())
+        coalesced = sum(counts["coalesced"] for counts in self.routes.values())
+        requests = leaders + coalesced
+        return {
+            "in_flight": len(self.in_flight),
+            "requests": requests,
+            "leaders": leaders,
+            "coalesced": coalesced,
+            "hit_rate": round(coalesced / requests, 4) if requests else None,
+            "routes": self.routes
+        }
+
+read_flights = SingleFlight()
+
+class CoalescingMiddleware:
+    """Serves identical concurrent GETs on `paths` from a single execution.
+
+    Requests are keyed by path, sorted query parameters and the headers that
+    change the response (store, encoding, origin). It wraps compression, so
+    followers replay the leader's already encoded body byte for byte, and sits
+    inside tracing, so each follower is traced and tagged under its own
+    request id.
+    """
+
+    VARY_HEADERS = (b"x-store-id", b"accept-encoding", b"origin")
+    # Headers that belong to one request and are never replayed to another
+    PRIVATE_HEADERS = (b"x-request-id",)
+
+    def __init__(self, app, flights: SingleFlight, paths: set):
+        self.app = app
+        self.flights = flights
+        self.paths = paths
+
+    def _shareable(self, message) -> dict:
+        # A copy, since middleware further out set their own headers on the message
+        headers = [(name, value) for name, value in message.get("headers", [])
+                   if name.lower() not in self.PRIVATE_HEADERS]
+        return {**message, "headers": headers}
+
+    def _key(self, scope) -> tuple:
+        query = tuple(sorted(parse_qsl(scope["query_string"].decode("latin-1"), keep_blank_values=True)))
+        headers = dict(scope["headers"])
+        return (scope["path"], query) + tuple(headers.get(name, b"") for name in self.VARY_HEADERS)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "GET" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        key = self._key(scope)
+        if not self.flights.leader(key):
+            with tracing.span("coalesced", "wait"):
+                shared = await self.flights.join(key)
+            if shared is None:
+                # The leader's response could not be shared; run this one on its own
+                await self.app(scope, receive, send)
+                return
+            start_message, body = shared
+            await send(self._shareable(start_message))
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        start_message = None
+        chunks: List[bytes] = []
+
+        async def capture(message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                start_message = self._shareable(message)
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+            await send(message)
+
+        shared = None
+        try:
+            await self.app(scope, receive, capture)
+            # Server errors are likely transient, so followers retry instead of sharing them
+            if start_message is not None and start_message["status"] < 500:
+                shared = (start_message, b"".join(chunks))
+        finally:
+            self.flights.finish(key, shared)
+
 # Include the router in the main app
 app.include_router(api_router)
 
+# Innermost, so shed responses still get CORS headers and queue waits show up in traces
+if ADMISSION_CONTROL:
+    app.add_middleware(admission.AdmissionMiddleware, controller=admission_controller, classify=_admission_class)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -389,6 +1888,18 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=int(os.environ.get('COMPRESSION_MINIMUM_SIZE', '1024'))
+)
+
+if COALESCE_READS:
+    app.add_middleware(CoalescingMiddleware, flights=read_flights, paths=COALESCED_PATHS)
+
+# Outermost, so every request, coalesced followers included, gets its own X-Request-ID
+if TRACING_ENABLED:
+    app.add_middleware(tracing.TracingMiddleware, tracer=tracer)
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -396,6 +1907,46 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+async def _archive_collection_names() -> List[str]:
+    return await db.sales_archive_months.distinct("collection")
+
+async def migrate_default_store():
+    """Assign documents written before multi-store support to the default store."""
+    if await db.migrations.find_one({"_id": "default_store"}):
+        return
+    legacy = {"store_id": {"$exists": False}}
+    for collection_name in ["medicines", "sales", "users", "shop_details"] + await _archive_collection_names():
+        await db[collection_name].update_many(legacy, {"$set": {"store_id": DEFAULT_STORE_ID}})
+    # Archive summaries used to be keyed by month alone
+    for summary in await db.sales_archive_months.find(legacy).to_list(None):
+        await db.sales_archive_months.delete_one({"_id": summary["_id"]})
+        await _refresh_archive_summary(summary["_id"])
+    await db.migrations.insert_one({"_id": "default_store", "store_id": DEFAULT_STORE_ID, "applied_at": datetime.utcnow()})
+
+async def shard_sales_collection():
+    # Only valid against a mongos router with sharding enabled for the database
+    await client.admin.command("enableSharding", db.name)
+    await client.admin.command("shardCollection", f"{db.name}.sales", key=dict(storage.SALES_SHARD_KEY))
+
+@app.on_event("startup")
+async def startup_db_client():
+    if USE_MONGO:
+        await migrate_default_store()
+    await repo.initialize()
+    if USE_MONGO and SHARD_SALES_BY_STORE:
+        await shard_sales_collection()
+    await catalog.load()
+    global report_pool
+    # spawn, not fork: forking a process that already runs Motor's threads is unsafe
+    report_pool = ProcessPoolExecutor(max_workers=REPORT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    if SCHEDULER_ENABLED:
+        await scheduler.start()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    await scheduler.stop()
+    if report_pool:
+        report_pool.shutdown(wait=False, cancel_futures=True)
+    await repo.close()
+    if client:
+        client.close()
\ No newline at end of file
@@ -0,0 +1,317 @@
+"""Columnar sales snapshot for ad hoc analytics.
+
+Every sold line item becomes one row across a set of append-only column files
+(raw little-endian arrays, one file per column) that are memory-mapped for
+queries. Strings are dictionary encoded: the column holds an index into a list
+kept in the store's `meta.json`, next to the row count and the export cursor
+(the sale_date of the last exported sale).
+
+Rows are appended in sale_date order, so a date range is a slice found by
+binary search and every query is a handful of vectorized NumPy passes over
+that slice. Appends write the columns first and `meta.json` last (atomically),
+so readers only ever map rows that are complete; bytes left past the recorded
+row count by a crashed append are cut off by the next append. Each store has
+its own directory and an flock, so worker processes sharing a host can refresh
+it without stepping on each other.
+"""
+import asyncio
+import fcntl
+import json
+import os
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+SNAPSHOT_FORMAT = 1
+
+COLUMNS = {
+    # Seconds since the epoch, UTC (sale_date is a naive UTC timestamp)
+    "sold_at": np.dtype("<i8"),
+    # Running number of the sale within the snapshot, for distinct transaction counts
+    "sale": np.dtype("<i8"),
+    "medicine": np.dtype("<i4"),
+    "quantity": np.dtype("<i4"),
+    "price": np.dtype("<f8"),
+    "total": np.dtype("<f8"),
+    "payment_method": np.dtype("<i2"),
+    "cashier": np.dtype("<i4"),
+}
+
+# Dimension -> (column, dictionary in meta.json, output field)
+DIMENSIONS = {
+    "medicine": ("medicine", "medicines", "medicine_id"),
+    "payment_method": ("payment_method", "payment_methods", "payment_method"),
+    "cashier": ("cashier", "cashiers", "cashier_id"),
+}
+BUCKETS = ("hour", "day", "week", "month")
+EPOCH = datetime(1970, 1, 1)
+# 1970-01-01 was a Thursday; weeks start on Monday
+EPOCH_WEEKDAY = 3
+
+
+def epoch_seconds(moment: datetime) -> int:
+    return int((moment - EPOCH).total_seconds())
+
+
+def _empty_meta() -> dict:
+    return {
+        "format": SNAPSHOT_FORMAT, "rows": 0, "sales": 0, "cursor": None, "refreshed_at": None,
+        "medicines": [], "medicine_names": [], "payment_methods": [], "cashiers": []
+    }
+
+
+class SalesSnapshot:
+    """One store's snapshot directory."""
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+
+    def _path(self, column: str) -> Path:
+        return self.directory / f"{column}.col"
+
+    def meta(self) -> dict:
+        try:
+            return json.loads((self.directory / "meta.json").read_text())
+        except FileNotFoundError:
+            return _empty_meta()
+
+    def _write_meta(self, meta: dict):
+        temporary = self.directory / "meta.json.tmp"
+        temporary.write_text(json.dumps(meta))
+        os.replace(temporary, self.directory / "meta.json")
+
+    @contextmanager
+    def _locked(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with open(self.directory / ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def append(self, sales: List[dict], cursor: Optional[str], refreshed_at: datetime) -> Optional[dict]:
+        """Append `sales` (oldest first, all after `cursor`) and advance the cursor.
+
+        Returns the new meta, or None when another process moved the cursor
+        since `cursor` was read; the caller then re-reads and scans again.
+        """
+        with self._locked():
+            meta = self.meta()
+            if meta["cursor"] != cursor:
+                return None
+            codes = {
+                name: {value: index for index, value in enumerate(meta[name])}
+                for name in ("medicines", "payment_methods", "cashiers")
+            }
+
+            def encode(name: str, value: str) -> int:
+                index = codes[name].get(value)
+                if index is None:
+                    index = codes[name][value] = len(meta[name])
+                    meta[name].append(value)
+                    if name == "medicines":
+                        meta["medicine_names"].append(None)
+                return index
+
+            rows = {column: [] for column in COLUMNS}
+            for number, sale in enumerate(sales, start=meta["sales"]):
+                sold_at = epoch_seconds(datetime.fromisoformat(sale["sale_date"]))
+                payment_method = encode("payment_methods", sale["payment_method"])
+                cashier = encode("cashiers", sale["cashier_id"])
+                for item in sale["items"]:
+                    medicine = encode("medicines", item["medicine_id"])
+                    # The name as last sold wins
+                    meta["medicine_names"][medicine] = item["medicine_name"]
+                    rows["sold_at"].append(sold_at)
+                    rows["sale"].append(number)
+                    rows["medicine"].append(medicine)
+                    rows["quantity"].append(item["quantity"])
+                    rows["price"].append(item["price"])
+                    rows["total"].append(item["total"])
+                    rows["payment_method"].append(payment_method)
+                    rows["cashier"].append(cashier)
+
+            added = len(rows["sold_at"])
+            for column, dtype in COLUMNS.items():
+                with open(self._path(column), "ab") as handle:
+                    # Drop whatever a crashed append left past the committed rows
+                    handle.truncate(meta["rows"] * dtype.itemsize)
+                    handle.write(np.asarray(rows[column], dtype=dtype).tobytes())
+                    handle.flush()
+                    os.fsync(handle.fileno())
+            meta["rows"] += added
+            meta["sales"] += len(sales)
+            if sales:
+                meta["cursor"] = sales[-1]["sale_date"]
+            meta["refreshed_at"] = refreshed_at.isoformat()
+            self._write_meta(meta)
+            return meta
+
+    def columns(self, meta: dict) -> Dict[str, np.ndarray]:
+        """Read-only memory maps of the first meta["rows"] rows of every column."""
+        if not meta["rows"]:
+            return {column: np.empty(0, dtype) for column, dtype in COLUMNS.items()}
+        return {
+            column: np.memmap(self._path(column), dtype=dtype, mode="r", shape=(meta["rows"],))
+            for column, dtype in COLUMNS.items()
+        }
+
+    def query(self, start_date: Optional[date] = None, end_date: Optional[date] = None,
+              group_by: Optional[List[str]] = None, bucket: Optional[str] = None,
+              filters: Optional[Dict[str, List[str]]] = None, limit: int = 1000) -> dict:
+        meta = self.meta()
+        return evaluate(meta, self.columns(meta), start_date, end_date, group_by or [], bucket, filters or {}, limit)
+
+
+def _bucket_starts(sold_at: np.ndarray, bucket: str) -> np.ndarray:
+    """The epoch second each row's time bucket starts at."""
+    if bucket == "hour":
+        return sold_at - sold_at % 3600
+    if bucket == "day":
+        return sold_at - sold_at % 86400
+    if bucket == "week":
+        days = sold_at // 86400
+        return (days - (days + EPOCH_WEEKDAY) % 7) * 86400
+    months = sold_at.astype("datetime64[s]").astype("datetime64[M]")
+    return months.astype("datetime64[s]").astype(np.int64)
+
+
+def _bucket_label(start: int, bucket: str) -> str:
+    moment = EPOCH + timedelta(seconds=int(start))
+    if bucket == "hour":
+        return moment.strftime("%Y-%m-%dT%H:00")
+    if bucket == "month":
+        return moment.strftime("%Y-%m")
+    return moment.date().isoformat()
+
+
+def evaluate(meta: dict, columns: Dict[str, np.ndarray], start_date: Optional[date], end_date: Optional[date],
+             group_by: List[str], bucket: Optional[str], filters: Dict[str, List[str]], limit: int) -> dict:
+    """Filter, bucket and group the snapshot rows; groups come back by revenue, highest first
+    (by bucket first when bucketing)."""
+    # Rows are in sale_date order, so the date range is a slice
+    sold_at = columns["sold_at"]
+    low = np.searchsorted(sold_at, epoch_seconds(datetime.combine(start_date, datetime.min.time())), "left") \
+        if start_date else 0
+    high = np.searchsorted(sold_at, epoch_seconds(datetime.combine(end_date + timedelta(days=1),
+                                                                   datetime.min.time())), "left") \
+        if end_date else len(sold_at)
+    selected = {column: values[low:high] for column, values in columns.items()}
+
+    mask = None
+    for dimension, values in filters.items():
+        column, dictionary, _ = DIMENSIONS[dimension]
+        codes = {value: index for index, value in enumerate(meta[dictionary])}
+        wanted = np.array([codes[value] for value in values if value in codes], dtype=COLUMNS[column])
+        matches = np.isin(selected[column], wanted)
+        mask = matches if mask is None else mask & matches
+    if mask is not None:
+        selected = {column: values[mask] for column, values in selected.items()}
+
+    # One int64 key per row: the group columns packed in mixed radix
+    keys = np.zeros(len(selected["sold_at"]), dtype=np.int64)
+    radices = []
+    if bucket:
+        starts = _bucket_starts(selected["sold_at"], bucket)
+        first = int(starts.min()) if len(starts) else 0
+        span = int(starts.max()) - first + 1 if len(starts) else 1
+        keys = starts - first
+        radices.append(("bucket", span))
+    for dimension in group_by:
+        column, dictionary, _ = DIMENSIONS[dimension]
+        size = max(len(meta[dictionary]), 1)
+        keys = keys * size + selected[column]
+        radices.append((dimension, size))
+
+    span = int(np.prod([size for _, size in radices], dtype=np.int64))
+    if span <= 4 * len(keys) + 1024:
+        # Few possible keys: number the groups by counting rather than sorting
+        present = np.flatnonzero(np.bincount(keys, minlength=span))
+        numbering = np.zeros(span, dtype=np.int64)
+        numbering[present] = np.arange(len(present))
+        groups, inverse = present, numbering[keys]
+    else:
+        groups, inverse = np.unique(keys, return_inverse=True)
+    quantity = np.bincount(inverse, weights=selected["quantity"], minlength=len(groups))
+    revenue = np.bincount(inverse, weights=selected["total"], minlength=len(groups))
+    lines = np.bincount(inverse, minlength=len(groups))
+    # Distinct sales per group. Rows are in sale order, so (sale, group) pairs are
+    # only out of order within a sale and a stable sort puts them in order cheaply.
+    pairs = np.sort(selected["sale"] * len(groups) + inverse, kind="stable")
+    distinct = np.ones(len(pairs), dtype=bool)
+    distinct[1:] = pairs[1:] != pairs[:-1]
+    transactions = np.bincount(pairs[distinct] % max(len(groups), 1), minlength=len(groups))
+
+    decoded = {}
+    remainder = groups
+    for name, size in reversed(radices):
+        remainder, decoded[name] = np.divmod(remainder, size)
+
+    order = np.argsort(-revenue, kind="stable")
+    if bucket:
+        order = order[np.argsort(decoded["bucket"][order], kind="stable")]
+    rows = []
+    for index in order[:limit].tolist():
+        row = {}
+        if bucket:
+            row["bucket"] = _bucket_label(first + int(decoded["bucket"][index]), bucket)
+        for dimension in group_by:
+            code = int(decoded[dimension][index])
+            _, dictionary, field = DIMENSIONS[dimension]
+            row[field] = meta[dictionary][code]
+            if dimension == "medicine":
+                row["medicine_name"] = meta["medicine_names"][code]
+        row.update({
+            "quantity": int(quantity[index]),
+            "revenue": round(float(revenue[index]), 2),
+            "lines": int(lines[index]),
+            "transactions": int(transactions[index]),
+        })
+        rows.append(row)
+    return {
+        "rows_scanned": int(high - low),
+        "rows_matched": len(selected["sold_at"]),
+        "groups": len(groups),
+        "results": rows,
+        "as_of": meta["cursor"],
+        "refreshed_at": meta["refreshed_at"],
+    }
+
+
+async def refresh(snapshot: SalesSnapshot, sales, store_id: str, until: datetime, batch_size: int,
+                  max_batches: Optional[int] = None) -> dict:
+    """Append every sale up to `until` that the snapshot does not hold yet.
+
+    `sales` is the SaleRepository to read from; file work runs in a thread.
+    With `max_batches`, stop after that many appends even if more sales are
+    waiting, so a caller can bound how long it blocks.
+    """
+    until_text = until.isoformat()
+    meta = await asyncio.to_thread(snapshot.meta)
+    appends = 0
+    while True:
+        cursor = meta["cursor"]
+        batch = await sales.scan(store_id, cursor, until_text, batch_size)
+        full = len(batch) == batch_size
+        if full:
+            last = batch[-1]["sale_date"]
+            if batch[0]["sale_date"] == last:
+                # A whole batch of one timestamp: take every sale at it in one go
+                batch = await sales.scan(store_id, cursor, last)
+            else:
+                # The cursor is a timestamp, so sales sharing the last one are taken together next time
+                batch = [sale for sale in batch if sale["sale_date"] != last]
+        appended = await asyncio.to_thread(snapshot.append, batch, cursor, datetime.utcnow())
+        if appended is None:
+            # Another worker got there first; carry on from where it left off
+            meta = await asyncio.to_thread(snapshot.meta)
+            continue
+        meta = appended
+        appends += 1
+        if not full or (max_batches is not None and appends >= max_batches):
+            return meta
@@ -0,0 +1,2020 @@
+"""Storage backends for medicines, sales, users and shop details.
+
+Handlers in server.py talk to a `Repository`, which groups one repository per
+entity. `MongoRepository` is the Motor implementation used by multi-store
+deployments, including the monthly sales archive tier. `SQLiteRepository` is
+an embedded implementation for single-shop edge installs: one WAL-mode
+database file whose blocking calls run on a small thread pool.
+
+Documents go in and come out as plain dicts shaped exactly like the Mongo
+documents (without `_id`), so callers never need to know which backend is in
+use.
+"""
+import asyncio
+import json
+import sqlite3
+import threading
+import uuid
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pymongo import ReturnDocument, UpdateOne
+
+
+# Range shard key for `sales`: queries always lead with store_id so they stay
+# targeted to one shard, and sale_date spreads a busy store across chunks
+SALES_SHARD_KEY = [("store_id", 1), ("sale_date", 1)]
+# What SaleRepository.scan returns of each sale: enough for the analytics snapshot
+SCAN_FIELDS = ["id", "sale_date", "payment_method", "cashier_id", "items"]
+
+
+def sale_date_bounds(start_date: Optional[date], end_date: Optional[date]) -> dict:
+    """Inclusive sale_date bounds. Dates cover whole UTC days; datetimes (naive
+    UTC) are used as they are, e.g. for a business day in the shop's timezone."""
+    # sale_date is stored as an ISO string, so bounds are compared as strings too
+    bounds = {}
+    if start_date:
+        if not isinstance(start_date, datetime):
+            start_date = datetime.combine(start_date, datetime.min.time())
+        bounds["$gte"] = start_date.isoformat()
+    if end_date:
+        if not isinstance(end_date, datetime):
+            end_date = datetime.combine(end_date, datetime.max.time())
+        bounds["$lte"] = end_date.isoformat()
+    return bounds
+
+
+def project(document: dict, fields: Optional[Iterable[str]]) -> dict:
+    if not fields:
+        return document
+    return {key: value for key, value in document.items() if key in fields}
+
+
+def bulk_rejection(patch: dict, medicine: Optional[dict]) -> Optional[str]:
+    """Why a bulk update line does not apply to `medicine`, or None if it does."""
+    if medicine is None:
+        return "not_found"
+    expected = patch.get("expected_updated_at")
+    if expected is not None and medicine.get("updated_at") != expected:
+        return "modified"
+    delta = patch.get("stock_delta")
+    if delta and medicine["stock_quantity"] + delta < 0:
+        return "insufficient_stock"
+    return None
+
+
+def _empty_medicine_totals() -> dict:
+    return {"quantity_sold": 0, "revenue": 0, "transactions": 0, "first_sale": None, "last_sale": None}
+
+
+def batches_of(medicine: dict) -> List[dict]:
+    # Medicines stored before batches existed are one implicit batch
+    if medicine.get("batches") is None:
+        return [{
+            "batch_number": medicine["batch_number"],
+            "expiry_date": medicine["expiry_date"],
+            "quantity": medicine["stock_quantity"]
+        }]
+    return medicine["batches"]
+
+
+def with_batches(medicine: dict) -> dict:
+    """Sort the batches earliest expiry first and derive the top-level stock fields.
+
+    stock_quantity is the total over all batches; expiry_date and batch_number
+    describe the batch that sells next, the earliest one with stock left.
+    """
+    batches = sorted(batches_of(medicine), key=lambda batch: (batch["expiry_date"], batch["batch_number"]))
+    medicine = {**medicine, "batches": batches, "stock_quantity": sum(batch["quantity"] for batch in batches)}
+    current = next((batch for batch in batches if batch["quantity"] > 0), batches[0] if batches else None)
+    if current:
+        medicine["expiry_date"] = current["expiry_date"]
+        medicine["batch_number"] = current["batch_number"]
+    return medicine
+
+
+def sellable_stock(medicine: dict, today: str) -> int:
+    """Units in batches that have not expired by `today` (an ISO date)."""
+    return sum(batch["quantity"] for batch in batches_of(medicine) if batch["expiry_date"] >= today)
+
+
+def allocate_batches(medicine: dict, quantity: int, today: Optional[str] = None) -> Tuple[dict, List[dict]]:
+    """Take `quantity` units earliest expiry first (FEFO).
+
+    With `today` (an ISO date), batches that expired before it are skipped, so
+    sales never take expired lots; adjustments pass None and may take any.
+    Returns the updated medicine and the consumed {batch_number, expiry_date,
+    quantity} parts. Walks the batches in stored order, exactly like the Mongo
+    update pipeline, so both compute the same allocation.
+    """
+    remaining, batches, taken = quantity, [], []
+    for batch in batches_of(medicine):
+        expired = today is not None and batch["expiry_date"] < today
+        take = 0 if expired else min(remaining, batch["quantity"])
+        remaining -= take
+        batches.append({**batch, "quantity": batch["quantity"] - take})
+        if take:
+            taken.append({"batch_number": batch["batch_number"], "expiry_date": batch["expiry_date"], "quantity": take})
+    return with_batches({**medicine, "batches": batches}), taken
+
+
+def return_batches(medicine: dict, taken: List[dict]) -> dict:
+    """Put allocated units back into the batches they came from."""
+    returned = {part["batch_number"]: part for part in taken}
+    batches = []
+    for batch in batches_of(medicine):
+        part = returned.pop(batch["batch_number"], None)
+        batches.append({**batch, "quantity": batch["quantity"] + part["quantity"]} if part else batch)
+    # A batch removed in the meantime comes back with what was taken from it
+    batches += [dict(part) for part in returned.values()]
+    return with_batches({**medicine, "batches": batches})
+
+
+def receive_batch(medicine: dict, batch: dict) -> dict:
+    """Add a received lot, topping up the batch with the same number if there is one."""
+    batches = list(batches_of(medicine))
+    for index, existing in enumerate(batches):
+        if existing["batch_number"] == batch["batch_number"]:
+            if existing["expiry_date"] != batch["expiry_date"]:
+                raise ValueError(
+                    f"Batch {batch['batch_number']} is already stocked with expiry {existing['expiry_date']}"
+                )
+            batches[index] = {**existing, "quantity": existing["quantity"] + batch["quantity"]}
+            break
+    else:
+        batches.append(dict(batch))
+    return with_batches({**medicine, "batches": batches})
+
+
+def change_stock(medicine: dict, delta: int) -> dict:
+    """Apply an adjustment that names no batch.
+
+    Removals are taken earliest expiry first; additions go to the batch with
+    the latest expiry, normally the most recently received one.
+    """
+    if delta < 0:
+        return allocate_batches(medicine, -delta)[0]
+    if delta > 0:
+        batches = list(batches_of(medicine))
+        batches[-1] = {**batches[-1], "quantity": batches[-1]["quantity"] + delta}
+        return with_batches({**medicine, "batches": batches})
+    return medicine
+
+
+def apply_patch(medicine: dict, patch: dict, applied_at: datetime) -> dict:
+    """The medicine after one bulk update line (see MedicineRepository.bulk_update)."""
+    changes = dict(patch.get("set", {}))
+    stock_quantity = changes.pop("stock_quantity", None)
+    expiry_date = changes.pop("expiry_date", None)
+    medicine = {**medicine, **changes, "updated_at": applied_at}
+    if expiry_date is not None:
+        # A single expiry date corrects the batch currently on sale
+        medicine = with_batches({**medicine, "batches": [
+            {**batch, "expiry_date": expiry_date} if batch["batch_number"] == medicine["batch_number"] else batch
+            for batch in batches_of(medicine)
+        ]})
+    if stock_quantity is not None:
+        return change_stock(medicine, stock_quantity - medicine["stock_quantity"])
+    return change_stock(medicine, patch.get("stock_delta") or 0)
+
+
+# Goods-receipt lines already added to a medicine are remembered by their
+# posting marker, so re-posting a receipt never adds a line twice
+POSTINGS_KEPT = 100
+
+
+def receive_line(medicine: dict, line: dict, applied_at: datetime) -> dict:
+    """The medicine after one goods-receipt line (see MedicineRepository.stock_in)."""
+    medicine = receive_batch(medicine, {field: line[field] for field in ("batch_number", "expiry_date", "quantity")})
+    postings = (medicine.get("postings") or []) + [line["posting"]]
+    return {**medicine, "postings": postings[-POSTINGS_KEPT:], "updated_at": applied_at}
+
+
+# Fields rewritten by every stock change
+STOCK_FIELDS = ("batches", "stock_quantity", "expiry_date", "batch_number", "updated_at")
+
+# Inventory counters are kept per (store, supplier, expiry date) bucket
+COUNTER_FIELDS = ("skus", "in_stock", "units", "value")
+
+
+def valuation_entries(medicine: Optional[dict]) -> Dict[tuple, dict]:
+    """A medicine's contribution to the inventory counters, keyed by (supplier, expiry_date).
+
+    Units and value count under each batch's own expiry date; the medicine
+    counts as one SKU under the expiry of the batch on sale.
+    """
+    if not medicine:
+        return {}
+    entries: Dict[tuple, dict] = {}
+    current = entries.setdefault((medicine["supplier"], medicine["expiry_date"]), dict.fromkeys(COUNTER_FIELDS, 0))
+    current["skus"] = 1
+    current["in_stock"] = int(medicine["stock_quantity"] > 0)
+    for batch in batches_of(medicine):
+        entry = entries.setdefault((medicine["supplier"], batch["expiry_date"]), dict.fromkeys(COUNTER_FIELDS, 0))
+        entry["units"] += batch["quantity"]
+        entry["value"] += medicine["price"] * batch["quantity"]
+    return entries
+
+
+def counter_deltas(before: Optional[dict], after: Optional[dict]) -> Dict[tuple, dict]:
+    """Counter increments that turn `before`'s contribution into `after`'s."""
+    deltas: Dict[tuple, dict] = {}
+    _merge_deltas(deltas, valuation_entries(before), -1)
+    _merge_deltas(deltas, valuation_entries(after))
+    return {key: delta for key, delta in deltas.items() if any(delta.values())}
+
+
+def _merge_deltas(into: Dict[tuple, dict], deltas: Dict[tuple, dict], sign: int = 1):
+    for key, delta in deltas.items():
+        merged = into.setdefault(key, dict.fromkeys(COUNTER_FIELDS, 0))
+        for field in COUNTER_FIELDS:
+            merged[field] += sign * delta[field]
+
+
+class MedicineRepository(ABC):
+    @abstractmethod
+    async def insert(self, medicine: dict) -> None: ...
+
+    @abstractmethod
+    async def get(self, store_id: str, medicine_id: str) -> Optional[dict]: ...
+
+    @abstractmethod
+    async def search(self, store_id: str, search: Optional[str] = None,
+                     fields: Optional[List[str]] = None, limit: int = 1000) -> List[dict]:
+        """Medicines whose name or barcode contains `search` (case-insensitive)."""
+
+    @abstractmethod
+    async def all(self, store_id: Optional[str] = None) -> List[dict]:
+        """Every medicine of one store, or of all stores."""
+
+    @abstractmethod
+    async def updated_since(self, store_id: str, since: datetime) -> List[dict]: ...
+
+    @abstractmethod
+    async def update(self, store_id: str, medicine_id: str, changes: dict) -> Optional[dict]:
+        """Apply `changes` and return the updated medicine, or None if it does not exist."""
+
+    @abstractmethod
+    async def delete(self, store_id: str, medicine_id: str) -> bool: ...
+
+    @abstractmethod
+    async def allocate(self, store_id: str, medicine_id: str, quantity: int) -> Optional[Tuple[dict, List[dict]]]:
+        """Atomically take `quantity` units earliest expiry first, in one write.
+
+        Batches that expired before today are never sold. Returns the updated
+        medicine and the consumed batches (see `allocate_batches`), or None when
+        the medicine does not exist or has less than `quantity` unexpired units.
+        """
+
+    @abstractmethod
+    async def release(self, store_id: str, medicine_id: str, taken: List[dict]) -> Optional[dict]:
+        """Return units taken by `allocate` to their batches."""
+
+    @abstractmethod
+    async def receive(self, store_id: str, medicine_id: str, batch: dict) -> Optional[dict]:
+        """Add a received lot (see `receive_batch`); None if the medicine does not exist."""
+
+    @abstractmethod
+    async def stock_in(self, store_id: str, created: List[dict], lines: List[dict]) -> List[dict]:
+        """Post received stock: insert the `created` medicines and add every line's
+        {medicine_id, batch_number, expiry_date, quantity, posting} batch to its medicine.
+
+        Lines are added on top of whatever concurrent sales leave, never by
+        overwriting the stock. Each line's `posting` marker is remembered on the
+        medicine (new medicines arrive with theirs), so posting the same lines
+        again adds nothing twice. Returns the touched medicines as stored.
+
+        Raises ValueError for a missing medicine or a batch number already
+        stocked with another expiry. Lines are checked before the first write;
+        if a later round still fails, what was added stays marked and the same
+        lines can be posted again.
+        """
+
+    @abstractmethod
+    async def bulk_update(self, store_id: str, patches: List[dict]) -> dict:
+        """Apply many partial updates at once.
+
+        Each patch is {"id", "set": {field: value}, "stock_delta": int or None,
+        "expected_updated_at": datetime or None}. A line only applies while the
+        medicine's updated_at still equals expected_updated_at (when given) and
+        a negative stock_delta would not take stock below zero. Stock changes
+        are spread over the batches by `apply_patch`.
+
+        Returns {"updated": [medicine], "rejected": [{"id", "reason", "updated_at"}]}
+        where reason is "not_found", "modified" or "insufficient_stock".
+        """
+
+    @abstractmethod
+    async def bump_version(self, store_id: str, deleted: bool = False) -> dict:
+        """Increment the store's catalog version; returns {store_id, version, deletes}."""
+
+    @abstractmethod
+    async def versions(self, store_id: Optional[str] = None) -> List[dict]: ...
+
+
+class SaleRepository(ABC):
+    @abstractmethod
+    async def insert(self, sale: dict) -> None: ...
+
+    @abstractmethod
+    async def get(self, store_id: str, sale_id: str) -> Optional[dict]: ...
+
+    @abstractmethod
+    async def find(self, store_id: str, start_date: Optional[date] = None, end_date: Optional[date] = None,
+                   medicine_id: Optional[str] = None, medicine_name: Optional[str] = None,
+                   limit: int = 100, fields: Optional[List[str]] = None,
+                   customer_phone: Optional[str] = None) -> List[dict]:
+        """Sales newest first."""
+
+    @abstractmethod
+    async def totals(self, store_id: str, start_date: Optional[date] = None,
+                     end_date: Optional[date] = None) -> dict:
+        """{total_sales, total_transactions} over the range."""
+
+    @abstractmethod
+    async def medicine_totals(self, store_id: str, medicine_id: str, start_date: Optional[date] = None,
+                              end_date: Optional[date] = None) -> dict:
+        """{quantity_sold, revenue, transactions, first_sale, last_sale} for one medicine."""
+
+    @abstractmethod
+    async def summary(self, store_id: str, start_date: Optional[date], end_date: Optional[date]) -> dict:
+        """Per payment method and per medicine breakdown, as used by the Z-report.
+
+        The bounds may be datetimes (naive UTC), see sale_date_bounds. Returns {"payments": [{payment_method, transactions, total, first_receipt,
+        last_receipt}], "items": [{medicine_id, medicine_name, quantity, total}]}.
+        """
+
+    @abstractmethod
+    async def scan(self, store_id: str, after: Optional[str], until: str,
+                   limit: Optional[int] = None) -> List[dict]:
+        """Sales with `after` < sale_date <= `until` (ISO strings), oldest first, with SCAN_FIELDS only."""
+
+
+class CustomerRepository(ABC):
+    @abstractmethod
+    async def record_sale(self, sale: dict, recent_limit: int) -> dict:
+        """Fold a sale into its customer's profile and return the updated profile.
+
+        The profile keeps running totals plus the `recent_limit` newest sale
+        summaries, newest first.
+        """
+
+    @abstractmethod
+    async def get(self, store_id: str, phone: str) -> Optional[dict]: ...
+
+
+class InventoryRepository(ABC):
+    """Stock valuation counters.
+
+    The medicine repository keeps these in step with every insert, update,
+    delete and stock change, so reads cost one row per (supplier, expiry date)
+    bucket rather than a scan of the catalog. Rows are {supplier, expiry_date,
+    skus, in_stock, units, value}.
+    """
+
+    @abstractmethod
+    async def counters(self, store_id: str) -> List[dict]: ...
+
+    @abstractmethod
+    async def recompute(self, store_id: str) -> List[dict]:
+        """The same rows aggregated from the medicines themselves."""
+
+    @abstractmethod
+    async def replace(self, store_id: str, rows: List[dict]) -> None:
+        """Overwrite the store's counters, e.g. with the output of `recompute`."""
+
+
+class PurchaseRepository(ABC):
+    """Purchase orders and goods-receipt notes, plus running totals per supplier.
+
+    Both are documents with a `kind` ("order" or "receipt") and a `status`.
+    Orders go open -> received; receipts go draft -> posting -> posted, and
+    their stock is added by `MedicineRepository.stock_in`.
+    """
+
+    @abstractmethod
+    async def insert(self, document: dict) -> None: ...
+
+    @abstractmethod
+    async def get(self, store_id: str, kind: str, document_id: str) -> Optional[dict]: ...
+
+    @abstractmethod
+    async def find(self, store_id: str, kind: str, supplier: Optional[str] = None,
+                   status: Optional[str] = None, limit: int = 100) -> List[dict]:
+        """Newest first."""
+
+    @abstractmethod
+    async def transition(self, store_id: str, kind: str, document_id: str, statuses: Iterable[str],
+                         changes: dict) -> Optional[dict]:
+        """Apply `changes` only while the document's status is one of `statuses`.
+
+        Every transition also moves the document's updated_at, the watermark
+        for incremental backups. Returns the updated document, or None if it
+        is missing or in another status.
+        """
+
+    @abstractmethod
+    async def complete_receipt(self, store_id: str, receipt_id: str, posted_at: datetime) -> Optional[dict]:
+        """Mark a posting receipt posted and add it to its supplier's totals, exactly once."""
+
+    @abstractmethod
+    async def supplier_totals(self, store_id: str) -> List[dict]:
+        """Rows of {supplier, receipts, units, cost, last_received_at}."""
+
+
+def supplier_increments(receipt: dict) -> dict:
+    return {
+        "receipts": 1,
+        "units": sum(line["quantity"] for line in receipt["lines"]),
+        "cost": sum(line["quantity"] * line["unit_cost"] for line in receipt["lines"])
+    }
+
+
+def sale_summary(sale: dict) -> dict:
+    """The part of a sale embedded in a customer profile."""
+    return {
+        "sale_id": sale["id"],
+        "receipt_number": sale["receipt_number"],
+        "sale_date": sale["sale_date"],
+        "total_amount": sale["total_amount"],
+        "items": [
+            {"medicine_id": item["medicine_id"], "medicine_name": item["medicine_name"], "quantity": item["quantity"]}
+            for item in sale["items"]
+        ]
+    }
+
+
+class UserRepository(ABC):
+    @abstractmethod
+    async def insert(self, user: dict) -> None: ...
+
+    @abstractmethod
+    async def list(self, store_id: str, limit: int = 1000) -> List[dict]: ...
+
+
+class ShopRepository(ABC):
+    @abstractmethod
+    async def get(self, store_id: str) -> Optional[dict]: ...
+
+    @abstractmethod
+    async def save(self, shop: dict) -> dict:
+        """Create or replace the store's shop details, keeping the existing id."""
+
+
+class Repository(ABC):
+    backend: str
+    medicines: MedicineRepository
+    sales: SaleRepository
+    customers: CustomerRepository
+    inventory: InventoryRepository
+    purchases: PurchaseRepository
+    users: UserRepository
+    shops: ShopRepository
+
+    @abstractmethod
+    async def initialize(self) -> None:
+        """Create schema and indexes."""
+
+    async def close(self) -> None:
+        pass
+
+
+# MongoDB
+
+async def ensure_sales_indexes(collection):
+    # Every sales index leads with store_id, so the same indexes back the shard key
+    await collection.create_index(SALES_SHARD_KEY)
+    # Multikey index: one entry per line item, used by medicine_id lookups
+    await collection.create_index([("store_id", 1), ("items.medicine_id", 1), ("sale_date", -1)])
+    await collection.create_index([("store_id", 1), ("id", 1)])
+    # Only sales with a customer phone are indexed for customer history
+    await collection.create_index(
+        [("store_id", 1), ("customer_phone", 1), ("sale_date", -1)],
+        partialFilterExpression={"customer_phone": {"$type": "string"}}
+    )
+
+
+def _bson_datetime(value: datetime) -> datetime:
+    return value.replace(microsecond=value.microsecond // 1000 * 1000)
+
+
+def _sellable_filter(quantity: int, today: str) -> dict:
+    """Matches a medicine with at least `quantity` units in unexpired batches."""
+    return {"$expr": {"$gte": [{"$reduce": {
+        "input": "$batches",
+        "initialValue": 0,
+        "in": {"$add": ["$$value", {"$cond": [{"$lt": ["$$this.expiry_date", today]}, 0, "$$this.quantity"]}]}
+    }}, quantity]}}
+
+
+def _fefo_pipeline(quantity: int, now: datetime, today: str) -> List[dict]:
+    """Update pipeline taking `quantity` units from the batches in array order.
+
+    The array is kept sorted earliest expiry first, so one $reduce pass is
+    FEFO however many batches there are, and the whole allocation is a single
+    atomic write. Batches expired before `today` are passed over. Mirrors
+    `allocate_batches`.
+    """
+    allocation = {"$reduce": {
+        "input": "$batches",
+        "initialValue": {"remaining": quantity, "batches": []},
+        "in": {"$let": {
+            "vars": {"take": {"$cond": [
+                {"$lt": ["$$this.expiry_date", today]}, 0, {"$min": ["$$value.remaining", "$$this.quantity"]}
+            ]}},
+            "in": {
+                "remaining": {"$subtract": ["$$value.remaining", "$$take"]},
+                "batches": {"$concatArrays": ["$$value.batches", [
+                    {"$mergeObjects": ["$$this", {"quantity": {"$subtract": ["$$this.quantity", "$$take"]}}]}
+                ]]}
+            }
+        }}
+    }}
+    # The batch on sale next: the first with stock left, else the first one
+    current = {"$ifNull": [
+        {"$arrayElemAt": [{"$filter": {"input": "$batches", "cond": {"$gt": ["$$this.quantity", 0]}}}, 0]},
+        {"$arrayElemAt": ["$batches", 0]}
+    ]}
+    return [
+        {"$set": {
+            "batches": {"$let": {"vars": {"allocation": allocation}, "in": "$$allocation.batches"}},
+            "stock_quantity": {"$subtract": ["$stock_quantity", quantity]},
+            "updated_at": now
+        }},
+        {"$set": {
+            "expiry_date": {"$let": {"vars": {"current": current}, "in": "$$current.expiry_date"}},
+            "batch_number": {"$let": {"vars": {"current": current}, "in": "$$current.batch_number"}}
+        }}
+    ]
+
+
+def _stock_in_operation(store_id: str, before: dict, line: dict, medicine: dict) -> UpdateOne:
+    """Guarded $inc adding one goods-receipt line to a medicine.
+
+    The filter pins what the counter deltas and the new batch on sale were
+    computed from (supplier, price, batch on sale, whether anything is in
+    stock), not the quantities, so concurrent sales only make it miss when
+    they empty a batch.
+    """
+    query = {
+        "store_id": store_id,
+        "id": before["id"],
+        "postings": {"$ne": line["posting"]},
+        "supplier": before["supplier"],
+        "price": before["price"],
+        "expiry_date": before["expiry_date"],
+        "batch_number": before["batch_number"],
+        "stock_quantity": {"$gt": 0} if before["stock_quantity"] > 0 else {"$lte": 0}
+    }
+    update = {
+        "$inc": {"stock_quantity": line["quantity"]},
+        "$set": {
+            "expiry_date": medicine["expiry_date"],
+            "batch_number": medicine["batch_number"],
+            "updated_at": medicine["updated_at"]
+        },
+        "$push": {"postings": {"$each": [line["posting"]], "$slice": -POSTINGS_KEPT}}
+    }
+    if any(batch["batch_number"] == line["batch_number"] for batch in batches_of(before)):
+        query["batches"] = {"$elemMatch": {"batch_number": line["batch_number"], "expiry_date": line["expiry_date"]}}
+        update["$inc"]["batches.$.quantity"] = line["quantity"]
+    else:
+        query["batches.batch_number"] = {"$ne": line["batch_number"]}
+        batch = {field: line[field] for field in ("batch_number", "expiry_date", "quantity")}
+        update["$push"]["batches"] = {"$each": [batch], "$sort": {"expiry_date": 1, "batch_number": 1}}
+    return UpdateOne(query, update)
+
+
+class MongoMedicineRepository(MedicineRepository):
+    def __init__(self, db):
+        self.db = db
+
+    async def _count(self, store_id: str, deltas: Dict[tuple, dict]):
+        # Upserts on the unique (store_id, supplier, expiry_date) index are
+        # retried by the server when two writers create the same bucket at once
+        operations = [
+            UpdateOne(
+                {"store_id": store_id, "supplier": supplier, "expiry_date": expiry_date},
+                {"$inc": delta},
+                upsert=True
+            )
+            for (supplier, expiry_date), delta in deltas.items()
+        ]
+        if operations:
+            await self.db.inventory_counters.bulk_write(operations, ordered=False)
+
+    async def insert(self, medicine: dict) -> None:
+        await self.db.medicines.insert_one(dict(medicine))
+        await self._count(medicine["store_id"], counter_deltas(None, medicine))
+
+    async def get(self, store_id: str, medicine_id: str) -> Optional[dict]:
+        return await self.db.medicines.find_one({"store_id": store_id, "id": medicine_id}, {"_id": 0})
+
+    async def search(self, store_id, search=None, fields=None, limit=1000):
+        query = {"store_id": store_id}
+        if search:
+            query["$or"] = [
+                {"name": {"$regex": search, "$options": "i"}},
+                {"barcode": {"$regex": search, "$options": "i"}}
+            ]
+        projection = {"_id": 0, **{field: 1 for field in fields}} if fields else {"_id": 0}
+        return await self.db.medicines.find(query, projection).to_list(limit)
+
+    async def all(self, store_id=None):
+        return await self.db.medicines.find({"store_id": store_id} if store_id else {}, {"_id": 0}).to_list(None)
+
+    async def updated_since(self, store_id, since):
+        return await self.db.medicines.find(
+            {"store_id": store_id, "updated_at": {"$gte": since}}, {"_id": 0}
+        ).to_list(None)
+
+    async def update(self, store_id, medicine_id, changes):
+        # The old document is needed for the counters; a plain $set makes the new one
+        before = await self.db.medicines.find_one_and_update(
+            {"store_id": store_id, "id": medicine_id},
+            {"$set": changes},
+            projection={"_id": 0},
+            return_document=ReturnDocument.BEFORE
+        )
+        if before is None:
+            return None
+        medicine = {**before, **changes}
+        await self._count(store_id, counter_deltas(before, medicine))
+        return medicine
+
+    async def delete(self, store_id, medicine_id):
+        medicine = await self.db.medicines.find_one_and_delete(
+            {"store_id": store_id, "id": medicine_id}, projection={"_id": 0}
+        )
+        if medicine is None:
+            return False
+        await self._count(store_id, counter_deltas(medicine, None))
+        return True
+
+    async def allocate(self, store_id, medicine_id, quantity):
+        now = _bson_datetime(datetime.utcnow())
+        today = date.today().isoformat()
+        # The filter only matches while enough unexpired stock remains. The
+        # document as it was before the write fixes the allocation, so it is
+        # replayed locally instead of being stored for the round trip back.
+        before = await self.db.medicines.find_one_and_update(
+            {"store_id": store_id, "id": medicine_id, "stock_quantity": {"$gte": quantity},
+             **_sellable_filter(quantity, today)},
+            _fefo_pipeline(quantity, now, today),
+            projection={"_id": 0},
+            return_document=ReturnDocument.BEFORE
+        )
+        if before is None:
+            return None
+        medicine, taken = allocate_batches({**before, "updated_at": now}, quantity, today)
+        await self._count(store_id, counter_deltas(before, medicine))
+        return medicine, taken
+
+    async def _swap(self, store_id: str, medicine_id: str, change) -> Optional[dict]:
+        # Read-modify-write of the stock fields, guarded by the batches array
+        # being unchanged; a lost race means another write landed, so retry
+        while True:
+            before = await self.get(store_id, medicine_id)
+            if before is None:
+                return None
+            medicine = {**change(before), "updated_at": _bson_datetime(datetime.utcnow())}
+            result = await self.db.medicines.update_one(
+                {"store_id": store_id, "id": medicine_id, "batches": before.get("batches")},
+                {"$set": {field: medicine[field] for field in STOCK_FIELDS}}
+            )
+            if result.matched_count:
+                await self._count(store_id, counter_deltas(before, medicine))
+                return medicine
+
+    async def release(self, store_id, medicine_id, taken):
+        return await self._swap(store_id, medicine_id, lambda medicine: return_batches(medicine, taken))
+
+    async def receive(self, store_id, medicine_id, batch):
+        return await self._swap(store_id, medicine_id, lambda medicine: receive_batch(medicine, batch))
+
+    async def stock_in(self, store_id, created, lines):
+        applied_at = _bson_datetime(datetime.utcnow())
+        ids = list(dict.fromkeys([medicine["id"] for medicine in created] + [line["medicine_id"] for line in lines]))
+        # New medicines are upserted so a second posting leaves them alone
+        inserts = [
+            UpdateOne({"store_id": store_id, "id": medicine["id"]}, {"$setOnInsert": dict(medicine)}, upsert=True)
+            for medicine in created
+        ]
+        deltas: Dict[tuple, dict] = {}
+        touched: Dict[str, dict] = {}
+        pending = lines
+        # Each round is one ordered bulk_write; lines that missed their guard
+        # because a sale emptied a batch in between are recomputed and resent
+        while pending or inserts:
+            state = await self._by_id(store_id, ids)
+            for medicine in created:
+                state.setdefault(medicine["id"], medicine)
+            operations, attempted = list(inserts), []
+            for line in pending:
+                before = state.get(line["medicine_id"])
+                if before is None:
+                    raise ValueError(f"Medicine {line['medicine_id']} not found")
+                if line["posting"] in (before.get("postings") or []):
+                    continue
+                medicine = receive_line(before, line, applied_at)
+                operations.append(_stock_in_operation(store_id, before, line, medicine))
+                attempted.append((line, before, medicine))
+                state[line["medicine_id"]] = medicine
+            if not operations:
+                touched.update(state)
+                break
+            result = await self.db.medicines.bulk_write(operations, ordered=True)
+            for index in result.upserted_ids:
+                _merge_deltas(deltas, counter_deltas(None, created[index]))
+            inserts = []
+
+            current = await self._by_id(store_id, ids)
+            touched.update(current)
+            pending = []
+            for line, before, medicine in attempted:
+                if line["posting"] in (current.get(line["medicine_id"], {}).get("postings") or []):
+                    _merge_deltas(deltas, counter_deltas(before, medicine))
+                else:
+                    pending.append(line)
+        await self._count(store_id, deltas)
+        return list(touched.values())
+
+    async def bulk_update(self, store_id, patches):
+        # Timestamps are truncated to BSON's millisecond precision so they compare
+        # equal to what is stored (clients may echo a microsecond value from the cache)
+        applied_at = _bson_datetime(datetime.utcnow())
+        # Each line is stamped with a posting marker of its own, which later
+        # writes (a sale rewriting updated_at) leave alone
+        token = f"bulk-{uuid.uuid4().hex}"
+        patches = [
+            {**patch, "expected_updated_at": _bson_datetime(patch["expected_updated_at"])}
+            if patch.get("expected_updated_at") else patch
+            for patch in patches
+        ]
+        order = {patch["id"]: index for index, patch in enumerate(patches)}
+        postings = {patch["id"]: f"{token}/{index}" for index, patch in enumerate(patches)}
+        result = {"updated": [], "rejected": []}
+        deltas: Dict[tuple, dict] = {}
+        pending = patches
+        # Lines are computed from one read and written guarded by the batches
+        # they were computed from; lines that lost a race to a sale are redone
+        while pending:
+            previous = await self._by_id(store_id, [patch["id"] for patch in pending])
+            operations, attempted = [], []
+            for patch in pending:
+                before = previous.get(patch["id"])
+                reason = bulk_rejection(patch, before)
+                if reason:
+                    result["rejected"].append({
+                        "id": patch["id"],
+                        "reason": reason,
+                        "updated_at": before.get("updated_at") if before else None
+                    })
+                    continue
+                posting = postings[patch["id"]]
+                medicine = apply_patch(before, patch, applied_at)
+                medicine["postings"] = ((before.get("postings") or []) + [posting])[-POSTINGS_KEPT:]
+                changed = {key: medicine[key] for key in patch.get("set", {}) if key not in STOCK_FIELDS}
+                operations.append(UpdateOne(
+                    {"store_id": store_id, "id": patch["id"], "updated_at": before.get("updated_at"),
+                     "batches": before.get("batches")},
+                    {"$set": {**changed, **{field: medicine[field] for field in STOCK_FIELDS}},
+                     "$push": {"postings": {"$each": [posting], "$slice": -POSTINGS_KEPT}}}
+                ))
+                attempted.append((patch, before, medicine))
+            if not operations:
+                break
+            await self.db.medicines.bulk_write(operations, ordered=False)
+
+            # One read tells applied lines (carrying their posting) from the ones
+            # that lost a race, which are redone and cannot apply twice
+            current = await self._by_id(store_id, [patch["id"] for patch, _, _ in attempted])
+            pending = []
+            for patch, before, medicine in attempted:
+                if postings[patch["id"]] in (current.get(patch["id"], {}).get("postings") or []):
+                    result["updated"].append(medicine)
+                    _merge_deltas(deltas, counter_deltas(before, medicine))
+                else:
+                    pending.append(patch)
+        await self._count(store_id, deltas)
+        result["updated"].sort(key=lambda medicine: order[medicine["id"]])
+        return result
+
+    async def _by_id(self, store_id: str, ids: List[str]) -> Dict[str, dict]:
+        return {
+            medicine["id"]: medicine
+            for medicine in await self.db.medicines.find(
+                {"store_id": store_id, "id": {"$in": ids}}, {"_id": 0}
+            ).to_list(None)
+        }
+
+    async def bump_version(self, store_id, deleted=False):
+        increments = {"version": 1, "deletes": 1} if deleted else {"version": 1}
+        version = await self.db.catalog_versions.find_one_and_update(
+            {"_id": store_id},
+            {"$inc": increments},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return {"store_id": store_id, "version": version["version"], "deletes": version.get("deletes", 0)}
+
+    async def versions(self, store_id=None):
+        versions = await self.db.catalog_versions.find({"_id": store_id} if store_id else {}).to_list(None)
+        return [
+            {"store_id": version["_id"], "version": version.get("version", 0), "deletes": version.get("deletes", 0)}
+            for version in versions
+        ]
+
+
+class MongoSaleRepository(SaleRepository):
+    """Sales across the hot `sales` collection and the monthly archive collections.
+
+    The archive job (see server.py) moves old months into `sales_archive_YYYY_MM`
+    collections and records one summary per store and month in
+    `sales_archive_months`; reads here fall through to those transparently.
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    async def archived_months(self, store_id: str, start_date: Optional[date], end_date: Optional[date]) -> List[dict]:
+        """A store's archive month summaries overlapping the given range, newest first."""
+        query = {"store_id": store_id}
+        month_query = {}
+        if start_date:
+            month_query["$gte"] = start_date.strftime("%Y-%m")
+        if end_date:
+            month_query["$lte"] = end_date.strftime("%Y-%m")
+        if month_query:
+            query["month"] = month_query
+        return await self.db.sales_archive_months.find(query).sort("month", -1).to_list(None)
+
+    async def _collections(self, store_id, start_date, end_date) -> list:
+        archived = await self.archived_months(store_id, start_date, end_date)
+        return [self.db.sales] + [self.db[month["collection"]] for month in archived]
+
+    @staticmethod
+    def _match(store_id, start_date, end_date) -> dict:
+        match = {"store_id": store_id}
+        bounds = sale_date_bounds(start_date, end_date)
+        if bounds:
+            match["sale_date"] = bounds
+        return match
+
+    async def insert(self, sale: dict) -> None:
+        await self.db.sales.insert_one(dict(sale))
+
+    async def get(self, store_id, sale_id):
+        query = {"store_id": store_id, "id": sale_id}
+        sale = await self.db.sales.find_one(query, {"_id": 0})
+        if sale:
+            return sale
+        for month in await self.archived_months(store_id, None, None):
+            sale = await self.db[month["collection"]].find_one(query, {"_id": 0})
+            if sale:
+                return sale
+        return None
+
+    async def find(self, store_id, start_date=None, end_date=None, medicine_id=None, medicine_name=None,
+                   limit=100, fields=None, customer_phone=None):
+        query = self._match(store_id, start_date, end_date)
+        if customer_phone:
+            query["customer_phone"] = customer_phone
+        # Prefer medicine_id: it is an exact match served by the items.medicine_id index
+        if medicine_id:
+            query["items.medicine_id"] = medicine_id
+        elif medicine_name:
+            query["items.medicine_name"] = {"$regex": medicine_name, "$options": "i"}
+        projection = {"_id": 0, "id": 1, **{field: 1 for field in fields}} if fields else {"_id": 0}
+
+        sales = await self.db.sales.find(query, projection).sort("sale_date", -1).limit(limit).to_list(limit)
+        if len(sales) >= limit:
+            return sales
+
+        seen = {sale["id"] for sale in sales}
+        for month in await self.archived_months(store_id, start_date, end_date):
+            remaining = limit - len(sales)
+            archived = await self.db[month["collection"]].find(query, projection) \
+                .sort("sale_date", -1).limit(remaining).to_list(remaining)
+            # A sale can briefly exist in both tiers while the archive job is moving it
+            sales.extend(sale for sale in archived if sale["id"] not in seen)
+            seen.update(sale["id"] for sale in archived)
+            if len(sales) >= limit:
+                break
+        return sales[:limit]
+
+    @staticmethod
+    def _month_within(month: str, start_date: Optional[date], end_date: Optional[date]) -> bool:
+        first_day = datetime.strptime(month, "%Y-%m").date()
+        next_month = (first_day + timedelta(days=32)).replace(day=1)
+        return (start_date is None or start_date <= first_day) and \
+            (end_date is None or end_date >= next_month - timedelta(days=1))
+
+    @staticmethod
+    async def _collection_totals(collection, match: dict) -> dict:
+        pipeline = [
+            {"$match": match},
+            {"$group": {
+                "_id": None,
+                "total_sales": {"$sum": "$total_amount"},
+                "total_transactions": {"$sum": 1}
+            }}
+        ]
+        result = await collection.aggregate(pipeline).to_list(1)
+        if result:
+            return {"total_sales": result[0]["total_sales"], "total_transactions": result[0]["total_transactions"]}
+        return {"total_sales": 0, "total_transactions": 0}
+
+    async def totals(self, store_id, start_date=None, end_date=None):
+        match = self._match(store_id, start_date, end_date)
+        totals = await self._collection_totals(self.db.sales, match)
+        # Fully covered archive months are answered from their precomputed summary
+        for month in await self.archived_months(store_id, start_date, end_date):
+            if self._month_within(month["month"], start_date, end_date):
+                month_totals = month
+            else:
+                month_totals = await self._collection_totals(self.db[month["collection"]], match)
+            totals["total_sales"] += month_totals["total_sales"]
+            totals["total_transactions"] += month_totals["total_transactions"]
+        return totals
+
+    async def medicine_totals(self, store_id, medicine_id, start_date=None, end_date=None):
+        match = {**self._match(store_id, start_date, end_date), "items.medicine_id": medicine_id}
+        # One document per sale, so transactions is a plain count; the medicine's
+        # lines are summed within each sale instead of unwinding
+        lines = {"$filter": {"input": "$items", "as": "item", "cond": {"$eq": ["$$item.medicine_id", medicine_id]}}}
+        pipeline = [
+            {"$match": match},
+            {"$project": {
+                "sale_date": 1,
+                "quantity": {"$reduce": {"input": lines, "initialValue": 0,
+                                         "in": {"$add": ["$$value", "$$this.quantity"]}}},
+                "revenue": {"$reduce": {"input": lines, "initialValue": 0,
+                                        "in": {"$add": ["$$value", "$$this.total"]}}}
+            }},
+            {"$group": {
+                "_id": None,
+                "quantity_sold": {"$sum": "$quantity"},
+                "revenue": {"$sum": "$revenue"},
+                "transactions": {"$sum": 1},
+                "first_sale": {"$min": "$sale_date"},
+                "last_sale": {"$max": "$sale_date"}
+            }}
+        ]
+        collections = await self._collections(store_id, start_date, end_date)
+        results = await asyncio.gather(*[collection.aggregate(pipeline).to_list(1) for collection in collections])
+        partials = [result[0] for result in results if result and result[0]["transactions"]]
+        if not partials:
+            return _empty_medicine_totals()
+        return {
+            "quantity_sold": sum(partial["quantity_sold"] for partial in partials),
+            "revenue": sum(partial["revenue"] for partial in partials),
+            "transactions": sum(partial["transactions"] for partial in partials),
+            "first_sale": min(partial["first_sale"] for partial in partials),
+            "last_sale": max(partial["last_sale"] for partial in partials)
+        }
+
+    async def summary(self, store_id, start_date, end_date):
+        match = self._match(store_id, start_date, end_date)
+        payment_pipeline = [
+            {"$match": match},
+            {"$group": {
+                "_id": "$payment_method",
+                "transactions": {"$sum": 1},
+                "total": {"$sum": "$total_amount"},
+                "first_receipt": {"$min": "$receipt_number"},
+                "last_receipt": {"$max": "$receipt_number"}
+            }}
+        ]
+        item_pipeline = [
+            {"$match": match},
+            {"$unwind": "$items"},
+            {"$group": {
+                "_id": "$items.medicine_id",
+                "medicine_name": {"$first": "$items.medicine_name"},
+                "quantity": {"$sum": "$items.quantity"},
+                "total": {"$sum": "$items.total"}
+            }}
+        ]
+        payments: Dict[str, dict] = {}
+        items: Dict[str, dict] = {}
+        for collection in await self._collections(store_id, start_date, end_date):
+            for row in await collection.aggregate(payment_pipeline).to_list(None):
+                if not row["transactions"]:
+                    continue
+                payment = payments.setdefault(row["_id"], {
+                    "payment_method": row["_id"], "transactions": 0, "total": 0,
+                    "first_receipt": row["first_receipt"], "last_receipt": row["last_receipt"]
+                })
+                payment["transactions"] += row["transactions"]
+                payment["total"] += row["total"]
+                payment["first_receipt"] = min(payment["first_receipt"], row["first_receipt"])
+                payment["last_receipt"] = max(payment["last_receipt"], row["last_receipt"])
+            for row in await collection.aggregate(item_pipeline).to_list(None):
+                if row["_id"] is None:
+                    continue
+                item = items.setdefault(row["_id"], {
+                    "medicine_id": row["_id"], "medicine_name": row["medicine_name"], "quantity": 0, "total": 0
+                })
+                item["quantity"] += row["quantity"]
+                item["total"] += row["total"]
+        return {"payments": list(payments.values()), "items": list(items.values())}
+
+    async def scan(self, store_id, after, until, limit=None):
+        query = {"store_id": store_id, "sale_date": {"$lte": until}}
+        if after:
+            query["sale_date"]["$gt"] = after
+        projection = {"_id": 0, **{field: 1 for field in SCAN_FIELDS}}
+        first_month = datetime.fromisoformat(after).date() if after else None
+        collections = await self._collections(store_id, first_month, None)
+
+        async def oldest(collection):
+            cursor = collection.find(query, projection).sort("sale_date", 1)
+            if limit:
+                cursor = cursor.limit(limit)
+            return await cursor.to_list(limit)
+        sales = {}
+        for batch in await asyncio.gather(*[oldest(collection) for collection in collections]):
+            # A sale can briefly exist in both tiers while the archive job is moving it
+            for sale in batch:
+                sales.setdefault(sale["id"], sale)
+        return sorted(sales.values(), key=lambda sale: (sale["sale_date"], sale["id"]))[:limit]
+
+
+class MongoCustomerRepository(CustomerRepository):
+    def __init__(self, db):
+        self.db = db
+
+    async def record_sale(self, sale, recent_limit):
+        now = datetime.utcnow()
+        update = {
+            "$setOnInsert": {"first_visit": sale["sale_date"]},
+            "$set": {"last_visit": sale["sale_date"], "updated_at": now},
+            "$inc": {"visits": 1, "lifetime_spend": sale["total_amount"]},
+            "$push": {"recent_sales": {"$each": [sale_summary(sale)], "$position": 0, "$slice": recent_limit}}
+        }
+        if sale.get("customer_name"):
+            update["$set"]["name"] = sale["customer_name"]
+        return await self.db.customers.find_one_and_update(
+            {"store_id": sale["store_id"], "phone": sale["customer_phone"]},
+            update,
+            projection={"_id": 0},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def get(self, store_id, phone):
+        return await self.db.customers.find_one({"store_id": store_id, "phone": phone}, {"_id": 0})
+
+
+class MongoInventoryRepository(InventoryRepository):
+    def __init__(self, db):
+        self.db = db
+
+    async def counters(self, store_id):
+        return await self.db.inventory_counters.find(
+            {"store_id": store_id, "$or": [{"skus": {"$gt": 0}}, {"units": {"$ne": 0}}]}, {"_id": 0, "store_id": 0}
+        ).to_list(None)
+
+    async def recompute(self, store_id):
+        # SKUs count under the batch on sale, stock under every batch's own expiry
+        skus = [
+            {"$match": {"store_id": store_id}},
+            {"$group": {
+                "_id": {"supplier": "$supplier", "expiry_date": "$expiry_date"},
+                "skus": {"$sum": 1},
+                "in_stock": {"$sum": {"$cond": [{"$gt": ["$stock_quantity", 0]}, 1, 0]}}
+            }}
+        ]
+        stock = [
+            {"$match": {"store_id": store_id}},
+            {"$unwind": "$batches"},
+            {"$group": {
+                "_id": {"supplier": "$supplier", "expiry_date": "$batches.expiry_date"},
+                "units": {"$sum": "$batches.quantity"},
+                "value": {"$sum": {"$multiply": ["$price", "$batches.quantity"]}}
+            }}
+        ]
+        rows: Dict[tuple, dict] = {}
+        for pipeline in (skus, stock):
+            for group in await self.db.medicines.aggregate(pipeline).to_list(None):
+                key = (group["_id"]["supplier"], group["_id"]["expiry_date"])
+                row = rows.setdefault(key, {"supplier": key[0], "expiry_date": key[1], **dict.fromkeys(COUNTER_FIELDS, 0)})
+                row.update({field: value for field, value in group.items() if field in COUNTER_FIELDS})
+        return [row for row in rows.values() if row["skus"] or row["units"]]
+
+    async def replace(self, store_id, rows):
+        # Not atomic: a medicine write landing in between is lost from the counters
+        await self.db.inventory_counters.delete_many({"store_id": store_id})
+        if rows:
+            await self.db.inventory_counters.insert_many([{**row, "store_id": store_id} for row in rows])
+
+
+class MongoPurchaseRepository(PurchaseRepository):
+    def __init__(self, db):
+        self.db = db
+
+    async def insert(self, document):
+        await self.db.purchases.insert_one(dict(document))
+
+    async def get(self, store_id, kind, document_id):
+        return await self.db.purchases.find_one({"store_id": store_id, "kind": kind, "id": document_id}, {"_id": 0})
+
+    async def find(self, store_id, kind, supplier=None, status=None, limit=100):
+        query = {"store_id": store_id, "kind": kind}
+        if supplier:
+            query["supplier"] = supplier
+        if status:
+            query["status"] = status
+        return await self.db.purchases.find(query, {"_id": 0}).sort("created_at", -1).to_list(limit)
+
+    async def transition(self, store_id, kind, document_id, statuses, changes):
+        changes = {**changes, "updated_at": _bson_datetime(datetime.utcnow())}
+        before = await self.db.purchases.find_one_and_update(
+            {"store_id": store_id, "kind": kind, "id": document_id, "status": {"$in": list(statuses)}},
+            {"$set": changes},
+            projection={"_id": 0},
+            return_document=ReturnDocument.BEFORE
+        )
+        return {**before, **changes} if before else None
+
+    async def complete_receipt(self, store_id, receipt_id, posted_at):
+        # Only the caller that moves the receipt to posted counts it
+        receipt = await self.transition(
+            store_id, "receipt", receipt_id, ("posting",), {"status": "posted", "posted_at": posted_at}
+        )
+        if receipt:
+            await self.db.supplier_totals.update_one(
+                {"store_id": store_id, "supplier": receipt["supplier"]},
+                {"$inc": supplier_increments(receipt), "$max": {"last_received_at": posted_at}},
+                upsert=True
+            )
+        return receipt
+
+    async def supplier_totals(self, store_id):
+        return await self.db.supplier_totals.find(
+            {"store_id": store_id}, {"_id": 0, "store_id": 0}
+        ).sort("supplier", 1).to_list(None)
+
+
+class MongoUserRepository(UserRepository):
+    def __init__(self, db):
+        self.db = db
+
+    async def insert(self, user):
+        await self.db.users.insert_one(dict(user))
+
+    async def list(self, store_id, limit=1000):
+        return await self.db.users.find({"store_id": store_id}, {"_id": 0}).to_list(limit)
+
+
+class MongoShopRepository(ShopRepository):
+    def __init__(self, db):
+        self.db = db
+
+    async def get(self, store_id):
+        return await self.db.shop_details.find_one({"store_id": store_id}, {"_id": 0})
+
+    async def save(self, shop):
+        shop = dict(shop)
+        existing = await self.db.shop_details.find_one({"store_id": shop["store_id"]}, {"id": 1})
+        if existing:
+            shop["id"] = existing["id"]
+            await self.db.shop_details.update_one({"store_id": shop["store_id"], "id": shop["id"]}, {"$set": shop})
+        else:
+            await self.db.shop_details.insert_one(dict(shop))
+        return shop
+
+
+class MongoRepository(Repository):
+    backend = "mongo"
+
+    def __init__(self, db):
+        self.db = db
+        self.medicines = MongoMedicineRepository(db)
+        self.sales = MongoSaleRepository(db)
+        self.customers = MongoCustomerRepository(db)
+        self.inventory = MongoInventoryRepository(db)
+        self.purchases = MongoPurchaseRepository(db)
+        self.users = MongoUserRepository(db)
+        self.shops = MongoShopRepository(db)
+
+    async def initialize(self):
+        await self.db.medicines.create_index([("store_id", 1), ("id", 1)], unique=True)
+        await self.db.medicines.create_index([("store_id", 1), ("name", 1)])
+        await self.db.medicines.create_index([("store_id", 1), ("barcode", 1)])
+        # Multikey, for the expiry scan over every batch
+        await self.db.medicines.create_index([("store_id", 1), ("batches.expiry_date", 1)])
+        # Delta reads for the catalog sync
+        await self.db.medicines.create_index([("store_id", 1), ("updated_at", 1)])
+        await self.db.users.create_index([("store_id", 1), ("username", 1)])
+        await self.db.shop_details.create_index([("store_id", 1)], unique=True)
+        await self.db.customers.create_index([("store_id", 1), ("phone", 1)], unique=True)
+        await self.db.inventory_counters.create_index(
+            [("store_id", 1), ("supplier", 1), ("expiry_date", 1)], unique=True
+        )
+        await self.db.purchases.create_index([("store_id", 1), ("id", 1)], unique=True)
+        await self.db.purchases.create_index([("store_id", 1), ("kind", 1), ("created_at", -1)])
+        await self.db.supplier_totals.create_index([("store_id", 1), ("supplier", 1)], unique=True)
+        await self.db.sales_archive_months.create_index([("store_id", 1), ("month", -1)])
+        await ensure_sales_indexes(self.db.sales)
+        for collection_name in await self.db.sales_archive_months.distinct("collection"):
+            await ensure_sales_indexes(self.db[collection_name])
+        # Medicines that predate batches become a single batch, once
+        if not await self.db.migrations.find_one({"_id": "medicine_batches"}):
+            await self.db.medicines.update_many({"batches": {"$exists": False}}, [{"$set": {"batches": [{
+                "batch_number": "$batch_number", "expiry_date": "$expiry_date", "quantity": "$stock_quantity"
+            }]}}])
+            await self.db.migrations.update_one(
+                {"_id": "medicine_batches"}, {"$set": {"applied_at": datetime.utcnow()}}, upsert=True
+            )
+        # Catalogs that predate the inventory counters get them built once
+        if not await self.db.migrations.find_one({"_id": "inventory_counters"}):
+            for store_id in await self.db.medicines.distinct("store_id"):
+                await self.inventory.replace(store_id, await self.inventory.recompute(store_id))
+            await self.db.migrations.update_one(
+                {"_id": "inventory_counters"}, {"$set": {"applied_at": datetime.utcnow()}}, upsert=True
+            )
+
+
+# SQLite
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return {"$date": value.isoformat()}
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f"Cannot store {type(value).__name__} in SQLite")
+
+
+def _json_object_hook(value: dict):
+    if len(value) == 1 and "$date" in value:
+        return datetime.fromisoformat(value["$date"])
+    return value
+
+
+def _dumps(document: dict) -> str:
+    return json.dumps({key: value for key, value in document.items() if key != "_id"}, default=_json_default)
+
+
+def _loads(text: str) -> dict:
+    return json.loads(text, object_hook=_json_object_hook)
+
+
+def _sortable(value) -> Optional[str]:
+    # Datetime columns hold microsecond ISO strings so they sort lexically
+    if isinstance(value, datetime):
+        return value.isoformat(timespec="microseconds")
+    return value
+
+
+def _like(text: str) -> str:
+    escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+# Each entry upgrades the schema by one version (tracked in PRAGMA user_version)
+SQLITE_MIGRATIONS = [
+    """
+    CREATE TABLE medicines (
+        store_id TEXT NOT NULL,
+        id TEXT NOT NULL,
+        name TEXT NOT NULL,
+        barcode TEXT,
+        expiry_date TEXT,
+        stock_quantity INTEGER NOT NULL,
+        updated_at TEXT,
+        doc TEXT NOT NULL,
+        PRIMARY KEY (store_id, id)
+    );
+    CREATE INDEX medicines_name ON medicines (store_id, name COLLATE NOCASE);
+    CREATE INDEX medicines_barcode ON medicines (store_id, barcode);
+    CREATE INDEX medicines_updated_at ON medicines (store_id, updated_at);
+    CREATE INDEX medicines_expiry_date ON medicines (store_id, expiry_date);
+
+    CREATE TABLE sales (
+        store_id TEXT NOT NULL,
+        id TEXT NOT NULL,
+        sale_date TEXT NOT NULL,
+        total_amount REAL NOT NULL,
+        payment_method TEXT NOT NULL,
+        receipt_number TEXT NOT NULL,
+        doc TEXT NOT NULL,
+        PRIMARY KEY (store_id, id)
+    );
+    CREATE INDEX sales_sale_date ON sales (store_id, sale_date);
+
+    -- One row per line item, the equivalent of Mongo's multikey items index
+    CREATE TABLE sale_items (
+        store_id TEXT NOT NULL,
+        sale_id TEXT NOT NULL,
+        medicine_id TEXT NOT NULL,
+        medicine_name TEXT NOT NULL,
+        sale_date TEXT NOT NULL,
+        quantity INTEGER NOT NULL,
+        total REAL NOT NULL
+    );
+    CREATE INDEX sale_items_medicine ON sale_items (store_id, medicine_id, sale_date);
+    CREATE INDEX sale_items_sale ON sale_items (store_id, sale_id);
+
+    CREATE TABLE users (
+        store_id TEXT NOT NULL,
+        id TEXT NOT NULL,
+        username TEXT NOT NULL,
+        doc TEXT NOT NULL,
+        PRIMARY KEY (store_id, id)
+    );
+    CREATE INDEX users_username ON users (store_id, username);
+
+    CREATE TABLE shops (
+        store_id TEXT PRIMARY KEY,
+        doc TEXT NOT NULL
+    );
+
+    CREATE TABLE catalog_versions (
+        store_id TEXT PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0,
+        deletes INTEGER NOT NULL DEFAULT 0
+    );
+    """,
+    """
+    ALTER TABLE sales ADD COLUMN customer_phone TEXT;
+    UPDATE sales SET customer_phone = json_extract(doc, '$.customer_phone');
+    CREATE INDEX sales_customer_phone ON sales (store_id, customer_phone, sale_date)
+        WHERE customer_phone IS NOT NULL;
+
+    CREATE TABLE customers (
+        store_id TEXT NOT NULL,
+        phone TEXT NOT NULL,
+        doc TEXT NOT NULL,
+        PRIMARY KEY (store_id, phone)
+    );
+    """,
+    """
+    CREATE TABLE inventory_counters (
+        store_id TEXT NOT NULL,
+        supplier TEXT NOT NULL,
+        expiry_date TEXT NOT NULL,
+        skus INTEGER NOT NULL,
+        in_stock INTEGER NOT NULL,
+        units INTEGER NOT NULL,
+        value REAL NOT NULL,
+        PRIMARY KEY (store_id, supplier, expiry_date)
+    );
+    INSERT INTO inventory_counters
+    SELECT store_id, json_extract(doc, '$.supplier'), expiry_date, COUNT(*), SUM(stock_quantity > 0),
+           SUM(stock_quantity), SUM(json_extract(doc, '$.price') * stock_quantity)
+    FROM medicines GROUP BY store_id, json_extract(doc, '$.supplier'), expiry_date;
+    """,
+    """
+    UPDATE medicines SET doc = json_set(doc, '$.batches', json_array(json_object(
+        'batch_number', json_extract(doc, '$.batch_number'),
+        'expiry_date', json_extract(doc, '$.expiry_date'),
+        'quantity', stock_quantity
+    )))
+    WHERE json_extract(doc, '$.batches') IS NULL;
+    """,
+    """
+    CREATE TABLE purchases (
+        store_id TEXT NOT NULL,
+        id TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        supplier TEXT NOT NULL,
+        status TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        doc TEXT NOT NULL,
+        PRIMARY KEY (store_id, id)
+    );
+    CREATE INDEX purchases_kind ON purchases (store_id, kind, created_at);
+
+    CREATE TABLE supplier_totals (
+        store_id TEXT NOT NULL,
+        supplier TEXT NOT NULL,
+        receipts INTEGER NOT NULL,
+        units INTEGER NOT NULL,
+        cost REAL NOT NULL,
+        last_received_at TEXT NOT NULL,
+        PRIMARY KEY (store_id, supplier)
+    );
+    """,
+]
+
+
+class SQLiteDatabase:
+    """A WAL-mode SQLite file accessed from a thread pool.
+
+    Each pool thread keeps its own connection. Writes run inside
+    `BEGIN IMMEDIATE` so read-modify-write sequences are atomic even when
+    several server processes share the file.
+    """
+
+    def __init__(self, path: str, workers: int = 4):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sqlite")
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # Autocommit mode; transactions are opened explicitly in `write`
+            connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("PRAGMA busy_timeout=5000")
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    async def read(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, lambda: func(self._connection(), *args))
+
+    async def write(self, func, *args):
+        def run():
+            connection = self._connection()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                result = func(connection, *args)
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+            return result
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, run)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
+
+
+class SQLiteMedicineRepository(MedicineRepository):
+    def __init__(self, database: SQLiteDatabase):
+        self.database = database
+
+    @staticmethod
+    def _row(medicine: dict) -> tuple:
+        return (
+            medicine["store_id"], medicine["id"], medicine["name"], medicine.get("barcode"),
+            medicine.get("expiry_date"), medicine["stock_quantity"], _sortable(medicine.get("updated_at")),
+            _dumps(medicine)
+        )
+
+    @staticmethod
+    def _store(connection, medicine: dict):
+        connection.execute(
+            "INSERT OR REPLACE INTO medicines (store_id, id, name, barcode, expiry_date, stock_quantity, "
+            "updated_at, doc) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            SQLiteMedicineRepository._row(medicine)
+        )
+
+    @staticmethod
+    def _fetch(connection, store_id, medicine_id) -> Optional[dict]:
+        row = connection.execute(
+            "SELECT doc FROM medicines WHERE store_id = ? AND id = ?", (store_id, medicine_id)
+        ).fetchone()
+        return _loads(row["doc"]) if row else None
+
+    @staticmethod
+    def _count(connection, store_id, deltas: Dict[tuple, dict]):
+        if not deltas:
+            return
+        connection.executemany(
+            "INSERT INTO inventory_counters (store_id, supplier, expiry_date, skus, in_stock, units, value) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (store_id, supplier, expiry_date) DO UPDATE SET "
+            "skus = skus + excluded.skus, in_stock = in_stock + excluded.in_stock, "
+            "units = units + excluded.units, value = value + excluded.value",
+            [(store_id, supplier, expiry_date, *(delta[field] for field in COUNTER_FIELDS))
+             for (supplier, expiry_date), delta in deltas.items()]
+        )
+        connection.execute(
+            "DELETE FROM inventory_counters WHERE store_id = ? AND skus = 0 AND units = 0", (store_id,)
+        )
+
+    async def insert(self, medicine):
+        def run(connection):
+            connection.execute(
+                "INSERT INTO medicines (store_id, id, name, barcode, expiry_date, stock_quantity, "
+                "updated_at, doc) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                self._row(medicine)
+            )
+            self._count(connection, medicine["store_id"], counter_deltas(None, medicine))
+        await self.database.write(run)
+
+    async def get(self, store_id, medicine_id):
+        return await self.database.read(self._fetch, store_id, medicine_id)
+
+    async def search(self, store_id, search=None, fields=None, limit=1000):
+        def run(connection):
+            sql = "SELECT doc FROM medicines WHERE store_id = ?"
+            params: list = [store_id]
+            if search:
+                sql += " AND (name LIKE ? ESCAPE '\\' OR barcode LIKE ? ESCAPE '\\')"
+                params += [_like(search), _like(search)]
+            sql += " LIMIT ?"
+            params.append(limit)
+            return [project(_loads(row["doc"]), fields) for row in connection.execute(sql, params)]
+        return await self.database.read(run)
+
+    async def all(self, store_id=None):
+        def run(connection):
+            if store_id:
+                rows = connection.execute("SELECT doc FROM medicines WHERE store_id = ?", (store_id,))
+            else:
+                rows = connection.execute("SELECT doc FROM medicines")
+            return [_loads(row["doc"]) for row in rows]
+        return await self.database.read(run)
+
+    async def updated_since(self, store_id, since):
+        def run(connection):
+            rows = connection.execute(
+                "SELECT doc FROM medicines WHERE store_id = ? AND updated_at >= ?", (store_id, _sortable(since))
+            )
+            return [_loads(row["doc"]) for row in rows]
+        return await self.database.read(run)
+
+    async def update(self, store_id, medicine_id, changes):
+        def run(connection):
+            before = self._fetch(connection, store_id, medicine_id)
+            if before is None:
+                return None
+            medicine = {**before, **changes}
+            self._store(connection, medicine)
+            self._count(connection, store_id, counter_deltas(before, medicine))
+            return medicine
+        return await self.database.write(run)
+
+    async def delete(self, store_id, medicine_id):
+        def run(connection):
+            medicine = self._fetch(connection, store_id, medicine_id)
+            if medicine is None:
+                return False
+            connection.execute("DELETE FROM medicines WHERE store_id = ? AND id = ?", (store_id, medicine_id))
+            self._count(connection, store_id, counter_deltas(medicine, None))
+            return True
+        return await self.database.write(run)
+
+    async def _change(self, store_id, medicine_id, change):
+        def run(connection):
+            before = self._fetch(connection, store_id, medicine_id)
+            if before is None:
+                return None
+            medicine = {**change(before), "updated_at": datetime.utcnow()}
+            self._store(connection, medicine)
+            self._count(connection, store_id, counter_deltas(before, medicine))
+            return medicine
+        return await self.database.write(run)
+
+    async def allocate(self, store_id, medicine_id, quantity):
+        def run(connection):
+            today = date.today().isoformat()
+            before = self._fetch(connection, store_id, medicine_id)
+            if before is None or sellable_stock(before, today) < quantity:
+                return None
+            medicine, taken = allocate_batches({**before, "updated_at": datetime.utcnow()}, quantity, today)
+            self._store(connection, medicine)
+            self._count(connection, store_id, counter_deltas(before, medicine))
+            return medicine, taken
+        return await self.database.write(run)
+
+    async def release(self, store_id, medicine_id, taken):
+        return await self._change(store_id, medicine_id, lambda medicine: return_batches(medicine, taken))
+
+    async def receive(self, store_id, medicine_id, batch):
+        return await self._change(store_id, medicine_id, lambda medicine: receive_batch(medicine, batch))
+
+    async def stock_in(self, store_id, created, lines):
+        def run(connection):
+            applied_at = datetime.utcnow()
+            touched: Dict[str, dict] = {}
+            deltas: Dict[tuple, dict] = {}
+            for medicine in created:
+                stored = self._fetch(connection, store_id, medicine["id"])
+                if stored is None:
+                    _merge_deltas(deltas, counter_deltas(None, medicine))
+                touched[medicine["id"]] = stored or medicine
+            for line in lines:
+                before = touched.get(line["medicine_id"]) or self._fetch(connection, store_id, line["medicine_id"])
+                if before is None:
+                    raise ValueError(f"Medicine {line['medicine_id']} not found")
+                if line["posting"] in (before.get("postings") or []):
+                    touched[line["medicine_id"]] = before
+                    continue
+                medicine = receive_line(before, line, applied_at)
+                _merge_deltas(deltas, counter_deltas(before, medicine))
+                touched[line["medicine_id"]] = medicine
+            # One transaction, so a ValueError above leaves nothing behind
+            for medicine in touched.values():
+                self._store(connection, medicine)
+            self._count(connection, store_id, deltas)
+            return list(touched.values())
+        return await self.database.write(run)
+
+    async def bulk_update(self, store_id, patches):
+        def run(connection):
+            applied_at = datetime.utcnow()
+            result = {"updated": [], "rejected": []}
+            deltas: Dict[tuple, dict] = {}
+            for patch in patches:
+                before = self._fetch(connection, store_id, patch["id"])
+                reason = bulk_rejection(patch, before)
+                if reason:
+                    result["rejected"].append({
+                        "id": patch["id"],
+                        "reason": reason,
+                        "updated_at": before.get("updated_at") if before else None
+                    })
+                    continue
+                medicine = apply_patch(before, patch, applied_at)
+                self._store(connection, medicine)
+                _merge_deltas(deltas, counter_deltas(before, medicine))
+                result["updated"].append(medicine)
+            self._count(connection, store_id, deltas)
+            return result
+        return await self.database.write(run)
+
+    async def bump_version(self, store_id, deleted=False):
+        def run(connection):
+            connection.execute(
+                "INSERT INTO catalog_versions (store_id, version, deletes) VALUES (?, 1, ?) "
+                "ON CONFLICT (store_id) DO UPDATE SET version = version + 1, deletes = deletes + excluded.deletes",
+                (store_id, int(deleted))
+            )
+            row = connection.execute(
+                "SELECT store_id, version, deletes FROM catalog_versions WHERE store_id = ?", (store_id,)
+            ).fetchone()
+            return dict(row)
+        return await self.database.write(run)
+
+    async def versions(self, store_id=None):
+        def run(connection):
+            if store_id:
+                rows = connection.execute(
+                    "SELECT store_id, version, deletes FROM catalog_versions WHERE store_id = ?", (store_id,)
+                )
+            else:
+                rows = connection.execute("SELECT store_id, version, deletes FROM catalog_versions")
+            return [dict(row) for row in rows]
+        return await self.database.read(run)
+
+
+class SQLiteSaleRepository(SaleRepository):
+    def __init__(self, database: SQLiteDatabase):
+        self.database = database
+
+    @staticmethod
+    def _date_filter(start_date, end_date, column: str = "sale_date"):
+        bounds = sale_date_bounds(start_date, end_date)
+        clauses, params = [], []
+        if "$gte" in bounds:
+            clauses.append(f"{column} >= ?")
+            params.append(bounds["$gte"])
+        if "$lte" in bounds:
+            clauses.append(f"{column} <= ?")
+            params.append(bounds["$lte"])
+        return "".join(f" AND {clause}" for clause in clauses), params
+
+    async def insert(self, sale):
+        def run(connection):
+            connection.execute(
+                "INSERT INTO sales (store_id, id, sale_date, total_amount, payment_method, receipt_number, "
+                "customer_phone, doc) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (sale["store_id"], sale["id"], _sortable(sale["sale_date"]), sale["total_amount"],
+                 sale["payment_method"], sale["receipt_number"], sale.get("customer_phone"), _dumps(sale))
+            )
+            connection.executemany(
+                "INSERT INTO sale_items (store_id, sale_id, medicine_id, medicine_name, sale_date, quantity, total) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(sale["store_id"], sale["id"], item["medicine_id"], item["medicine_name"],
+                  _sortable(sale["sale_date"]), item["quantity"], item["total"]) for item in sale["items"]]
+            )
+        await self.database.write(run)
+
+    async def get(self, store_id, sale_id):
+        def run(connection):
+            row = connection.execute(
+                "SELECT doc FROM sales WHERE store_id = ? AND id = ?", (store_id, sale_id)
+            ).fetchone()
+            return _loads(row["doc"]) if row else None
+        return await self.database.read(run)
+
+    async def find(self, store_id, start_date=None, end_date=None, medicine_id=None, medicine_name=None,
+                   limit=100, fields=None, customer_phone=None):
+        def run(connection):
+            date_sql, date_params = self._date_filter(start_date, end_date)
+            sql = "SELECT doc FROM sales WHERE store_id = ?" + date_sql
+            params = [store_id] + date_params
+            if customer_phone:
+                sql += " AND customer_phone = ?"
+                params.append(customer_phone)
+            if medicine_id:
+                sql += " AND id IN (SELECT sale_id FROM sale_items WHERE store_id = ? AND medicine_id = ?)"
+                params += [store_id, medicine_id]
+            elif medicine_name:
+                sql += (" AND id IN (SELECT sale_id FROM sale_items WHERE store_id = ? "
+                        "AND medicine_name LIKE ? ESCAPE '\\')")
+                params += [store_id, _like(medicine_name)]
+            sql += " ORDER BY sale_date DESC LIMIT ?"
+            params.append(limit)
+            keep = set(fields) | {"id"} if fields else None
+            return [project(_loads(row["doc"]), keep) for row in connection.execute(sql, params)]
+        return await self.database.read(run)
+
+    async def totals(self, store_id, start_date=None, end_date=None):
+        def run(connection):
+            date_sql, date_params = self._date_filter(start_date, end_date)
+            row = connection.execute(
+                "SELECT COALESCE(SUM(total_amount), 0) AS total_sales, COUNT(*) AS total_transactions "
+                "FROM sales WHERE store_id = ?" + date_sql,
+                [store_id] + date_params
+            ).fetchone()
+            return dict(row)
+        return await self.database.read(run)
+
+    async def medicine_totals(self, store_id, medicine_id, start_date=None, end_date=None):
+        def run(connection):
+            date_sql, date_params = self._date_filter(start_date, end_date)
+            row = connection.execute(
+                "SELECT COALESCE(SUM(quantity), 0) AS quantity_sold, COALESCE(SUM(total), 0) AS revenue, "
+                "COUNT(DISTINCT sale_id) AS transactions, MIN(sale_date) AS first_sale, MAX(sale_date) AS last_sale "
+                "FROM sale_items WHERE store_id = ? AND medicine_id = ?" + date_sql,
+                [store_id, medicine_id] + date_params
+            ).fetchone()
+            return dict(row)
+        return await self.database.read(run)
+
+    async def summary(self, store_id, start_date, end_date):
+        def run(connection):
+            date_sql, date_params = self._date_filter(start_date, end_date)
+            payments = connection.execute(
+                "SELECT payment_method, COUNT(*) AS transactions, SUM(total_amount) AS total, "
+                "MIN(receipt_number) AS first_receipt, MAX(receipt_number) AS last_receipt "
+                "FROM sales WHERE store_id = ?" + date_sql + " GROUP BY payment_method",
+                [store_id] + date_params
+            ).fetchall()
+            items = connection.execute(
+                "SELECT medicine_id, MIN(medicine_name) AS medicine_name, SUM(quantity) AS quantity, "
+                "SUM(total) AS total FROM sale_items WHERE store_id = ?" + date_sql + " GROUP BY medicine_id",
+                [store_id] + date_params
+            ).fetchall()
+            return {"payments": [dict(row) for row in payments], "items": [dict(row) for row in items]}
+        return await self.database.read(run)
+
+    async def scan(self, store_id, after, until, limit=None):
+        def run(connection):
+            sql = "SELECT doc FROM sales WHERE store_id = ? AND sale_date <= ?"
+            params = [store_id, until]
+            if after:
+                sql += " AND sale_date > ?"
+                params.append(after)
+            sql += " ORDER BY sale_date, id"
+            if limit:
+                sql += " LIMIT ?"
+                params.append(limit)
+            return [project(_loads(row["doc"]), SCAN_FIELDS) for row in connection.execute(sql, params)]
+        return await self.database.read(run)
+
+
+class SQLiteCustomerRepository(CustomerRepository):
+    def __init__(self, database: SQLiteDatabase):
+        self.database = database
+
+    async def record_sale(self, sale, recent_limit):
+        def run(connection):
+            row = connection.execute(
+                "SELECT doc FROM customers WHERE store_id = ? AND phone = ?", (sale["store_id"], sale["customer_phone"])
+            ).fetchone()
+            profile = _loads(row["doc"]) if row else {
+                "store_id": sale["store_id"], "phone": sale["customer_phone"], "first_visit": sale["sale_date"],
+                "visits": 0, "lifetime_spend": 0, "recent_sales": []
+            }
+            profile["visits"] += 1
+            profile["lifetime_spend"] += sale["total_amount"]
+            profile["last_visit"] = sale["sale_date"]
+            profile["updated_at"] = datetime.utcnow()
+            if sale.get("customer_name"):
+                profile["name"] = sale["customer_name"]
+            profile["recent_sales"] = [sale_summary(sale)] + profile["recent_sales"][:recent_limit - 1]
+            connection.execute(
+                "INSERT OR REPLACE INTO customers (store_id, phone, doc) VALUES (?, ?, ?)",
+                (profile["store_id"], profile["phone"], _dumps(profile))
+            )
+            return profile
+        return await self.database.write(run)
+
+    async def get(self, store_id, phone):
+        def run(connection):
+            row = connection.execute(
+                "SELECT doc FROM customers WHERE store_id = ? AND phone = ?", (store_id, phone)
+            ).fetchone()
+            return _loads(row["doc"]) if row else None
+        return await self.database.read(run)
+
+
+class SQLiteInventoryRepository(InventoryRepository):
+    def __init__(self, database: SQLiteDatabase):
+        self.database = database
+
+    async def counters(self, store_id):
+        def run(connection):
+            rows = connection.execute(
+                "SELECT supplier, expiry_date, skus, in_stock, units, value FROM inventory_counters "
+                "WHERE store_id = ? AND (skus > 0 OR units != 0)",
+                (store_id,)
+            )
+            return [dict(row) for row in rows]
+        return await self.database.read(run)
+
+    async def recompute(self, store_id):
+        def run(connection):
+            # SKUs count under the batch on sale, stock under every batch's own expiry
+            rows = connection.execute(
+                "SELECT supplier, expiry_date, SUM(skus) AS skus, SUM(in_stock) AS in_stock, SUM(units) AS units, "
+                "SUM(value) AS value FROM ("
+                "  SELECT json_extract(doc, '$.supplier') AS supplier, expiry_date, COUNT(*) AS skus, "
+                "  SUM(stock_quantity > 0) AS in_stock, 0 AS units, 0 AS value "
+                "  FROM medicines WHERE store_id = ? GROUP BY supplier, expiry_date "
+                "  UNION ALL "
+                "  SELECT json_extract(doc, '$.supplier'), json_extract(batch.value, '$.expiry_date'), 0, 0, "
+                "  SUM(json_extract(batch.value, '$.quantity')), "
+                "  SUM(json_extract(doc, '$.price') * json_extract(batch.value, '$.quantity')) "
+                "  FROM medicines, json_each(medicines.doc, '$.batches') AS batch WHERE store_id = ? "
+                "  GROUP BY 1, 2"
+                ") GROUP BY supplier, expiry_date HAVING SUM(skus) > 0 OR SUM(units) != 0",
+                (store_id, store_id)
+            )
+            return [dict(row) for row in rows]
+        return await self.database.read(run)
+
+    async def replace(self, store_id, rows):
+        def run(connection):
+            connection.execute("DELETE FROM inventory_counters WHERE store_id = ?", (store_id,))
+            connection.executemany(
+                "INSERT INTO inventory_counters (store_id, supplier, expiry_date, skus, in_stock, units, value) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(store_id, row["supplier"], row["expiry_date"], *(row[field] for field in COUNTER_FIELDS))
+                 for row in rows]
+            )
+        await self.database.write(run)
+
+
+class SQLitePurchaseRepository(PurchaseRepository):
+    def __init__(self, database: SQLiteDatabase):
+        self.database = database
+
+    @staticmethod
+    def _fetch(connection, store_id, kind, document_id) -> Optional[dict]:
+        row = connection.execute(
+            "SELECT doc FROM purchases WHERE store_id = ? AND id = ? AND kind = ?", (store_id, document_id, kind)
+        ).fetchone()
+        return _loads(row["doc"]) if row else None
+
+    @staticmethod
+    def _store(connection, document: dict):
+        connection.execute(
+            "INSERT OR REPLACE INTO purchases (store_id, id, kind, supplier, status, created_at, doc) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (document["store_id"], document["id"], document["kind"], document["supplier"], document["status"],
+             _sortable(document["created_at"]), _dumps(document))
+        )
+
+    @classmethod
+    def _transition(cls, connection, store_id, kind, document_id, statuses, changes) -> Optional[dict]:
+        document = cls._fetch(connection, store_id, kind, document_id)
+        if document is None or document["status"] not in statuses:
+            return None
+        document.update(changes, updated_at=datetime.utcnow())
+        cls._store(connection, document)
+        return document
+
+    async def insert(self, document):
+        await self.database.write(self._store, document)
+
+    async def get(self, store_id, kind, document_id):
+        return await self.database.read(self._fetch, store_id, kind, document_id)
+
+    async def find(self, store_id, kind, supplier=None, status=None, limit=100):
+        def run(connection):
+            sql = "SELECT doc FROM purchases WHERE store_id = ? AND kind = ?"
+            params: list = [store_id, kind]
+            if supplier:
+                sql += " AND supplier = ?"
+                params.append(supplier)
+            if status:
+                sql += " AND status = ?"
+                params.append(status)
+            sql += " ORDER BY created_at DESC LIMIT ?"
+            params.append(limit)
+            return [_loads(row["doc"]) for row in connection.execute(sql, params)]
+        return await self.database.read(run)
+
+    async def transition(self, store_id, kind, document_id, statuses, changes):
+        statuses = tuple(statuses)
+        return await self.database.write(self._transition, store_id, kind, document_id, statuses, changes)
+
+    async def complete_receipt(self, store_id, receipt_id, posted_at):
+        def run(connection):
+            receipt = self._transition(
+                connection, store_id, "receipt", receipt_id, ("posting",), {"status": "posted", "posted_at": posted_at}
+            )
+            if receipt:
+                increments = supplier_increments(receipt)
+                connection.execute(
+                    "INSERT INTO supplier_totals (store_id, supplier, receipts, units, cost, last_received_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (store_id, supplier) DO UPDATE SET "
+                    "receipts = receipts + excluded.receipts, units = units + excluded.units, "
+                    "cost = cost + excluded.cost, last_received_at = MAX(last_received_at, excluded.last_received_at)",
+                    (store_id, receipt["supplier"], increments["receipts"], increments["units"], increments["cost"],
+                     _sortable(posted_at))
+                )
+            return receipt
+        return await self.database.write(run)
+
+    async def supplier_totals(self, store_id):
+        def run(connection):
+            rows = connection.execute(
+                "SELECT supplier, receipts, units, cost, last_received_at FROM supplier_totals "
+                "WHERE store_id = ? ORDER BY supplier",
+                (store_id,)
+            )
+            return [
+                {**dict(row), "last_received_at": datetime.fromisoformat(row["last_received_at"])} for row in rows
+            ]
+        return await self.database.read(run)
+
+
+class SQLiteUserRepository(UserRepository):
+    def __init__(self, database: SQLiteDatabase):
+        self.database = database
+
+    async def insert(self, user):
+        def run(connection):
+            connection.execute(
+                "INSERT INTO users (store_id, id, username, doc) VALUES (?, ?, ?, ?)",
+                (user["store_id"], user["id"], user["username"], _dumps(user))
+            )
+        await self.database.write(run)
+
+    async def list(self, store_id, limit=1000):
+        def run(connection):
+            rows = connection.execute("SELECT doc FROM users WHERE store_id = ? LIMIT ?", (store_id, limit))
+            return [_loads(row["doc"]) for row in rows]
+        return await self.database.read(run)
+
+
+class SQLiteShopRepository(ShopRepository):
+    def __init__(self, database: SQLiteDatabase):
+        self.database = database
+
+    async def get(self, store_id):
+        def run(connection):
+            row = connection.execute("SELECT doc FROM shops WHERE store_id = ?", (store_id,)).fetchone()
+            return _loads(row["doc"]) if row else None
+        return await self.database.read(run)
+
+    async def save(self, shop):
+        def run(connection):
+            stored = dict(shop)
+            row = connection.execute("SELECT doc FROM shops WHERE store_id = ?", (stored["store_id"],)).fetchone()
+            if row:
+                stored["id"] = _loads(row["doc"])["id"]
+            connection.execute(
+                "INSERT OR REPLACE INTO shops (store_id, doc) VALUES (?, ?)", (stored["store_id"], _dumps(stored))
+            )
+            return stored
+        return await self.database.write(run)
+
+
+class SQLiteRepository(Repository):
+    backend = "sqlite"
+
+    def __init__(self, path: str, workers: int = 4):
+        self.database = SQLiteDatabase(path, workers)
+        self.medicines = SQLiteMedicineRepository(self.database)
+        self.sales = SQLiteSaleRepository(self.database)
+        self.customers = SQLiteCustomerRepository(self.database)
+        self.inventory = SQLiteInventoryRepository(self.database)
+        self.purchases = SQLitePurchaseRepository(self.database)
+        self.users = SQLiteUserRepository(self.database)
+        self.shops = SQLiteShopRepository(self.database)
+
+    async def initialize(self):
+        def run(connection):
+            version = connection.execute("PRAGMA user_version").fetchone()[0]
+            for number, migration in enumerate(SQLITE_MIGRATIONS[version:], start=version + 1):
+                connection.executescript(migration)
+                connection.execute(f"PRAGMA user_version = {number}")
+        # executescript manages its own transaction, so this bypasses `write`
+        await self.database.read(run)
+
+    async def close(self):
+        await asyncio.to_thread(self.database.close)
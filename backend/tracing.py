@@ -0,0 +1,262 @@
+"""Sampled per-request tracing in Chrome trace-event format.
+
+A sampled request gets a `Trace` held in a context variable; `span()` records
+nested, timed sections anywhere below it (storage calls, model construction,
+encoding). Finished traces are kept in memory for lookup by request ID and
+appended to a rotating file that chrome://tracing or https://ui.perfetto.dev
+open directly. Outside a sampled request `span()` is a cheap no-op.
+"""
+import asyncio
+import contextvars
+import functools
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+
+
+_current: contextvars.ContextVar[Optional["Trace"]] = contextvars.ContextVar("trace", default=None)
+# perf_counter is monotonic but has no epoch; this maps it onto wall-clock microseconds
+_EPOCH_OFFSET = time.time() - time.perf_counter()
+
+
+def _now_us() -> float:
+    return (time.perf_counter() + _EPOCH_OFFSET) * 1_000_000
+
+
+class Trace:
+    _next_tid = 1
+    _tid_lock = threading.Lock()
+
+    def __init__(self, request_id: str, name: str):
+        self.request_id = request_id
+        self.name = name
+        self.pid = os.getpid()
+        self.started = _now_us()
+        self.events: List[dict] = []
+        self._tids: Dict[int, int] = {}
+
+    def tid(self) -> int:
+        """One row per asyncio task, so concurrent spans do not overlap in the viewer."""
+        try:
+            task_key = id(asyncio.current_task())
+        except RuntimeError:
+            task_key = threading.get_ident()
+        tid = self._tids.get(task_key)
+        if tid is None:
+            with Trace._tid_lock:
+                tid = Trace._next_tid
+                Trace._next_tid += 1
+            self._tids[task_key] = tid
+            label = self.name if len(self._tids) == 1 else f"{self.name} task {len(self._tids)}"
+            self.events.append({
+                "name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid,
+                "args": {"name": f"{label} [{self.request_id}]"}
+            })
+        return tid
+
+    def add(self, name: str, category: str, started: float, duration: float, args: dict):
+        self.events.append({
+            "name": name, "cat": category, "ph": "X", "ts": round(started, 3), "dur": round(duration, 3),
+            "pid": self.pid, "tid": self.tid(), "args": {"request_id": self.request_id, **args}
+        })
+
+    def summary(self) -> dict:
+        spans = [event for event in self.events if event["ph"] == "X"]
+        return {
+            "request_id": self.request_id,
+            "name": self.name,
+            "started_at": self.started / 1_000_000,
+            "duration_ms": round(max((e["ts"] + e["dur"] for e in spans), default=self.started) / 1000
+                                 - self.started / 1000, 3),
+            "spans": len(spans)
+        }
+
+
+def current() -> Optional[Trace]:
+    return _current.get()
+
+
+@contextmanager
+def span(name: str, category: str = "app", **args):
+    """Time the enclosed block as a span of the current trace, if any."""
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    started = _now_us()
+    try:
+        yield
+    finally:
+        trace.add(name, category, started, _now_us() - started, args)
+
+
+class _TracedRepository:
+    """Proxy that wraps every coroutine method of a repository in a "db" span."""
+
+    def __init__(self, target, prefix: str):
+        self._target = target
+        self._prefix = prefix
+
+    def __getattr__(self, name):
+        attribute = getattr(self._target, name)
+        if not asyncio.iscoroutinefunction(attribute):
+            return attribute
+
+        @functools.wraps(attribute)
+        async def traced(*args, **kwargs):
+            with span(f"{self._prefix}.{name}", "db"):
+                return await attribute(*args, **kwargs)
+        return traced
+
+
+def instrument_repository(repository, parts=("medicines", "sales", "customers", "inventory", "purchases", "users",
+                                             "shops")):
+    for part in parts:
+        if hasattr(repository, part):
+            setattr(repository, part, _TracedRepository(getattr(repository, part), part))
+    return repository
+
+
+class TraceFile:
+    """Appends trace events to a JSON array file, rotating by size.
+
+    Each event is written on its own line followed by a comma. The trace
+    viewers accept an array without the closing bracket, which keeps the file
+    valid while it is still being appended to.
+    """
+
+    def __init__(self, path: Path, max_bytes: int, backups: int):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._lock = threading.Lock()
+
+    def _rotate(self):
+        for index in range(self.backups - 1, 0, -1):
+            source = self.path.with_name(f"{self.path.name}.{index}")
+            if source.exists():
+                source.replace(self.path.with_name(f"{self.path.name}.{index + 1}"))
+        if self.backups:
+            self.path.replace(self.path.with_name(f"{self.path.name}.1"))
+        else:
+            self.path.unlink()
+
+    def write(self, events: List[dict]):
+        lines = "".join(json.dumps(event, default=str) + ",\n" for event in events)
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            if self.path.exists() and self.path.stat().st_size + len(lines) > self.max_bytes:
+                self._rotate()
+            with open(self.path, "a", encoding="utf-8") as output:
+                if output.tell() == 0:
+                    output.write("[\n")
+                output.write(lines)
+
+    def find(self, request_id: str) -> List[dict]:
+        """Events of one request, searched across the current and rotated files."""
+        events = []
+        with self._lock:
+            paths = [self.path] + [self.path.with_name(f"{self.path.name}.{i}") for i in range(1, self.backups + 1)]
+            for path in paths:
+                if not path.exists():
+                    continue
+                with open(path, encoding="utf-8") as source:
+                    for line in source:
+                        if request_id in line:
+                            event = json.loads(line.rstrip().rstrip(","))
+                            if event.get("args", {}).get("request_id") == request_id or \
+                                    event.get("args", {}).get("name", "").endswith(f"[{request_id}]"):
+                                events.append(event)
+        return events
+
+
+class Tracer:
+    def __init__(self, sample_rate: float, trace_file: Optional[TraceFile], buffer_size: int = 200):
+        self.sample_rate = sample_rate
+        self.trace_file = trace_file
+        self.buffer_size = buffer_size
+        self.recent: "OrderedDict[str, Trace]" = OrderedDict()
+        self.sampled = 0
+        self.requests = 0
+
+    def should_sample(self, forced: bool) -> bool:
+        self.requests += 1
+        return forced or (self.sample_rate > 0 and random.random() < self.sample_rate)
+
+    async def finish(self, trace: Trace):
+        self.sampled += 1
+        self.recent[trace.request_id] = trace
+        while len(self.recent) > self.buffer_size:
+            self.recent.popitem(last=False)
+        if self.trace_file:
+            await asyncio.to_thread(self.trace_file.write, trace.events)
+
+    async def events(self, request_id: str) -> Optional[List[dict]]:
+        trace = self.recent.get(request_id)
+        if trace:
+            return trace.events
+        if self.trace_file:
+            events = await asyncio.to_thread(self.trace_file.find, request_id)
+            return events or None
+        return None
+
+    def metrics(self) -> dict:
+        return {
+            "sample_rate": self.sample_rate,
+            "requests": self.requests,
+            "sampled": self.sampled,
+            "file": str(self.trace_file.path) if self.trace_file else None,
+            "recent": [trace.summary() for trace in reversed(self.recent.values())]
+        }
+
+
+class TracingMiddleware:
+    """Starts a trace for sampled requests and tags responses with X-Request-ID.
+
+    `X-Trace: 1` forces a trace for that request; an incoming X-Request-ID is
+    reused so traces can be matched to client or proxy logs.
+    """
+
+    def __init__(self, app, tracer: Tracer):
+        self.app = app
+        self.tracer = tracer
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        if not self.tracer.should_sample(headers.get("x-trace") == "1"):
+            await self.app(scope, receive, send)
+            return
+
+        request_id = headers.get("x-request-id") or uuid.uuid4().hex
+        trace = Trace(request_id, f"{scope['method']} {scope['path']}")
+        status = None
+
+        async def send_with_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                MutableHeaders(scope=message)["X-Request-ID"] = request_id
+            await send(message)
+
+        token = _current.set(trace)
+        started = _now_us()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            trace.add(trace.name, "request", started, _now_us() - started, {
+                "query": scope["query_string"].decode("latin-1"), "status": status
+            })
+            _current.reset(token)
+            await self.tracer.finish(trace)
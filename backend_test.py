@@ -50,6 +50,8 @@ def make_request(method, endpoint, data=None, params=None):
             response = requests.post(url, json=data, timeout=30)
         elif method == "PUT":
             response = requests.put(url, json=data, timeout=30)
+        elif method == "PATCH":
+            response = requests.patch(url, json=data, timeout=30)
         elif method == "DELETE":
             response = requests.delete(url, timeout=30)
         
@@ -146,7 +148,36 @@ def test_medicine_inventory_management(results):
         else:
             results.log_fail("Update medicine", f"Status: {response.status_code if response else 'No response'}")
         
-        # Test 6: Delete the created medicine
+        # Test 6: Bulk partial update with optimistic concurrency
+        bulk_data = {"updates": [{
+            "id": created_medicine["id"],
+            "price": 32.00,
+            "stock_delta": -10,
+            "expected_updated_at": updated_medicine["updated_at"]
+        }]} if response and response.status_code == 200 else {"updates": []}
+        response = make_request("PATCH", "/medicines/bulk", data=bulk_data)
+        if response and response.status_code == 200 and response.json()["updated"] == 1:
+            medicine = make_request("GET", f"/medicines/{created_medicine['id']}").json()
+            if medicine["price"] == 32.00 and medicine["stock_quantity"] == 140:
+                results.log_pass("Bulk update medicines")
+            else:
+                results.log_fail("Bulk update medicines", f"Got price {medicine['price']}, stock {medicine['stock_quantity']}")
+        else:
+            results.log_fail("Bulk update medicines", f"Status: {response.status_code if response else 'No response'}")
+        
+        # Test 7: Receive a second batch with an earlier expiry
+        batch = {"batch_number": "TEST000", "expiry_date": "2025-06-30", "quantity": 10}
+        response = make_request("POST", f"/medicines/{created_medicine['id']}/batches", data=batch)
+        if response and response.status_code == 200:
+            medicine = response.json()
+            if medicine["stock_quantity"] == 150 and medicine["batch_number"] == "TEST000" and len(medicine["batches"]) == 2:
+                results.log_pass("Receive medicine batch")
+            else:
+                results.log_fail("Receive medicine batch", f"Got stock {medicine['stock_quantity']}, batches {medicine['batches']}")
+        else:
+            results.log_fail("Receive medicine batch", f"Status: {response.status_code if response else 'No response'}")
+        
+        # Test 8: Delete the created medicine
         response = make_request("DELETE", f"/medicines/{created_medicine['id']}")
         if response and response.status_code == 200:
             results.log_pass("Delete medicine")
@@ -155,7 +186,19 @@ def test_medicine_inventory_management(results):
             results.log_fail("Delete medicine", f"Status: {response.status_code if response else 'No response'}")
     else:
         results.log_fail("Create new medicine", f"Status: {response.status_code if response else 'No response'}")
-    
+
+    # Test 9: Inventory valuation counters agree with a full recompute
+    response = make_request("GET", "/inventory/valuation")
+    verify = make_request("GET", "/inventory/valuation/verify")
+    if response and response.status_code == 200 and verify and verify.status_code == 200:
+        if verify.json()["consistent"] and response.json()["totals"] == verify.json()["totals"]:
+            results.log_pass("Inventory valuation")
+            print(f"   Stock value: {response.json()['totals']['value']}")
+        else:
+            results.log_fail("Inventory valuation", f"Counters drifted: {verify.json()['mismatches'][:3]}")
+    else:
+        results.log_fail("Inventory valuation", f"Status: {response.status_code if response else 'No response'}")
+
     return True
 
 def test_point_of_sale_system(results):
@@ -211,6 +254,13 @@ def test_point_of_sale_system(results):
         results.log_pass("Create sale transaction")
         print(f"   Created sale with receipt: {sale['receipt_number']}")
         
+        # Stock is taken earliest expiry first and the batches are recorded on the line
+        taken = sale["items"][0].get("batches", [])
+        if sum(batch["quantity"] for batch in taken) == 2:
+            results.log_pass("Sale records consumed batches")
+        else:
+            results.log_fail("Sale records consumed batches", f"Got {taken}")
+        
         # Test 2: Verify stock deduction
         response = make_request("GET", f"/medicines/{medicine_for_sale['id']}")
         if response and response.status_code == 200:
@@ -230,11 +280,27 @@ def test_point_of_sale_system(results):
             print(f"   Receipt number format correct: {sale['receipt_number']}")
         else:
             results.log_fail("Receipt number generation", f"Invalid format: {sale.get('receipt_number')}")
+
+        # Test 4: Printable receipt
+        response = make_request("GET", f"/sales/{sale['id']}/receipt", params={"format": "text"})
+        if response and response.status_code == 200 and sale["receipt_number"] in response.text:
+            results.log_pass("Printable receipt rendering")
+        else:
+            results.log_fail("Printable receipt rendering", f"Status: {response.status_code if response else 'No response'}")
+
+        # Test 5: Customer history by phone
+        response = make_request("GET", "/customers/+91 98765 43210/history")
+        if response and response.status_code == 200 and \
+                any(entry["sale_id"] == sale["id"] for entry in response.json()["sales"]):
+            results.log_pass("Customer purchase history")
+            print(f"   Customer has {response.json()['profile']['visits']} visit(s)")
+        else:
+            results.log_fail("Customer purchase history", f"Status: {response.status_code if response else 'No response'}")
     else:
         results.log_fail("Create sale transaction", f"Status: {response.status_code if response else 'No response'}")
         return False
     
-    # Test 4: Test insufficient stock scenario
+    # Test 6: Test insufficient stock scenario
     insufficient_sale = {
         "items": [
             {
@@ -314,7 +380,40 @@ def test_sales_analytics(results):
         print(f"   Today's sales: {len(filtered_sales)} records")
     else:
         results.log_fail("Sales date filtering", f"Status: {response.status_code if response else 'No response'}")
-    
+
+    # Test 5: Filter by medicine ID and per-medicine history
+    if sales:
+        medicine_id = sales[0]["items"][0]["medicine_id"]
+        response = make_request("GET", "/sales", params={"medicine_id": medicine_id})
+        if response and response.status_code == 200:
+            medicine_sales = response.json()
+            if medicine_sales and all(
+                any(item["medicine_id"] == medicine_id for item in sale["items"]) for sale in medicine_sales
+            ):
+                results.log_pass("Sales filtering by medicine ID")
+            else:
+                results.log_fail("Sales filtering by medicine ID", "Returned sales without the requested medicine")
+        else:
+            results.log_fail("Sales filtering by medicine ID", f"Status: {response.status_code if response else 'No response'}")
+
+        response = make_request("GET", f"/medicines/{medicine_id}/sales")
+        if response and response.status_code == 200:
+            history = response.json()
+            if history["totals"]["quantity_sold"] > 0 and history["history"]:
+                results.log_pass("Medicine sales history")
+                print(f"   Medicine sold {history['totals']['quantity_sold']} units in {history['totals']['transactions']} sales")
+            else:
+                results.log_fail("Medicine sales history", "Empty history for a sold medicine")
+        else:
+            results.log_fail("Medicine sales history", f"Status: {response.status_code if response else 'No response'}")
+
+    # Test 6: Daily Z-report
+    response = make_request("GET", "/reports/z-report", params={"report_date": today, "format": "csv"})
+    if response and response.status_code == 200 and response.text.startswith("Z-Report"):
+        results.log_pass("Daily Z-report CSV")
+    else:
+        results.log_fail("Daily Z-report CSV", f"Status: {response.status_code if response else 'No response'}")
+
     return True
 
 def test_user_management_with_permissions(results):
@@ -497,6 +596,112 @@ def test_low_stock_scenario(results):
     
     return True
 
+def test_goods_receipts(results):
+    """Test purchase orders and posting goods receipts"""
+    print("\n🔍 Testing Goods Receipts...")
+    
+    response = make_request("GET", "/medicines")
+    if not response or response.status_code != 200 or not response.json():
+        results.log_fail("Goods receipt - Get medicines", "Cannot retrieve medicines")
+        return False
+    medicine = response.json()[0]
+    
+    # Test 1: Raise a purchase order
+    order_data = {"supplier": "Test Supplier", "lines": [
+        {"medicine_id": medicine["id"], "medicine_name": medicine["name"], "quantity": 20, "unit_cost": 1.5}
+    ]}
+    response = make_request("POST", "/purchase-orders", data=order_data)
+    if response and response.status_code == 200 and response.json()["status"] == "open":
+        order = response.json()
+        results.log_pass("Create purchase order")
+    else:
+        results.log_fail("Create purchase order", f"Status: {response.status_code if response else 'No response'}")
+        return False
+    
+    # Test 2: Receive it, with a batch of a medicine that is new to the shop
+    receipt_data = {
+        "supplier": "Test Supplier",
+        "purchase_order_id": order["id"],
+        "lines": [
+            {"medicine_id": medicine["id"], "batch_number": f"GRN{int(time.time())}", "expiry_date": "2030-12-31",
+             "quantity": 20, "unit_cost": 1.5},
+            {"medicine_name": "GRN Test Medicine", "price": 12.0, "batch_number": "GRN001",
+             "expiry_date": "2030-06-30", "quantity": 5, "unit_cost": 8.0}
+        ]
+    }
+    response = make_request("POST", "/goods-receipts", data=receipt_data)
+    if response and response.status_code == 200 and response.json()["status"] == "posted":
+        receipt = response.json()
+        restocked = make_request("GET", f"/medicines/{medicine['id']}").json()
+        if restocked["stock_quantity"] >= medicine["stock_quantity"] + 20:
+            results.log_pass("Post goods receipt")
+        else:
+            results.log_fail("Post goods receipt", f"Stock {medicine['stock_quantity']} -> {restocked['stock_quantity']}")
+    else:
+        results.log_fail("Post goods receipt", f"Status: {response.status_code if response else 'No response'}")
+        return False
+    
+    # Test 3: A posted receipt cannot be posted twice
+    response = make_request("POST", f"/goods-receipts/{receipt['id']}/post")
+    if response and response.status_code == 409:
+        results.log_pass("Reject second posting")
+    else:
+        results.log_fail("Reject second posting", f"Status: {response.status_code if response else 'No response'}")
+    
+    # Test 4: The order is received and the supplier totals include the receipt
+    order = make_request("GET", f"/purchase-orders/{order['id']}").json()
+    response = make_request("GET", "/suppliers/totals")
+    totals = {row["supplier"]: row for row in response.json()["suppliers"]} if response else {}
+    if order["status"] == "received" and totals.get("Test Supplier", {}).get("units", 0) >= 25:
+        results.log_pass("Purchase order and supplier totals")
+    else:
+        results.log_fail("Purchase order and supplier totals", f"Order {order['status']}, totals {totals}")
+    
+    return True
+
+def test_bootstrap(results):
+    """Test the one-request bootstrap and its post-sale delta"""
+    print("\n🔍 Testing Bootstrap...")
+    
+    # Test 1: One response carries everything the app shows on start
+    response = make_request("GET", "/bootstrap")
+    if response and response.status_code == 200 and response.json()["medicines"]:
+        bootstrap = response.json()
+        sections = {"cursor", "medicines", "recent_sales", "analytics", "users", "shop"}
+        if set(bootstrap) == sections and "password_hash" not in (bootstrap["users"] or [{}])[0]:
+            results.log_pass("Bootstrap")
+        else:
+            results.log_fail("Bootstrap", f"Sections: {sorted(bootstrap)}")
+    else:
+        results.log_fail("Bootstrap", f"Status: {response.status_code if response else 'No response'}")
+        return False
+    
+    # Test 2: After a sale the delta has the sold medicine's stock and the new sale
+    medicine = next(m for m in bootstrap["medicines"] if m["stock_quantity"] > 0)
+    sale_data = {
+        "items": [{"medicine_id": medicine["id"], "medicine_name": medicine["name"], "quantity": 1,
+                   "price": medicine["price"], "total": medicine["price"]}],
+        "total_amount": medicine["price"],
+        "payment_method": "cash",
+        "cashier_id": DEFAULT_CASHIER_ID
+    }
+    response = make_request("POST", "/sales", data=sale_data)
+    if not response or response.status_code != 200:
+        results.log_fail("Bootstrap delta - Create sale",
+                         f"Status: {response.status_code if response else 'No response'}")
+        return False
+    sale = response.json()
+    response = make_request("GET", "/bootstrap/delta", params={"cursor": bootstrap["cursor"]})
+    delta = response.json() if response and response.status_code == 200 else {}
+    changed = {m["id"]: m for m in delta.get("medicines", [])}
+    if changed.get(medicine["id"], {}).get("stock_quantity") == medicine["stock_quantity"] - 1 and \
+            delta["recent_sales"][0]["id"] == sale["id"] and delta["recent_sales"][0]["item_count"] == 1:
+        results.log_pass("Bootstrap delta after sale")
+    else:
+        results.log_fail("Bootstrap delta after sale", f"Response: {delta}")
+    
+    return True
+
 def main():
     """Run all backend tests"""
     print("🚀 Starting Medicine POS System Backend API Tests")
@@ -517,6 +722,8 @@ def main():
     test_user_management_with_permissions(results)
     test_shop_details_management(results)
     test_low_stock_scenario(results)
+    test_goods_receipts(results)
+    test_bootstrap(results)
     
     # Print final summary
     success = results.summary()
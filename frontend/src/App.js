@@ -5,6 +5,11 @@ import axios from 'axios';
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
 
+// Each till belongs to one store; the backend falls back to its default store
+if (process.env.REACT_APP_STORE_ID) {
+  axios.defaults.headers.common['X-Store-ID'] = process.env.REACT_APP_STORE_ID;
+}
+
 const App = () => {
   const [currentView, setCurrentView] = useState('pos');
   const [medicines, setMedicines] = useState([]);
@@ -26,14 +31,12 @@ const App = () => {
   const quantityRefs = useRef([]);
   const customerNameRef = useRef(null);
   const customerPhoneRef = useRef(null);
+  // Where the next /bootstrap/delta picks up from
+  const bootstrapCursor = useRef(null);
 
-  // Fetch data on component mount
+  // Everything the app shows comes back from one request on mount
   useEffect(() => {
-    fetchMedicines();
-    fetchSales();
-    fetchAnalytics();
-    fetchUsers();
-    fetchShop();
+    fetchBootstrap();
   }, []);
 
   // Keyboard shortcuts
@@ -201,39 +204,50 @@ const App = () => {
     }
   };
 
-  const fetchSales = async () => {
-    try {
-      const response = await axios.get(`${API}/sales`);
-      setSales(response.data);
-    } catch (error) {
-      console.error('Error fetching sales:', error);
-    }
-  };
-
-  const fetchAnalytics = async () => {
+  const fetchBootstrap = async () => {
     try {
-      const response = await axios.get(`${API}/sales/analytics`);
-      setAnalytics(response.data);
+      const response = await axios.get(`${API}/bootstrap`);
+      const data = response.data;
+      bootstrapCursor.current = data.cursor;
+      setMedicines(data.medicines);
+      setSales(data.recent_sales);
+      setAnalytics(data.analytics);
+      setUsers(data.users);
+      setShop(data.shop);
     } catch (error) {
-      console.error('Error fetching analytics:', error);
+      console.error('Error fetching bootstrap data:', error);
     }
   };
 
-  const fetchUsers = async () => {
-    try {
-      const response = await axios.get(`${API}/users`);
-      setUsers(response.data);
-    } catch (error) {
-      console.error('Error fetching users:', error);
+  // Stock levels, recent sales and analytics changed since the last bootstrap or delta
+  const refreshDashboard = async () => {
+    if (!bootstrapCursor.current) {
+      fetchBootstrap();
+      return;
     }
-  };
-
-  const fetchShop = async () => {
     try {
-      const response = await axios.get(`${API}/shop`);
-      setShop(response.data);
+      const response = await axios.get(`${API}/bootstrap/delta`, {
+        params: { cursor: bootstrapCursor.current }
+      });
+      const data = response.data;
+      bootstrapCursor.current = data.cursor;
+      setSales(data.recent_sales);
+      setAnalytics(data.analytics);
+      if (data.full_catalog) {
+        searchTerm ? fetchMedicines(searchTerm) : setMedicines(data.medicines);
+        return;
+      }
+      const changed = new Map(data.medicines.map(medicine => [medicine.id, medicine]));
+      setMedicines(current => {
+        const merged = current.map(medicine => changed.get(medicine.id) || medicine);
+        if (searchTerm) {
+          return merged;
+        }
+        const known = new Set(current.map(medicine => medicine.id));
+        return merged.concat(data.medicines.filter(medicine => !known.has(medicine.id)));
+      });
     } catch (error) {
-      console.error('Error fetching shop details:', error);
+      console.error('Error refreshing dashboard:', error);
     }
   };
 
@@ -307,9 +321,7 @@ const App = () => {
       setCustomerName('');
       setCustomerPhone('');
       setPaymentMethod('cash');
-      fetchMedicines();
-      fetchSales();
-      fetchAnalytics();
+      refreshDashboard();
       
       alert('Sale completed successfully!');
       
@@ -594,7 +606,7 @@ const App = () => {
                   <td className="py-3 text-sm">{sale.customer_name || 'Walk-in'}</td>
                   <td className="py-3 text-sm">
                     <span className="bg-blue-100 text-blue-800 px-2 py-1 rounded-full text-xs">
-                      {sale.items.length} items
+                      {sale.item_count} items
                     </span>
                   </td>
                   <td className="py-3 text-sm font-semibold text-green-600">₹{sale.total_amount.toFixed(2)}</td>
@@ -637,7 +649,7 @@ const App = () => {
             📦 View Inventory (Ctrl+I)
           </button>
           <button
-            onClick={() => {fetchSales(); fetchAnalytics();}}
+            onClick={refreshDashboard}
             className="bg-purple-600 text-white px-4 py-2 rounded hover:bg-purple-700 text-sm"
           >
             🔄 Refresh Data
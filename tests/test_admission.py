@@ -0,0 +1,119 @@
+"""Admission control: reserved capacity, bounded queues, shedding and priority."""
+import asyncio
+
+import httpx
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+import admission
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def controller(capacity=4, heavy_limit=2, heavy_queue=2, heavy_timeout=5.0):
+    return admission.AdmissionController(capacity, [
+        admission.RouteClass("checkout", 0, limit=capacity, reserved=2, queue=10, timeout=5.0),
+        admission.RouteClass("heavy", 1, limit=heavy_limit, queue=heavy_queue, timeout=heavy_timeout),
+    ])
+
+
+def test_heavy_reads_are_bounded_and_shed_without_blocking_checkout():
+    async def scenario():
+        gate = asyncio.Event()
+
+        async def heavy(request):
+            await gate.wait()
+            return JSONResponse({"ok": True})
+
+        async def checkout(request):
+            return JSONResponse({"ok": True})
+
+        app = Starlette(routes=[Route("/heavy", heavy), Route("/checkout", checkout, methods=["POST"])])
+        limits = controller()
+        app.add_middleware(
+            admission.AdmissionMiddleware, controller=limits,
+            classify=lambda method, path, query: "heavy" if path == "/heavy" else "checkout"
+        )
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            reports = [asyncio.create_task(client.get("/heavy")) for _ in range(8)]
+            while limits.classes["heavy"].active + len(limits.classes["heavy"].waiters) < 4:
+                await asyncio.sleep(0.01)
+            # Reports hold every slot they may have; checkout still gets straight in
+            checkouts = await asyncio.wait_for(asyncio.gather(*[client.post("/checkout") for _ in range(3)]), 1)
+            assert [response.status_code for response in checkouts] == [200, 200, 200]
+            gate.set()
+            responses = await asyncio.gather(*reports)
+        return responses, limits.metrics()
+
+    responses, metrics = run(scenario())
+    assert sorted(response.status_code for response in responses) == [200] * 4 + [429] * 4
+    shed = [response for response in responses if response.status_code == 429]
+    assert all(int(response.headers["Retry-After"]) >= 1 for response in shed)
+    heavy = metrics["classes"]["heavy"]
+    assert (heavy["admitted"], heavy["peak_queue_depth"], heavy["shed"]["queue_full"]) == (4, 2, 4)
+    assert metrics["classes"]["checkout"]["admitted"] == 3
+    assert metrics["shared_in_use"] == 0 and heavy["active"] == 0
+
+
+def test_queued_request_is_shed_after_its_timeout():
+    async def scenario():
+        limits = controller(heavy_limit=1, heavy_timeout=0.05)
+        heavy = limits.classes["heavy"]
+        assert await limits.acquire(heavy) is None
+        retry_after = await limits.acquire(heavy)
+        limits.release(heavy)
+        return retry_after, heavy
+
+    retry_after, heavy = run(scenario())
+    assert retry_after >= 1
+    assert heavy.shed == {"queue_full": 0, "timeout": 1} and not heavy.waiters
+
+
+def test_freed_slots_go_to_the_highest_priority_waiter():
+    async def scenario():
+        limits = admission.AdmissionController(1, [
+            admission.RouteClass("checkout", 0, limit=1, queue=5, timeout=5.0),
+            admission.RouteClass("heavy", 1, limit=1, queue=5, timeout=5.0),
+        ])
+        checkout, heavy = limits.classes["checkout"], limits.classes["heavy"]
+        order = []
+
+        async def request(route_class):
+            assert await limits.acquire(route_class) is None
+            order.append(route_class.name)
+            limits.release(route_class)
+
+        assert await limits.acquire(heavy) is None
+        # The report queued first, but the till is served first once the slot frees
+        waiting = [asyncio.create_task(request(heavy)), asyncio.create_task(request(checkout))]
+        await asyncio.sleep(0.01)
+        limits.release(heavy)
+        await asyncio.gather(*waiting)
+        return order
+
+    assert run(scenario()) == ["checkout", "heavy"]
+
+
+def test_new_arrival_does_not_borrow_ahead_of_higher_priority_waiters():
+    async def scenario():
+        limits = admission.AdmissionController(2, [
+            admission.RouteClass("checkout", 0, limit=2, queue=5, timeout=5.0),
+            admission.RouteClass("heavy", 1, limit=2, queue=5, timeout=0.05),
+        ])
+        checkout, heavy = limits.classes["checkout"], limits.classes["heavy"]
+        assert await limits.acquire(heavy) is None
+        assert await limits.acquire(heavy) is None
+        waiting = asyncio.create_task(limits.acquire(checkout))
+        await asyncio.sleep(0)
+        # A shared slot frees up before anything dispatched it
+        heavy.active -= 1
+        # The queued checkout gets it; the new report has to wait its turn
+        retry_after = await limits.acquire(heavy)
+        return await waiting, retry_after, checkout.active, heavy.active
+
+    admitted, retry_after, checkout_active, heavy_active = run(scenario())
+    assert admitted is None and retry_after >= 1
+    assert (checkout_active, heavy_active) == (1, 1)
@@ -0,0 +1,122 @@
+"""Backup and restore round trips; MongoDB only, so these run when TEST_MONGO_URL is set."""
+import asyncio
+import os
+import uuid
+from datetime import datetime
+
+import pytest
+
+import backup
+import storage
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def _mongo_database():
+    url = os.environ.get("TEST_MONGO_URL")
+    if not url:
+        pytest.skip("TEST_MONGO_URL not set")
+    from motor.motor_asyncio import AsyncIOMotorClient
+    client = AsyncIOMotorClient(url, serverSelectionTimeoutMS=2000)
+    db = client[f"pos_test_{uuid.uuid4().hex[:8]}"]
+
+    async def cleanup():
+        await client.drop_database(db.name)
+        client.close()
+    return db, cleanup
+
+
+def make_sale(number, sale_date):
+    return {
+        "id": f"sale-{number}", "store_id": "main", "items": [], "total_amount": 10.0 * number,
+        "payment_method": "cash", "sale_date": sale_date, "receipt_number": f"RCP{number}"
+    }
+
+
+def test_restore_does_not_count_archived_sales_twice(tmp_path):
+    async def scenario():
+        db, cleanup = _mongo_database()
+        try:
+            await db.sales.insert_many([make_sale(number, f"2025-01-{number:02d}T10:00:00") for number in (1, 2)])
+            full = await backup.run_backup(db, backup_dir=tmp_path)
+
+            # The archive job moves January out of the hot tier after the full backup
+            january = await db.sales.find({}).to_list(None)
+            await db.sales_archive_2025_01.insert_many(january)
+            await db.sales.delete_many({})
+            await db.sales.insert_one(make_sale(3, datetime.utcnow().isoformat()))
+            incremental = await backup.run_backup(db, incremental=True, backup_dir=tmp_path)
+            assert incremental["base"] == full["id"]
+
+            result = await backup.run_restore(db, incremental["id"], drop=True, backup_dir=tmp_path)
+            assert result["applied"] == [full["id"], incremental["id"]]
+            assert result["archived_duplicates"] == 2
+            hot = sorted(sale["id"] for sale in await db.sales.find({}).to_list(None))
+            archived = sorted(sale["id"] for sale in await db.sales_archive_2025_01.find({}).to_list(None))
+            return hot, archived
+        finally:
+            await cleanup()
+
+    assert run(scenario()) == (["sale-3"], ["sale-1", "sale-2"])
+
+
+def test_restore_rebuilds_the_inventory_counters(tmp_path):
+    async def scenario():
+        db, cleanup = _mongo_database()
+        try:
+            await db.medicines.insert_many([{
+                "id": f"med-{number}", "store_id": "main", "name": f"Medicine {number}", "price": 2.0,
+                "supplier": "Acme", "expiry_date": "2027-01-01", "stock_quantity": 5 * number,
+                "batches": [{"batch_number": "B1", "expiry_date": "2027-01-01", "quantity": 5 * number}]
+            } for number in (1, 2)])
+            full = await backup.run_backup(db, backup_dir=tmp_path)
+            # Counters are not part of the backup; stale ones must not survive a restore
+            await db.inventory_counters.insert_one({
+                "store_id": "main", "supplier": "Gone", "expiry_date": "2026-01-01",
+                "skus": 9, "in_stock": 9, "units": 90, "value": 180.0
+            })
+            result = await backup.run_restore(db, full["id"], drop=True, backup_dir=tmp_path)
+            assert result["inventory_counters_rebuilt"] == 1
+            return await db.inventory_counters.find({}, {"_id": 0}).to_list(None)
+        finally:
+            await cleanup()
+
+    assert run(scenario()) == [{
+        "supplier": "Acme", "expiry_date": "2027-01-01", "skus": 2, "in_stock": 2, "units": 15, "value": 30.0,
+        "store_id": "main"
+    }]
+
+
+def test_incremental_restore_carries_a_posted_goods_receipt(tmp_path):
+    async def scenario():
+        db, cleanup = _mongo_database()
+        purchases = storage.MongoRepository(db).purchases
+        try:
+            created_at = datetime(2026, 3, 1, 9, 0)
+            await purchases.insert({
+                "id": "grn-1", "store_id": "main", "kind": "receipt", "supplier": "Acme", "status": "draft",
+                "created_at": created_at, "updated_at": created_at,
+                "lines": [{"quantity": 10, "unit_cost": 1.5}, {"quantity": 4, "unit_cost": 2.0}]
+            })
+            full = await backup.run_backup(db, backup_dir=tmp_path)
+            assert full["collections"]["purchases"]["documents"] == 1
+
+            # Posting changes neither created_at nor anything the full backup saw
+            await purchases.transition("main", "receipt", "grn-1", ("draft",), {"status": "posting"})
+            posted_at = datetime(2026, 3, 1, 10, 0)
+            await purchases.complete_receipt("main", "grn-1", posted_at)
+            incremental = await backup.run_backup(db, incremental=True, backup_dir=tmp_path)
+            assert incremental["collections"]["purchases"]["documents"] == 1
+            assert incremental["collections"]["supplier_totals"]["documents"] == 1
+
+            await backup.run_restore(db, incremental["id"], drop=True, backup_dir=tmp_path)
+            receipt = await purchases.get("main", "receipt", "grn-1")
+            return receipt["status"], receipt["posted_at"], await purchases.supplier_totals("main")
+        finally:
+            await cleanup()
+
+    assert run(scenario()) == ("posted", datetime(2026, 3, 1, 10, 0), [{
+        "supplier": "Acme", "receipts": 1, "units": 14, "cost": 23.0, "last_received_at": datetime(2026, 3, 1, 10, 0)
+    }])
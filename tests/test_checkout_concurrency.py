@@ -0,0 +1,217 @@
+"""Concurrent checkout benchmark and stock integrity gate.
+
+Fires bursts of concurrent POST /api/sales requests at a few hot medicines
+with limited stock, through the real ASGI app, at rising concurrency. Every
+level asserts that stock never goes negative and that the stock consumed
+equals the quantities of the sales that were recorded, then reports
+throughput and latency percentiles.
+
+Runs on SQLite always and on MongoDB when TEST_MONGO_URL is set. Optional
+gates: BENCH_MAX_P99_MS and BENCH_MIN_THROUGHPUT. BENCH_RESULTS names a JSON
+file to write the measurements to (for CI artifacts).
+"""
+import asyncio
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+import uuid
+
+import pytest
+
+os.environ.setdefault("STORAGE_BACKEND", "sqlite")
+os.environ.setdefault("SQLITE_PATH", os.path.join(tempfile.mkdtemp(), "pos.sqlite3"))
+os.environ["SCHEDULER_ENABLED"] = "false"
+
+import httpx  # noqa: E402
+import server  # noqa: E402
+import storage  # noqa: E402
+
+
+CONCURRENCY_LEVELS = [int(level) for level in os.environ.get("BENCH_CONCURRENCY", "1,8,32,64").split(",")]
+HOT_SKUS = 3
+STOCK_PER_SKU = 60
+# Enough demand that every level sells out and most late checkouts are refused
+CHECKOUTS_PER_LEVEL = 120
+
+_results = []
+
+
+def _percentile(values, percent):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))]
+
+
+async def _repository(backend, tmp_path):
+    if backend == "sqlite":
+        return storage.SQLiteRepository(str(tmp_path / "bench.sqlite3")), None
+    url = os.environ.get("TEST_MONGO_URL")
+    if not url:
+        pytest.skip("TEST_MONGO_URL not set")
+    from motor.motor_asyncio import AsyncIOMotorClient
+    client = AsyncIOMotorClient(url, serverSelectionTimeoutMS=2000)
+    db = client[f"pos_bench_{uuid.uuid4().hex[:8]}"]
+
+    async def cleanup():
+        await client.drop_database(db.name)
+        client.close()
+    return storage.MongoRepository(db), cleanup
+
+
+async def _run_level(client, store_id, concurrency, rng):
+    headers = {"X-Store-ID": store_id}
+    medicines = []
+    for index in range(HOT_SKUS):
+        response = await client.post("/api/medicines", headers=headers, json={
+            "name": f"Hot SKU {index}", "price": 10.0 + index, "stock_quantity": STOCK_PER_SKU,
+            "expiry_date": "2030-01-01", "batch_number": "BENCH", "supplier": "Bench"
+        })
+        assert response.status_code == 200, response.text
+        medicines.append(response.json())
+
+    carts = []
+    for _ in range(CHECKOUTS_PER_LEVEL):
+        picked = rng.sample(medicines, rng.randint(1, 2))
+        items = [{
+            "medicine_id": medicine["id"], "medicine_name": medicine["name"], "quantity": rng.randint(1, 3),
+            "price": medicine["price"], "total": 0
+        } for medicine in picked]
+        for item in items:
+            item["total"] = item["price"] * item["quantity"]
+        carts.append({
+            "items": items, "total_amount": sum(item["total"] for item in items),
+            "payment_method": "cash", "cashier_id": "bench"
+        })
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    statuses = []
+
+    async def checkout(cart):
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.post("/api/sales", headers=headers, json=cart)
+            latencies.append((time.perf_counter() - started) * 1000)
+            statuses.append(response.status_code)
+            return response
+
+    started = time.perf_counter()
+    responses = await asyncio.gather(*[checkout(cart) for cart in carts])
+    elapsed = time.perf_counter() - started
+
+    # Integrity: only clean rejections, never negative stock, and every unit
+    # that left the shelf belongs to exactly one recorded sale
+    assert set(statuses) <= {200, 400}, f"unexpected statuses {sorted(set(statuses))}"
+    sold = {medicine["id"]: 0 for medicine in medicines}
+    for response in responses:
+        if response.status_code == 200:
+            for item in response.json()["items"]:
+                sold[item["medicine_id"]] += item["quantity"]
+    recorded = {medicine["id"]: 0 for medicine in medicines}
+    for sale in await server.repo.sales.find(store_id, limit=CHECKOUTS_PER_LEVEL * 2):
+        for item in sale["items"]:
+            recorded[item["medicine_id"]] += item["quantity"]
+    for medicine in medicines:
+        stored = await server.repo.medicines.get(store_id, medicine["id"])
+        assert stored["stock_quantity"] >= 0
+        assert STOCK_PER_SKU - stored["stock_quantity"] == sold[medicine["id"]] == recorded[medicine["id"]]
+        # The catalog cache agrees with storage after the burst
+        assert server.catalog.get(store_id, medicine["id"])["stock_quantity"] == stored["stock_quantity"]
+    assert statuses.count(200) == len(await server.repo.sales.find(store_id, limit=CHECKOUTS_PER_LEVEL * 2))
+
+    return {
+        "concurrency": concurrency,
+        "requests": len(carts),
+        "succeeded": statuses.count(200),
+        "rejected": statuses.count(400),
+        "units_sold": sum(sold.values()),
+        "throughput_rps": round(len(carts) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies), 2),
+        "p95_ms": round(_percentile(latencies, 95), 2),
+        "p99_ms": round(_percentile(latencies, 99), 2),
+    }
+
+
+@pytest.mark.parametrize("backend", ["sqlite", "mongo"])
+def test_concurrent_checkouts_keep_stock_consistent(backend, tmp_path):
+    async def run():
+        repository, cleanup = await _repository(backend, tmp_path)
+        original_repo, original_catalog = server.repo, server.catalog
+        server.repo, server.catalog = repository, server.CatalogCache()
+        try:
+            await repository.initialize()
+            await server.catalog.load()
+            transport = httpx.ASGITransport(app=server.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                rng = random.Random(39)
+                levels = []
+                for concurrency in CONCURRENCY_LEVELS:
+                    # A fresh store per level keeps the stock arithmetic independent
+                    levels.append(await _run_level(client, f"bench-{concurrency}", concurrency, rng))
+                return levels
+        finally:
+            server.repo, server.catalog = original_repo, original_catalog
+            await repository.close()
+            if cleanup:
+                await cleanup()
+
+    levels = asyncio.run(run())
+    print(f"\ncheckout benchmark ({backend})")
+    print(f"{'conc':>5} {'ok':>4} {'rej':>4} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for level in levels:
+        print(f"{level['concurrency']:>5} {level['succeeded']:>4} {level['rejected']:>4} {level['throughput_rps']:>8}"
+              f" {level['p50_ms']:>8} {level['p95_ms']:>8} {level['p99_ms']:>8}")
+    _results.append({"backend": backend, "levels": levels})
+    if os.environ.get("BENCH_RESULTS"):
+        with open(os.environ["BENCH_RESULTS"], "w") as output:
+            json.dump(_results, output, indent=2)
+
+    max_p99 = os.environ.get("BENCH_MAX_P99_MS")
+    min_throughput = os.environ.get("BENCH_MIN_THROUGHPUT")
+    for level in levels:
+        if max_p99:
+            assert level["p99_ms"] <= float(max_p99), f"p99 {level['p99_ms']}ms at concurrency {level['concurrency']}"
+        if min_throughput:
+            assert level["throughput_rps"] >= float(min_throughput), \
+                f"{level['throughput_rps']} req/s at concurrency {level['concurrency']}"
+
+
+@pytest.mark.parametrize("backend", ["sqlite", "mongo"])
+def test_other_workers_pick_up_checkout_stock_on_their_next_sync(backend, tmp_path):
+    async def run():
+        repository, cleanup = await _repository(backend, tmp_path)
+        original_repo, original_catalog = server.repo, server.catalog
+        server.repo, server.catalog = repository, server.CatalogCache()
+        try:
+            await repository.initialize()
+            transport = httpx.ASGITransport(app=server.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                headers = {"X-Store-ID": "main"}
+                medicine = (await client.post("/api/medicines", headers=headers, json={
+                    "name": "Hot SKU", "price": 10.0, "stock_quantity": 5,
+                    "expiry_date": "2030-01-01", "batch_number": "BENCH", "supplier": "Bench"
+                })).json()
+                other = server.CatalogCache()
+                await other.load()
+                versions = await repository.medicines.versions()
+
+                response = await client.post("/api/sales", headers=headers, json={
+                    "items": [{"medicine_id": medicine["id"], "medicine_name": "Hot SKU", "quantity": 2,
+                               "price": 10.0, "total": 20.0}],
+                    "total_amount": 20.0, "payment_method": "cash", "cashier_id": "bench"
+                })
+                assert response.status_code == 200, response.text
+                # A checkout writes no catalog version; the next sync still sees its stock
+                assert await repository.medicines.versions() == versions
+                assert other.get("main", medicine["id"])["stock_quantity"] == 5
+                assert (await other.sync())["changed_stores"] == ["main"]
+                return other.get("main", medicine["id"])["stock_quantity"]
+        finally:
+            server.repo, server.catalog = original_repo, original_catalog
+            await repository.close()
+            if cleanup:
+                await cleanup()
+
+    assert asyncio.run(run()) == 3
@@ -0,0 +1,20 @@
+"""Receipt rendering."""
+from zoneinfo import ZoneInfo
+
+import reports
+
+
+def make_sale(sale_date):
+    return {
+        "receipt_number": "RCP1", "sale_date": sale_date, "payment_method": "cash", "total_amount": 112.0,
+        "items": [{"medicine_name": "Paracetamol 500mg", "quantity": 2, "price": 56.0, "total": 112.0}]
+    }
+
+
+def test_receipt_prints_the_sale_time_in_the_shop_timezone():
+    # 20:00 UTC is 01:30 the next morning in India
+    sale = make_sale("2026-05-04T20:00:00")
+    for fmt in ("text", "html"):
+        rendered = reports.render_receipt(sale, None, fmt, 0.12, ZoneInfo("Asia/Kolkata"))
+        assert "05-05-2026 01:30" in rendered
+    assert "04-05-2026 20:00" in reports.render_receipt(sale, None, "text", 0.12, ZoneInfo("UTC"))
@@ -0,0 +1,109 @@
+"""Cron parsing, next-run computation and slot leases.
+
+The lease tests need MongoDB and run when TEST_MONGO_URL points at a reachable server.
+"""
+import asyncio
+import os
+import uuid
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import pytest
+
+from scheduler import CronSchedule, Job, Scheduler
+
+
+async def noop():
+    return None
+
+
+def test_fields_parse_ranges_steps_and_lists():
+    schedule = CronSchedule("*/15 9-17/4 1,15 * 1-6")
+    assert schedule.minutes == {0, 15, 30, 45}
+    assert schedule.hours == {9, 13, 17}
+    assert schedule.days == {1, 15}
+    assert schedule.months == set(range(1, 13))
+    assert schedule.weekdays == {1, 2, 3, 4, 5, 6}
+    # 7 is Sunday too
+    assert CronSchedule("0 0 * * 5-7").weekdays == {5, 6, 0}
+
+
+@pytest.mark.parametrize("expression", ["* * * *", "60 * * * *", "* 24 * * *", "* * 0 * *", "5-1 * * * *"])
+def test_invalid_expressions_are_rejected(expression):
+    with pytest.raises(ValueError):
+        CronSchedule(expression)
+
+
+def test_next_after_steps_within_the_day():
+    schedule = CronSchedule("*/15 * * * *")
+    assert schedule.next_after(datetime(2026, 5, 4, 10, 7, 30)) == datetime(2026, 5, 4, 10, 15)
+    assert schedule.next_after(datetime(2026, 5, 4, 10, 45)) == datetime(2026, 5, 4, 11, 0)
+
+
+def test_next_after_rolls_over_months_and_years():
+    assert CronSchedule("30 2 * * *").next_after(datetime(2026, 1, 31, 3, 0)) == datetime(2026, 2, 1, 2, 30)
+    assert CronSchedule("0 0 1 * *").next_after(datetime(2026, 12, 15)) == datetime(2027, 1, 1)
+    assert CronSchedule("0 12 31 * *").next_after(datetime(2026, 4, 1)) == datetime(2026, 5, 31, 12, 0)
+    assert CronSchedule("0 0 29 2 *").next_after(datetime(2026, 3, 1)) == datetime(2028, 2, 29)
+
+
+def test_day_of_week_ranges_and_day_or_weekday():
+    # 2026-05-09 is a Saturday, 2026-05-10 a Sunday
+    weekdays = CronSchedule("0 3 * * 1-6")
+    assert weekdays.next_after(datetime(2026, 5, 9, 4, 0)) == datetime(2026, 5, 11, 3, 0)
+    assert CronSchedule("0 3 * * 0").next_after(datetime(2026, 5, 9, 4, 0)) == datetime(2026, 5, 10, 3, 0)
+    # Both restricted: either the day of month or the weekday matches
+    assert CronSchedule("0 0 20 * 0").next_after(datetime(2026, 5, 11)) == datetime(2026, 5, 17)
+
+
+def test_cron_jobs_fire_at_wall_clock_time_in_their_timezone():
+    job = Job("archive", noop, cron="30 2 * * *", timezone=ZoneInfo("Asia/Kolkata"))
+    # 02:30 IST is 21:00 UTC the previous evening
+    assert job.compute_next_run(datetime(2026, 5, 4, 12, 0)) == datetime(2026, 5, 4, 21, 0)
+    assert job.compute_next_run(datetime(2026, 5, 4, 21, 0)) == datetime(2026, 5, 5, 21, 0)
+    utc = Job("archive", noop, cron="30 2 * * *", timezone=ZoneInfo("UTC"))
+    assert utc.compute_next_run(datetime(2026, 5, 4, 12, 0)) == datetime(2026, 5, 5, 2, 30)
+    assert job.metrics()["timezone"] == "Asia/Kolkata"
+
+
+def _lease_collection():
+    url = os.environ.get("TEST_MONGO_URL")
+    if not url:
+        pytest.skip("TEST_MONGO_URL not set")
+    from motor.motor_asyncio import AsyncIOMotorClient
+    client = AsyncIOMotorClient(url, serverSelectionTimeoutMS=2000)
+    db = client[f"pos_test_{uuid.uuid4().hex[:8]}"]
+
+    async def cleanup():
+        await client.drop_database(db.name)
+        client.close()
+    return db.job_leases, cleanup
+
+
+def test_each_cron_slot_runs_on_one_worker_only():
+    async def scenario():
+        leases, cleanup = _lease_collection()
+        runs = []
+        try:
+            workers = [Scheduler(lease_collection=leases, timezone=ZoneInfo("UTC")) for _ in range(2)]
+            for number, worker in enumerate(workers):
+                async def backup(number=number):
+                    runs.append(number)
+                worker.add_job("full_backup", backup, cron="0 3 * * *", jitter=300)
+            slot = datetime(2026, 5, 4, 3, 0)
+            # The second worker's jittered start comes after the first finished the slot
+            statuses = [await worker._run(worker.jobs["full_backup"], slot) for worker in workers]
+            # The next night's slot is free again, for whichever worker gets there first
+            statuses.append(await workers[1]._run(workers[1].jobs["full_backup"], datetime(2026, 5, 5, 3, 0)))
+            return statuses, runs
+        finally:
+            await cleanup()
+
+    assert asyncio.run(scenario()) == (["completed", "skipped", "completed"], [0, 1])
+
+
+def test_next_slot_is_the_unjittered_fire_time():
+    job = Job("archive", noop, cron="30 2 * * *", jitter=600, timezone=ZoneInfo("UTC"))
+    next_run = job.compute_next_run(datetime(2026, 5, 4, 12, 0))
+    assert job.next_slot == datetime(2026, 5, 5, 2, 30)
+    assert job.next_slot <= next_run <= datetime(2026, 5, 5, 2, 40)
@@ -0,0 +1,146 @@
+"""Columnar sales snapshot: incremental export and vectorized queries."""
+import asyncio
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pytest
+
+import snapshot
+import storage
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+@pytest.fixture
+def repo(tmp_path):
+    repository = storage.SQLiteRepository(str(tmp_path / "pos.sqlite3"))
+    run(repository.initialize())
+    yield repository
+    run(repository.close())
+
+
+def make_sales(count, start=datetime(2026, 1, 1, 8, 0), store_id="main"):
+    medicines = [("med-a", "Paracetamol"), ("med-b", "Cetirizine"), ("med-c", "Amoxicillin")]
+    sales = []
+    for number in range(count):
+        lines = [medicines[number % 3]] + ([medicines[(number + 1) % 3]] if number % 4 == 0 else [])
+        items = [{
+            "medicine_id": medicine_id, "medicine_name": name, "quantity": 1 + number % 3,
+            "price": 2.5 * (index + 1), "total": 2.5 * (index + 1) * (1 + number % 3)
+        } for index, (medicine_id, name) in enumerate(lines)]
+        sales.append({
+            "id": f"sale-{number:05d}", "store_id": store_id, "items": items,
+            "total_amount": sum(item["total"] for item in items),
+            "payment_method": ["cash", "card", "upi"][number % 3 if number % 5 else 2],
+            "customer_name": None, "customer_phone": None, "cashier_id": f"cashier-{number % 2}",
+            "sale_date": (start + timedelta(hours=7 * number)).isoformat(), "receipt_number": f"RCP{number}"
+        })
+    return sales
+
+
+def expected(sales, key, keep=lambda sale, item: True):
+    groups = defaultdict(lambda: {"quantity": 0, "revenue": 0.0, "lines": 0, "transactions": set()})
+    for sale in sales:
+        for item in sale["items"]:
+            if keep(sale, item):
+                group = groups[key(sale, item)]
+                group["quantity"] += item["quantity"]
+                group["revenue"] += item["total"]
+                group["lines"] += 1
+                group["transactions"].add(sale["id"])
+    return {
+        name: (group["quantity"], round(group["revenue"], 2), group["lines"], len(group["transactions"]))
+        for name, group in groups.items()
+    }
+
+
+def measured(result, *fields):
+    return {
+        tuple(row[field] for field in fields) if len(fields) > 1 else row[fields[0]]:
+            (row["quantity"], row["revenue"], row["lines"], row["transactions"])
+        for row in result["results"]
+    }
+
+
+def test_refresh_appends_incrementally_and_queries_match_the_sales(repo, tmp_path):
+    sales = make_sales(300)
+    for sale in sales + make_sales(5, store_id="other"):
+        run(repo.sales.insert(sale))
+    current = snapshot.SalesSnapshot(tmp_path / "snapshot")
+
+    until = datetime.fromisoformat(sales[199]["sale_date"])
+    meta = run(snapshot.refresh(current, repo.sales, "main", until, batch_size=64))
+    assert (meta["sales"], meta["cursor"]) == (200, sales[199]["sale_date"])
+    meta = run(snapshot.refresh(current, repo.sales, "main", datetime(2030, 1, 1), batch_size=64))
+    assert meta["sales"] == 300
+    assert meta["rows"] == sum(len(sale["items"]) for sale in sales)
+    sold_at = current.columns(meta)["sold_at"]
+    assert isinstance(sold_at, np.memmap) and np.all(np.diff(sold_at) >= 0)
+
+    by_medicine = current.query(group_by=["medicine"])
+    assert measured(by_medicine, "medicine_id") == expected(sales, lambda sale, item: item["medicine_id"])
+    assert {row["medicine_name"] for row in by_medicine["results"]} == {"Paracetamol", "Cetirizine", "Amoxicillin"}
+    revenues = [row["revenue"] for row in by_medicine["results"]]
+    assert revenues == sorted(revenues, reverse=True)
+
+    start, end = date(2026, 1, 10), date(2026, 2, 5)
+    within = [sale for sale in sales if start <= datetime.fromisoformat(sale["sale_date"]).date() <= end]
+    daily_upi = current.query(start, end, group_by=["cashier"], bucket="day", filters={"payment_method": ["upi"]})
+    assert measured(daily_upi, "bucket", "cashier_id") == expected(
+        within, lambda sale, item: (sale["sale_date"][:10], sale["cashier_id"]),
+        lambda sale, item: sale["payment_method"] == "upi"
+    )
+    buckets = [row["bucket"] for row in daily_upi["results"]]
+    assert buckets == sorted(buckets)
+    assert daily_upi["rows_scanned"] == sum(len(sale["items"]) for sale in within)
+
+    weekly = current.query(bucket="week", filters={"medicine": ["med-b", "unknown"]})
+    monday = lambda sale: (lambda day: (day - timedelta(days=day.weekday())).isoformat())(  # noqa: E731
+        datetime.fromisoformat(sale["sale_date"]).date())
+    assert measured(weekly, "bucket") == expected(
+        sales, lambda sale, item: monday(sale), lambda sale, item: item["medicine_id"] == "med-b"
+    )
+    monthly = current.query(bucket="month")
+    assert measured(monthly, "bucket") == expected(sales, lambda sale, item: sale["sale_date"][:7])
+    assert current.query(filters={"cashier": ["nobody"]})["results"] == []
+
+
+def test_append_cuts_off_a_crashed_partial_write(tmp_path):
+    current = snapshot.SalesSnapshot(tmp_path / "snapshot")
+    first, second = make_sales(10), make_sales(10, start=datetime(2026, 6, 1))
+    meta = current.append(first, None, datetime.utcnow())
+    # A crash between writing the columns and meta.json leaves orphaned bytes behind
+    with open(tmp_path / "snapshot" / "quantity.col", "ab") as handle:
+        handle.write(b"\xff" * 6)
+    assert current.append(second, "stale cursor", datetime.utcnow()) is None
+    meta = current.append(second, meta["cursor"], datetime.utcnow())
+
+    quantity = current.columns(meta)["quantity"]
+    assert quantity.tolist() == [item["quantity"] for sale in first + second for item in sale["items"]]
+    assert current.query()["results"][0]["transactions"] == 20
+
+
+def test_refresh_keeps_sales_sharing_a_timestamp_together(repo, tmp_path):
+    sales = make_sales(12)
+    for sale in sales[3:9]:
+        sale["sale_date"] = sales[3]["sale_date"]
+    for sale in sales:
+        run(repo.sales.insert(sale))
+    current = snapshot.SalesSnapshot(tmp_path / "snapshot")
+    meta = run(snapshot.refresh(current, repo.sales, "main", datetime(2030, 1, 1), batch_size=4))
+    assert meta["sales"] == 12
+    assert current.query()["results"][0]["transactions"] == 12
+
+
+def test_refresh_can_stop_after_a_bounded_number_of_batches(repo, tmp_path):
+    sales = make_sales(20)
+    for sale in sales:
+        run(repo.sales.insert(sale))
+    current = snapshot.SalesSnapshot(tmp_path / "snapshot")
+    meta = run(snapshot.refresh(current, repo.sales, "main", datetime(2030, 1, 1), batch_size=8, max_batches=1))
+    assert (meta["sales"], meta["cursor"]) == (7, sales[6]["sale_date"])
+    meta = run(snapshot.refresh(current, repo.sales, "main", datetime(2030, 1, 1), batch_size=8))
+    assert meta["sales"] == 20
@@ -0,0 +1,519 @@
+"""Contract tests shared by every storage backend.
+
+SQLite always runs; MongoDB runs when TEST_MONGO_URL points at a reachable server.
+"""
+import asyncio
+import os
+import uuid
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import storage
+
+
+def _mongo_repository():
+    url = os.environ.get("TEST_MONGO_URL")
+    if not url:
+        pytest.skip("TEST_MONGO_URL not set")
+    from motor.motor_asyncio import AsyncIOMotorClient
+    client = AsyncIOMotorClient(url, serverSelectionTimeoutMS=2000)
+    db = client[f"pos_test_{uuid.uuid4().hex[:8]}"]
+
+    async def cleanup():
+        await client.drop_database(db.name)
+        client.close()
+    return storage.MongoRepository(db), cleanup
+
+
+@pytest.fixture(params=["sqlite", "mongo"])
+def repo(request, tmp_path):
+    if request.param == "sqlite":
+        repository = storage.SQLiteRepository(str(tmp_path / "pos.sqlite3"))
+        cleanup = None
+    else:
+        repository, cleanup = _mongo_repository()
+    asyncio.run(repository.initialize())
+    yield repository
+    asyncio.run(repository.close())
+    if cleanup:
+        asyncio.run(cleanup())
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def medicine(store_id="main", **overrides):
+    # BSON dates keep millisecond precision
+    now = datetime.utcnow()
+    now = now.replace(microsecond=now.microsecond // 1000 * 1000)
+    document = {
+        "id": str(uuid.uuid4()),
+        "store_id": store_id,
+        "name": "Paracetamol 500mg",
+        "price": 2.5,
+        "stock_quantity": 10,
+        "expiry_date": (date.today() + timedelta(days=365)).isoformat(),
+        "batch_number": "B1",
+        "supplier": "Acme",
+        "barcode": "890100",
+        "created_at": now,
+        "updated_at": now,
+    }
+    document.update(overrides)
+    return storage.with_batches(document)
+
+
+def sale(medicine_doc, quantity=1, store_id="main", sale_date=None, payment_method="cash", receipt="RCP1"):
+    total = medicine_doc["price"] * quantity
+    return {
+        "id": str(uuid.uuid4()),
+        "store_id": store_id,
+        "items": [{
+            "medicine_id": medicine_doc["id"], "medicine_name": medicine_doc["name"],
+            "quantity": quantity, "price": medicine_doc["price"], "total": total
+        }],
+        "total_amount": total,
+        "payment_method": payment_method,
+        "customer_name": None,
+        "customer_phone": None,
+        "cashier_id": "cashier",
+        "sale_date": (sale_date or datetime.utcnow()).isoformat(),
+        "receipt_number": receipt,
+    }
+
+
+def test_medicine_round_trip(repo):
+    document = medicine()
+    run(repo.medicines.insert(document))
+    stored = run(repo.medicines.get("main", document["id"]))
+    assert stored == document
+    assert isinstance(stored["updated_at"], datetime)
+    assert run(repo.medicines.get("other", document["id"])) is None
+
+
+def test_medicine_search_and_projection(repo):
+    run(repo.medicines.insert(medicine(name="Paracetamol 500mg", barcode="111")))
+    run(repo.medicines.insert(medicine(name="Cetirizine", barcode="222")))
+    run(repo.medicines.insert(medicine(store_id="other", name="Paracetamol 650mg")))
+
+    assert [m["name"] for m in run(repo.medicines.search("main", "PARA"))] == ["Paracetamol 500mg"]
+    assert [m["name"] for m in run(repo.medicines.search("main", "222"))] == ["Cetirizine"]
+    # LIKE wildcards in the search text are matched literally
+    assert run(repo.medicines.search("main", "%")) == []
+    trimmed = run(repo.medicines.search("main", fields=["id", "name"]))
+    assert len(trimmed) == 2 and all(set(m) == {"id", "name"} for m in trimmed)
+
+
+def test_medicine_update_and_delete(repo):
+    document = medicine()
+    run(repo.medicines.insert(document))
+    updated = run(repo.medicines.update("main", document["id"], {"price": 3.0}))
+    assert updated["price"] == 3.0 and updated["name"] == document["name"]
+    assert run(repo.medicines.update("main", "missing", {"price": 1.0})) is None
+    assert run(repo.medicines.delete("main", document["id"])) is True
+    assert run(repo.medicines.delete("main", document["id"])) is False
+
+
+def test_allocate_is_guarded(repo):
+    document = medicine(stock_quantity=3)
+    run(repo.medicines.insert(document))
+    allocated, taken = run(repo.medicines.allocate("main", document["id"], 2))
+    assert allocated["stock_quantity"] == 1
+    assert taken == [{"batch_number": "B1", "expiry_date": document["expiry_date"], "quantity": 2}]
+    assert run(repo.medicines.allocate("main", document["id"], 2)) is None
+    assert run(repo.medicines.release("main", document["id"], taken))["stock_quantity"] == 3
+    assert run(repo.medicines.allocate("main", "missing", 1)) is None
+    assert run(repo.medicines.release("main", "missing", taken)) is None
+
+
+def test_concurrent_allocations_never_oversell(repo):
+    document = medicine(stock_quantity=5)
+    run(repo.medicines.insert(document))
+
+    async def checkout_all():
+        return await asyncio.gather(*[repo.medicines.allocate("main", document["id"], 1) for _ in range(20)])
+    results = run(checkout_all())
+    assert sum(result is not None for result in results) == 5
+    assert run(repo.medicines.get("main", document["id"]))["stock_quantity"] == 0
+
+
+def test_allocation_is_earliest_expiry_first(repo):
+    soon, later, latest = ((date.today() + timedelta(days=days)).isoformat() for days in (30, 90, 400))
+    document = medicine(batches=[
+        {"batch_number": "L3", "expiry_date": latest, "quantity": 5},
+        {"batch_number": "L1", "expiry_date": soon, "quantity": 2},
+        {"batch_number": "L2", "expiry_date": later, "quantity": 3},
+    ])
+    assert (document["stock_quantity"], document["batch_number"]) == (10, "L1")
+    run(repo.medicines.insert(document))
+
+    medicine_doc, taken = run(repo.medicines.allocate("main", document["id"], 4))
+    assert taken == [
+        {"batch_number": "L1", "expiry_date": soon, "quantity": 2},
+        {"batch_number": "L2", "expiry_date": later, "quantity": 2},
+    ]
+    assert [batch["quantity"] for batch in medicine_doc["batches"]] == [0, 1, 5]
+    assert (medicine_doc["stock_quantity"], medicine_doc["batch_number"], medicine_doc["expiry_date"]) == (6, "L2", later)
+    assert run(repo.medicines.get("main", document["id"])) == medicine_doc
+
+    restored = run(repo.medicines.release("main", document["id"], taken))
+    assert [batch["quantity"] for batch in restored["batches"]] == [2, 3, 5]
+    assert restored["batch_number"] == "L1"
+
+    # A received lot joins in expiry order; a known batch number is topped up
+    received = run(repo.medicines.receive("main", document["id"], {
+        "batch_number": "L0", "expiry_date": (date.today() + timedelta(days=7)).isoformat(), "quantity": 4
+    }))
+    assert [batch["batch_number"] for batch in received["batches"]] == ["L0", "L1", "L2", "L3"]
+    assert (received["stock_quantity"], received["batch_number"]) == (14, "L0")
+    topped = run(repo.medicines.receive("main", document["id"], {"batch_number": "L3", "expiry_date": latest, "quantity": 1}))
+    assert topped["batches"][-1]["quantity"] == 6
+    with pytest.raises(ValueError):
+        run(repo.medicines.receive("main", document["id"], {"batch_number": "L3", "expiry_date": soon, "quantity": 1}))
+    assert run(repo.medicines.receive("main", "missing", {"batch_number": "X", "expiry_date": soon, "quantity": 1})) is None
+
+    # Bulk adjustments name no batch: removals go earliest expiry first, additions to the latest lot
+    result = run(repo.medicines.bulk_update("main", [{"id": document["id"], "stock_delta": -5}]))
+    assert [batch["quantity"] for batch in result["updated"][0]["batches"]] == [0, 1, 3, 6]
+    result = run(repo.medicines.bulk_update("main", [{"id": document["id"], "set": {"stock_quantity": 12}}]))
+    assert [batch["quantity"] for batch in result["updated"][0]["batches"]] == [0, 1, 3, 8]
+
+    counters = {(row["supplier"], row["expiry_date"]): row for row in run(repo.inventory.counters("main"))}
+    recomputed = {(row["supplier"], row["expiry_date"]): row for row in run(repo.inventory.recompute("main"))}
+    assert counters == recomputed
+    assert counters[("Acme", latest)]["units"] == 8 and counters[("Acme", later)]["skus"] == 0
+
+
+def test_allocation_skips_expired_batches(repo):
+    expired, today, later = ((date.today() + timedelta(days=days)).isoformat() for days in (-1, 0, 90))
+    document = medicine(batches=[
+        {"batch_number": "OLD", "expiry_date": expired, "quantity": 4},
+        {"batch_number": "NOW", "expiry_date": today, "quantity": 1},
+        {"batch_number": "NEW", "expiry_date": later, "quantity": 3},
+    ])
+    run(repo.medicines.insert(document))
+
+    # A lot expiring today still sells; yesterday's never does
+    medicine_doc, taken = run(repo.medicines.allocate("main", document["id"], 3))
+    assert taken == [
+        {"batch_number": "NOW", "expiry_date": today, "quantity": 1},
+        {"batch_number": "NEW", "expiry_date": later, "quantity": 2},
+    ]
+    assert [batch["quantity"] for batch in medicine_doc["batches"]] == [4, 0, 1]
+    assert medicine_doc["stock_quantity"] == 5
+    assert run(repo.medicines.get("main", document["id"])) == medicine_doc
+    # Five units are in stock but only one of them can be sold
+    assert run(repo.medicines.allocate("main", document["id"], 2)) is None
+    assert run(repo.medicines.get("main", document["id"]))["stock_quantity"] == 5
+
+
+def test_catalog_versions_and_deltas(repo):
+    old = medicine(updated_at=datetime.utcnow() - timedelta(hours=1))
+    run(repo.medicines.insert(old))
+    since = datetime.utcnow() - timedelta(minutes=1)
+    fresh = medicine()
+    run(repo.medicines.insert(fresh))
+    assert [m["id"] for m in run(repo.medicines.updated_since("main", since))] == [fresh["id"]]
+
+    assert run(repo.medicines.bump_version("main")) == {"store_id": "main", "version": 1, "deletes": 0}
+    assert run(repo.medicines.bump_version("main", deleted=True)) == {"store_id": "main", "version": 2, "deletes": 1}
+    assert run(repo.medicines.versions()) == [{"store_id": "main", "version": 2, "deletes": 1}]
+
+
+def test_sales_queries(repo):
+    first, second = medicine(), medicine(name="Cetirizine")
+    yesterday = datetime.utcnow() - timedelta(days=1)
+    older = sale(first, quantity=2, sale_date=yesterday, receipt="RCP1")
+    newer = sale(second, quantity=1, payment_method="upi", receipt="RCP2")
+    for document in (older, newer, sale(first, store_id="other")):
+        run(repo.sales.insert(document))
+
+    assert [s["id"] for s in run(repo.sales.find("main"))] == [newer["id"], older["id"]]
+    assert [s["id"] for s in run(repo.sales.find("main", medicine_id=first["id"]))] == [older["id"]]
+    assert [s["id"] for s in run(repo.sales.find("main", medicine_name="cetiri"))] == [newer["id"]]
+    assert [s["id"] for s in run(repo.sales.find("main", start_date=date.today()))] == [newer["id"]]
+    assert set(run(repo.sales.find("main", fields=["total_amount"]))[0]) == {"id", "total_amount"}
+    assert run(repo.sales.get("main", older["id"])) == older
+
+    assert run(repo.sales.totals("main")) == {"total_sales": 7.5, "total_transactions": 2}
+    totals = run(repo.sales.medicine_totals("main", first["id"]))
+    assert (totals["quantity_sold"], totals["revenue"], totals["transactions"]) == (2, 5.0, 1)
+    assert totals["first_sale"] == older["sale_date"]
+
+    summary = run(repo.sales.summary("main", date.today(), date.today()))
+    assert [(p["payment_method"], p["transactions"], p["first_receipt"]) for p in summary["payments"]] == \
+        [("upi", 1, "RCP2")]
+    assert [(i["medicine_id"], i["quantity"]) for i in summary["items"]] == [(second["id"], 1)]
+
+
+def test_summary_takes_exact_utc_bounds_for_a_local_business_day(repo):
+    first = medicine()
+    # The IST business day of 2026-05-04 is 2026-05-03T18:30 to 2026-05-04T18:30 UTC
+    start, end = datetime(2026, 5, 3, 18, 30), datetime(2026, 5, 4, 18, 29, 59, 999999)
+    inside = [sale(first, sale_date=datetime(2026, 5, 3, 20, 0), receipt="RCP1"),
+              sale(first, sale_date=datetime(2026, 5, 4, 18, 0), receipt="RCP2")]
+    outside = [sale(first, sale_date=datetime(2026, 5, 3, 18, 0), receipt="RCP0"),
+               sale(first, sale_date=datetime(2026, 5, 4, 18, 30), receipt="RCP3")]
+    for document in inside + outside:
+        run(repo.sales.insert(document))
+
+    summary = run(repo.sales.summary("main", start, end))
+    assert [(p["transactions"], p["first_receipt"], p["last_receipt"]) for p in summary["payments"]] == \
+        [(2, "RCP1", "RCP2")]
+
+
+def test_medicine_totals_count_only_that_medicines_lines(repo):
+    first, second = medicine(), medicine(name="Cetirizine")
+    mixed = sale(first, quantity=2)
+    mixed["items"].append({"medicine_id": second["id"], "medicine_name": second["name"], "quantity": 5,
+                           "price": second["price"], "total": second["price"] * 5})
+    for document in (mixed, sale(first, quantity=1, receipt="RCP2"), sale(second, quantity=3, receipt="RCP3")):
+        run(repo.sales.insert(document))
+
+    totals = run(repo.sales.medicine_totals("main", first["id"]))
+    assert (totals["quantity_sold"], totals["revenue"], totals["transactions"]) == (3, 7.5, 2)
+    totals = run(repo.sales.medicine_totals("main", second["id"]))
+    assert (totals["quantity_sold"], totals["revenue"], totals["transactions"]) == (8, 20.0, 2)
+
+
+def test_scan_returns_sales_oldest_first_within_the_cursor_range(repo):
+    first = medicine()
+    start = datetime(2026, 3, 1, 9, 0)
+    documents = [sale(first, sale_date=start + timedelta(minutes=minute)) for minute in range(5)]
+    for document in reversed(documents):
+        run(repo.sales.insert(document))
+    run(repo.sales.insert(sale(first, store_id="other", sale_date=start)))
+
+    scanned = run(repo.sales.scan("main", None, documents[3]["sale_date"]))
+    assert [s["id"] for s in scanned] == [d["id"] for d in documents[:4]]
+    assert set(scanned[0]) == set(storage.SCAN_FIELDS)
+    after_first = run(repo.sales.scan("main", documents[0]["sale_date"], documents[4]["sale_date"], limit=2))
+    assert [s["id"] for s in after_first] == [d["id"] for d in documents[1:3]]
+
+
+def test_users_and_shop(repo):
+    user = {"id": "u1", "store_id": "main", "username": "asha", "password_hash": "x", "role": "cashier",
+            "permissions": {}, "is_active": True, "created_at": datetime.utcnow().isoformat()}
+    run(repo.users.insert(user))
+    assert run(repo.users.list("main")) == [user]
+    assert run(repo.users.list("other")) == []
+
+    assert run(repo.shops.get("main")) is None
+    shop = {"id": "s1", "store_id": "main", "name": "City Pharmacy", "address": "1 Main St", "phone": "123",
+            "email": None, "license_number": "DL1", "gst_number": None, "updated_at": datetime.utcnow().isoformat()}
+    run(repo.shops.save(shop))
+    # Saving again keeps the original id
+    saved = run(repo.shops.save({**shop, "id": "s2", "name": "City Pharmacy & Co"}))
+    assert saved["id"] == "s1"
+    assert run(repo.shops.get("main"))["name"] == "City Pharmacy & Co"
+
+
+def test_customer_profile_and_history(repo):
+    first, second = medicine(), medicine(name="Cetirizine")
+    sales = []
+    for index, medicine_doc in enumerate([first, second, first]):
+        document = sale(medicine_doc, receipt=f"RCP{index}", sale_date=datetime.utcnow() + timedelta(seconds=index))
+        document.update(customer_phone="9876543210", customer_name="Ravi" if index < 2 else None)
+        run(repo.sales.insert(document))
+        profile = run(repo.customers.record_sale(document, recent_limit=2))
+        sales.append(document)
+
+    assert (profile["visits"], profile["lifetime_spend"], profile["name"]) == (3, 7.5, "Ravi")
+    assert profile["first_visit"] == sales[0]["sale_date"] and profile["last_visit"] == sales[2]["sale_date"]
+    assert [summary["sale_id"] for summary in profile["recent_sales"]] == [sales[2]["id"], sales[1]["id"]]
+    assert run(repo.customers.get("main", "9876543210")) == profile
+    assert run(repo.customers.get("other", "9876543210")) is None
+
+    history = run(repo.sales.find("main", customer_phone="9876543210"))
+    assert [document["id"] for document in history] == [document["id"] for document in reversed(sales)]
+
+
+def test_bulk_update(repo):
+    price_change, stock_take, adjustment, stale, oversold = [medicine(stock_quantity=10) for _ in range(5)]
+    for document in (price_change, stock_take, adjustment, stale, oversold):
+        run(repo.medicines.insert(document))
+    result = run(repo.medicines.bulk_update("main", [
+        {"id": price_change["id"], "set": {"price": 4.0, "expiry_date": "2030-01-01"},
+         "expected_updated_at": price_change["updated_at"]},
+        {"id": stock_take["id"], "set": {"stock_quantity": 7}},
+        {"id": adjustment["id"], "stock_delta": -4},
+        {"id": stale["id"], "set": {"price": 9.0}, "expected_updated_at": stale["updated_at"] - timedelta(seconds=1)},
+        {"id": oversold["id"], "stock_delta": -11},
+        {"id": "missing", "set": {"price": 1.0}},
+    ]))
+
+    updated = {document["id"]: document for document in result["updated"]}
+    assert (updated[price_change["id"]]["price"], updated[price_change["id"]]["expiry_date"]) == (4.0, "2030-01-01")
+    assert updated[stock_take["id"]]["stock_quantity"] == 7
+    assert updated[adjustment["id"]]["stock_quantity"] == 6
+    assert updated[adjustment["id"]]["updated_at"] > adjustment["updated_at"]
+    assert {(line["id"], line["reason"]) for line in result["rejected"]} == {
+        (stale["id"], "modified"), (oversold["id"], "insufficient_stock"), ("missing", "not_found")
+    }
+    assert run(repo.medicines.get("main", stale["id"]))["price"] == stale["price"]
+    assert run(repo.medicines.get("main", oversold["id"]))["stock_quantity"] == 10
+
+
+def test_bulk_update_counts_a_line_a_sale_touched_after_it_applied():
+    repository, cleanup = _mongo_repository()
+    document = medicine(stock_quantity=10)
+
+    async def scenario():
+        await repository.initialize()
+        await repository.medicines.insert(document)
+        medicines = repository.medicines
+        by_id, reads = medicines._by_id, []
+
+        async def sell_before_the_read_back(store_id, ids):
+            reads.append(ids)
+            if len(reads) == 2:
+                # A checkout rewrites updated_at between the write and the read-back
+                await asyncio.sleep(0.01)
+                await medicines.allocate("main", document["id"], 2)
+            return await by_id(store_id, ids)
+        medicines._by_id = sell_before_the_read_back
+        try:
+            result = await medicines.bulk_update("main", [{"id": document["id"], "stock_delta": 5}])
+        finally:
+            del medicines._by_id
+        stored = await repository.medicines.get("main", document["id"])
+        counters = await repository.inventory.counters("main")
+        return result, stored, counters, await repository.inventory.recompute("main")
+
+    try:
+        result, stored, counters, recomputed = run(scenario())
+    finally:
+        run(cleanup())
+    assert [line["id"] for line in result["updated"]] == [document["id"]] and result["rejected"] == []
+    assert stored["stock_quantity"] == 13
+    assert sorted(counters, key=str) == sorted(recomputed, key=str)
+
+
+def test_inventory_counters_follow_writes(repo):
+    def by_bucket(rows):
+        return {(row["supplier"], row["expiry_date"]): {field: row[field] for field in storage.COUNTER_FIELDS}
+                for row in rows}
+
+    acme, other, moved, removed = (
+        medicine(price=2.0, stock_quantity=10), medicine(price=5.0, stock_quantity=0, supplier="Zenith"),
+        medicine(price=3.0, stock_quantity=4), medicine(price=1.0, stock_quantity=6)
+    )
+    for document in (acme, other, moved, removed):
+        run(repo.medicines.insert(document))
+    run(repo.medicines.insert(medicine(store_id="other", stock_quantity=99)))
+    run(repo.medicines.allocate("main", acme["id"], 3))
+    run(repo.medicines.update("main", moved["id"], storage.with_batches(
+        {**moved, "batches": None, "expiry_date": "2020-01-01", "supplier": "Zenith"}
+    )))
+    run(repo.medicines.delete("main", removed["id"]))
+    run(repo.medicines.bulk_update("main", [
+        {"id": acme["id"], "set": {"price": 4.0}},
+        {"id": other["id"], "stock_delta": 2},
+        {"id": removed["id"], "stock_delta": 1},
+    ]))
+
+    counters = by_bucket(run(repo.inventory.counters("main")))
+    assert counters == {
+        ("Acme", acme["expiry_date"]): {"skus": 1, "in_stock": 1, "units": 7, "value": 28.0},
+        ("Zenith", other["expiry_date"]): {"skus": 1, "in_stock": 1, "units": 2, "value": 10.0},
+        ("Zenith", "2020-01-01"): {"skus": 1, "in_stock": 1, "units": 4, "value": 12.0},
+    }
+    assert by_bucket(run(repo.inventory.recompute("main"))) == counters
+
+    # Drifted counters are put right from the full recompute
+    run(repo.inventory.replace("main", []))
+    assert run(repo.inventory.counters("main")) == []
+    run(repo.inventory.replace("main", run(repo.inventory.recompute("main"))))
+    assert by_bucket(run(repo.inventory.counters("main"))) == counters
+    assert by_bucket(run(repo.inventory.counters("other")))[("Acme", acme["expiry_date"])]["units"] == 99
+
+
+def test_stock_in_adds_each_line_once(repo):
+    soon, later = ((date.today() + timedelta(days=days)).isoformat() for days in (60, 500))
+    stocked, emptied = medicine(stock_quantity=4), medicine(stock_quantity=2, batch_number="E1")
+    for document in (stocked, emptied):
+        run(repo.medicines.insert(document))
+    created = medicine(name="New Syrup", batches=[{"batch_number": "N1", "expiry_date": later, "quantity": 6}])
+    created["postings"] = ["grn-1/2"]
+    lines = [
+        {"medicine_id": stocked["id"], "batch_number": "B1", "expiry_date": stocked["expiry_date"], "quantity": 3,
+         "posting": "grn-1/0"},
+        {"medicine_id": stocked["id"], "batch_number": "B0", "expiry_date": soon, "quantity": 5, "posting": "grn-1/1"},
+        {"medicine_id": emptied["id"], "batch_number": "E2", "expiry_date": later, "quantity": 1, "posting": "grn-1/3"},
+    ]
+
+    async def post_during_sales():
+        # Stock-ins add to whatever the sales leave rather than overwriting it
+        return (await asyncio.gather(
+            repo.medicines.stock_in("main", [created], lines),
+            repo.medicines.allocate("main", stocked["id"], 1),
+            repo.medicines.allocate("main", emptied["id"], 2),
+        ))[0]
+    assert {document["id"] for document in run(post_during_sales())} == {stocked["id"], emptied["id"], created["id"]}
+    stored = {
+        document["id"]: run(repo.medicines.get("main", document["id"])) for document in (stocked, emptied, created)
+    }
+    assert stored[stocked["id"]]["stock_quantity"] == 4 + 3 + 5 - 1
+    assert [batch["batch_number"] for batch in stored[stocked["id"]]["batches"]] == ["B0", "B1"]
+    assert stored[stocked["id"]]["batch_number"] == "B0"
+    assert (stored[emptied["id"]]["stock_quantity"], stored[emptied["id"]]["batch_number"]) == (1, "E2")
+    assert stored[created["id"]]["stock_quantity"] == 6
+
+    # Posting the same lines again changes nothing
+    again = {document["id"]: document for document in run(repo.medicines.stock_in("main", [created], lines))}
+    assert again == stored
+
+    counters = {(row["supplier"], row["expiry_date"]): row for row in run(repo.inventory.counters("main"))}
+    recomputed = {(row["supplier"], row["expiry_date"]): row for row in run(repo.inventory.recompute("main"))}
+    assert counters == recomputed
+
+    # A conflicting or unknown line rejects the posting before anything is added
+    for bad in ({"medicine_id": stocked["id"], "batch_number": "B0", "expiry_date": later, "quantity": 1},
+                {"medicine_id": "missing", "batch_number": "X", "expiry_date": later, "quantity": 1}):
+        with pytest.raises(ValueError):
+            run(repo.medicines.stock_in("main", [], [
+                {"medicine_id": emptied["id"], "batch_number": "E3", "expiry_date": later, "quantity": 9,
+                 "posting": "grn-2/0"},
+                {**bad, "posting": "grn-2/1"},
+            ]))
+    assert run(repo.medicines.get("main", emptied["id"]))["stock_quantity"] == 1
+
+
+def test_purchases_and_supplier_totals(repo):
+    now = datetime.utcnow().replace(microsecond=0)
+    order = {"id": "po-1", "store_id": "main", "kind": "order", "supplier": "Acme", "status": "open",
+             "created_at": now, "lines": [{"medicine_name": "Paracetamol 500mg", "quantity": 10, "unit_cost": 1.5}]}
+    receipts = [
+        {"id": f"grn-{index}", "store_id": "main", "kind": "receipt", "supplier": "Acme", "status": "draft",
+         "created_at": now + timedelta(minutes=index),
+         "lines": [{"quantity": 10, "unit_cost": 1.5}, {"quantity": 4, "unit_cost": 2.0}]}
+        for index in range(2)
+    ]
+    for document in (order, *receipts):
+        run(repo.purchases.insert(document))
+
+    assert run(repo.purchases.get("main", "order", "po-1")) == order
+    assert run(repo.purchases.get("main", "receipt", "po-1")) is None
+    assert [r["id"] for r in run(repo.purchases.find("main", "receipt"))] == ["grn-1", "grn-0"]
+    assert run(repo.purchases.find("main", "receipt", supplier="Zenith")) == []
+
+    # Only a receipt in "posting" completes, and only once
+    assert run(repo.purchases.complete_receipt("main", "grn-0", now)) is None
+    assert run(repo.purchases.transition("main", "receipt", "grn-0", ("draft", "posting"), {"status": "posting"}))
+    posted = run(repo.purchases.complete_receipt("main", "grn-0", now))
+    assert (posted["status"], posted["posted_at"]) == ("posted", now)
+    assert run(repo.purchases.get("main", "receipt", "grn-0"))["updated_at"] >= now
+    assert run(repo.purchases.complete_receipt("main", "grn-0", now)) is None
+    assert run(repo.purchases.transition(
+        "main", "receipt", "grn-0", ("draft", "posting"), {"status": "posting"}
+    )) is None
+    assert [r["id"] for r in run(repo.purchases.find("main", "receipt", status="posted"))] == ["grn-0"]
+
+    run(repo.purchases.transition("main", "receipt", "grn-1", ("draft",), {"status": "posting"}))
+    run(repo.purchases.complete_receipt("main", "grn-1", now + timedelta(hours=1)))
+    assert run(repo.purchases.supplier_totals("main")) == [{
+        "supplier": "Acme", "receipts": 2, "units": 28, "cost": 46.0, "last_received_at": now + timedelta(hours=1)
+    }]
+    assert run(repo.purchases.supplier_totals("other")) == []